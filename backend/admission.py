@@ -0,0 +1,179 @@
+import os
+import math
+import time
+import asyncio
+import ipaddress
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from fastapi import HTTPException, Request
+
+from metrics import ADMISSION_WAIT
+
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", os.environ.get("LLM_POOL_SIZE", "16")))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "10"))
+RATE_LIMIT_SESSION_PER_MIN = float(os.environ.get("RATE_LIMIT_SESSION_PER_MIN", "20"))
+RATE_LIMIT_SESSION_BURST = float(os.environ.get("RATE_LIMIT_SESSION_BURST", "8"))
+RATE_LIMIT_IP_PER_MIN = float(os.environ.get("RATE_LIMIT_IP_PER_MIN", "60"))
+RATE_LIMIT_IP_BURST = float(os.environ.get("RATE_LIMIT_IP_BURST", "20"))
+# Comma-separated addresses/CIDRs of the proxies in front of us; X-Forwarded-For is only read from these
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False)
+                   for p in os.environ.get("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+
+def _trusted(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    """The caller's address: the peer, or the nearest hop it forwarded for if the peer is a trusted proxy."""
+    ip = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get("x-forwarded-for")
+    if not forwarded or not _trusted(ip):
+        return ip
+    # Walk back from our side; the first hop not added by a trusted proxy is the client
+    for hop in reversed([h.strip() for h in forwarded.split(",") if h.strip()]):
+        ip = hop
+        if not _trusted(hop):
+            break
+    return ip
+
+
+class TokenBucketLimiter:
+    """Token buckets per key, with the least recently seen keys dropped past max_keys."""
+
+    def __init__(self, per_minute: float, burst: float, max_keys: int = 10000):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()
+        self.rejected = 0
+
+    def take(self, key: str) -> float:
+        """Consume one token; returns 0 if allowed, else seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            wait = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            wait = (1 - tokens) / self.rate
+            self.rejected += 1
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class _Gate:
+    def __init__(self, max_concurrent: int):
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+
+
+def _overloaded(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=503, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class AdmissionController:
+    """Bounds in-flight model calls and rejects early when the backlog is full.
+
+    Each model gets `max_concurrent` slots and at most `max_queue` callers
+    waiting for one. A caller that would exceed the queue, or that waits past
+    `queue_timeout`, gets a 503 with Retry-After instead of hanging until the
+    provider times out.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._gates: Dict[str, _Gate] = {}
+        self.session_limiter = TokenBucketLimiter(RATE_LIMIT_SESSION_PER_MIN, RATE_LIMIT_SESSION_BURST)
+        self.ip_limiter = TokenBucketLimiter(RATE_LIMIT_IP_PER_MIN, RATE_LIMIT_IP_BURST)
+
+    def _gate(self, model: str) -> _Gate:
+        gate = self._gates.get(model)
+        if gate is None:
+            gate = self._gates[model] = _Gate(self.max_concurrent)
+        return gate
+
+    def ensure_capacity(self, model: str):
+        gate = self._gate(model)
+        if gate.active >= gate.max_concurrent and gate.waiting >= self.max_queue:
+            gate.shed += 1
+            raise _overloaded("Nudge is very busy right now, please try again in a moment", self.queue_timeout / 2)
+
+    def has_free_slot(self, model: str) -> bool:
+        gate = self._gate(model)
+        return gate.active < gate.max_concurrent and not gate.waiting
+
+    @asynccontextmanager
+    async def slot(self, model: str):
+        gate = self._gate(model)
+        self.ensure_capacity(model)
+        start = time.perf_counter()
+        gate.waiting += 1
+        try:
+            await asyncio.wait_for(gate.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            gate.timed_out += 1
+            raise _overloaded("Timed out waiting for the assistant, please try again", self.queue_timeout / 2)
+        finally:
+            gate.waiting -= 1
+            ADMISSION_WAIT.observe(time.perf_counter() - start, (model,))
+        gate.active += 1
+        gate.admitted += 1
+        try:
+            yield
+        finally:
+            gate.active -= 1
+            gate.slots.release()
+
+    def check_rate(self, request: Request, session_id: str = None):
+        """Raise 429 if this client IP or session is over its request budget."""
+        ip = client_ip(request)
+        wait = self.ip_limiter.take(ip)
+        if not wait and session_id:
+            wait = self.session_limiter.take(session_id)
+        if wait:
+            raise HTTPException(status_code=429, detail="Too many requests, please slow down a little",
+                                headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+    def snapshot(self) -> dict:
+        return {
+            "models": {
+                model: {
+                    "max_concurrent": gate.max_concurrent,
+                    "active": gate.active,
+                    "queue_depth": gate.waiting,
+                    "admitted": gate.admitted,
+                    "shed": gate.shed,
+                    "timed_out": gate.timed_out,
+                    "wait_seconds": ADMISSION_WAIT.snapshot((model,)),
+                }
+                for model, gate in self._gates.items()
+            },
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout,
+            "rate_limited": {
+                "session": self.session_limiter.rejected,
+                "ip": self.ip_limiter.rejected,
+            },
+        }
@@ -0,0 +1,72 @@
+import os
+import re
+from difflib import SequenceMatcher
+from typing import List
+
+# Zone names at least this similar (0-1, after normalising) are treated as one zone
+ZONE_NAME_SIMILARITY = float(os.environ.get("ZONE_NAME_SIMILARITY", "0.8"))
+# Words that say nothing about which part of the room a zone is
+_FILLER = {"a", "an", "the", "of", "area", "zone", "spot", "section", "space"}
+
+
+def _name_key(name: str) -> str:
+    words = []
+    for word in re.findall(r"[a-z0-9]+", name.lower()):
+        if word in _FILLER:
+            continue
+        # Crude singular, so "Shelves"/"Shelf" and "Books"/"Book" line up
+        if word.endswith("ves") and len(word) > 4:
+            word = word[:-3] + "f"
+        elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+            word = word[:-1]
+        words.append(word)
+    # Sorted so "Pile of clothes" and "Clothes pile" compare equal
+    return " ".join(sorted(words))
+
+
+def similar_names(a: str, b: str, threshold: float = ZONE_NAME_SIMILARITY) -> bool:
+    key_a, key_b = _name_key(a), _name_key(b)
+    if key_a == key_b:
+        return True
+    return SequenceMatcher(None, key_a, key_b).ratio() >= threshold
+
+
+def merge_zones(zones: List[dict], threshold: float = ZONE_NAME_SIMILARITY) -> List[dict]:
+    """Collapse zones seen in several photos into one, keeping the most urgent view of each."""
+    merged: List[dict] = []
+    for zone in zones:
+        for existing in merged:
+            if similar_names(existing.get("name", ""), zone.get("name", ""), threshold):
+                existing["priority"] = min(existing.get("priority", 1), zone.get("priority", 1))
+                # The same zone photographed twice, so the larger estimate rather than the sum
+                existing["estimated_minutes"] = max(existing.get("estimated_minutes", 0),
+                                                    zone.get("estimated_minutes", 0))
+                if len(zone.get("description", "")) > len(existing.get("description", "")):
+                    existing["description"] = zone["description"]
+                break
+        else:
+            merged.append(dict(zone))
+    return sorted(merged, key=lambda zone: zone.get("priority", 1))
+
+
+def merge_analyses(parts: List[dict], threshold: float = ZONE_NAME_SIMILARITY) -> dict:
+    """Combine per-photo (or per-tile) analyses of one room into a single analysis."""
+    if len(parts) == 1:
+        return parts[0]
+    difficulties = [part.get("difficulty", 3) for part in parts]
+    # The average, but one much messier corner still pulls the room up
+    difficulty = max(round(sum(difficulties) / len(difficulties)), max(difficulties) - 1)
+    # Start where it is easiest: the quick win from the least difficult photo
+    easiest = sorted((part for part in parts if part.get("quick_win")), key=lambda part: part.get("difficulty", 3))
+    overviews = []
+    for part in parts:
+        overview = part.get("overview", "")
+        if overview and overview not in overviews:
+            overviews.append(overview)
+    return {
+        "overview": " ".join(overviews),
+        "encouragement": next((part["encouragement"] for part in parts if part.get("encouragement")), ""),
+        "difficulty": min(5, max(1, difficulty)),
+        "quick_win": easiest[0]["quick_win"] if easiest else "",
+        "zones": merge_zones([zone for part in parts for zone in part.get("zones", [])], threshold),
+    }
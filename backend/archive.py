@@ -0,0 +1,216 @@
+import os
+import time
+import zlib
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+import bson
+from bson.binary import Binary
+
+from helpers import env_flag, utc_now
+from session_repo import SESSION_TTL_DAYS
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ENABLED = env_flag("ARCHIVE_ENABLED", "1")
+# Completed sessions are archived after this long untouched, any other session after the longer idle time
+ARCHIVE_COMPLETED_AFTER_HOURS = float(os.environ.get("ARCHIVE_COMPLETED_AFTER_HOURS", "24"))
+ARCHIVE_IDLE_AFTER_DAYS = float(os.environ.get("ARCHIVE_IDLE_AFTER_DAYS", "7"))
+ARCHIVE_INTERVAL_SECONDS = float(os.environ.get("ARCHIVE_INTERVAL_SECONDS", "600"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "50"))
+# Share of wall time a sweep may spend working; it sleeps the rest between batches
+ARCHIVE_DUTY_CYCLE = float(os.environ.get("ARCHIVE_DUTY_CYCLE", "0.1"))
+ARCHIVE_BUSY_PAUSE_SECONDS = float(os.environ.get("ARCHIVE_BUSY_PAUSE_SECONDS", "5"))
+ARCHIVE_ZSTD_LEVEL = int(os.environ.get("ARCHIVE_ZSTD_LEVEL", "10"))
+
+# The bulky fields, stored compressed; everything else stays a plain, queryable field
+PACKED_FIELDS = ("analysis", "tasks", "items")
+CODEC = "zstd" if zstandard is not None else "zlib"
+
+
+def pack(fields: dict) -> bytes:
+    data = bson.encode(fields)
+    if CODEC == "zstd":
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+    return zlib.compress(data, 9)
+
+
+def unpack(data: bytes, codec: str) -> dict:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Session was archived with zstd; install zstandard to read it")
+        return bson.decode(zstandard.ZstdDecompressor().decompress(data))
+    return bson.decode(zlib.decompress(data))
+
+
+def _as_date(value) -> datetime:
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return utc_now()
+    if not isinstance(value, datetime):
+        return utc_now()
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SessionArchive:
+    """Archived sessions: summary fields as-is, the bulky ones compressed into `packed`.
+
+    Counters such as completed_tasks and streak keep their names, so the
+    archive can be queried for stats like the live collection.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.stats = {"archived": 0, "restored": 0, "bytes_before": 0, "bytes_after": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("session_id", unique=True)
+        # Archived sessions expire like live ones, counted from their last use
+        if SESSION_TTL_DAYS > 0:
+            await self.collection.create_index("last_active", expireAfterSeconds=SESSION_TTL_DAYS * 86400)
+
+    async def put(self, session: dict, last_active: datetime):
+        packed = {f: session[f] for f in PACKED_FIELDS if f in session}
+        data = await asyncio.to_thread(pack, packed)
+        doc = {k: v for k, v in session.items() if k not in PACKED_FIELDS}
+        doc.update(packed=Binary(data), codec=CODEC, archived_at=utc_now(), last_active=last_active)
+        await self.collection.replace_one({"session_id": session["session_id"]}, doc, upsert=True)
+        self.stats["archived"] += 1
+        self.stats["bytes_before"] += len(bson.encode(packed))
+        self.stats["bytes_after"] += len(data)
+
+    async def get(self, session_id: str) -> Optional[dict]:
+        """The full session as it was archived, or None."""
+        doc = await self.collection.find_one({"session_id": session_id}, {"_id": 0})
+        if doc is None:
+            return None
+        packed = await asyncio.to_thread(unpack, doc.pop("packed"), doc.pop("codec"))
+        for field in ("archived_at", "last_active"):
+            doc.pop(field, None)
+        return {**doc, **packed}
+
+    async def contains(self, session_id: str) -> bool:
+        return await self.collection.find_one({"session_id": session_id}, {"_id": 1}) is not None
+
+    async def delete(self, session_id: str, revision: Optional[int] = None):
+        query = {"session_id": session_id}
+        if revision is not None:
+            query["revision"] = revision
+        await self.collection.delete_one(query)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "codec": CODEC}
+
+
+class Archiver:
+    """Background sweeps that move completed and idle sessions into the archive.
+
+    Work is done in small batches. After each batch the sweep sleeps long
+    enough to keep its share of time under `duty_cycle`, and it waits while
+    `busy()` says the worker is serving traffic. Every step is safe to repeat,
+    so several workers may sweep at once: a session is only removed if its
+    revision is still the one archived, and reads of an archived session
+    restore it (see SessionRepository.restore).
+    """
+
+    def __init__(self, repo, archive: SessionArchive, busy: Optional[Callable[[], bool]] = None,
+                 batch_size: int = ARCHIVE_BATCH_SIZE, duty_cycle: float = ARCHIVE_DUTY_CYCLE,
+                 interval: float = ARCHIVE_INTERVAL_SECONDS):
+        self.repo = repo
+        self.archive = archive
+        self.busy = busy or (lambda: False)
+        self.batch_size = batch_size
+        self.duty_cycle = duty_cycle
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"sweeps": 0, "batches": 0, "changed_while_archiving": 0, "busy_pauses": 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Session archive sweep failed")
+            await asyncio.sleep(self.interval)
+
+    def candidates_query(self, now: datetime) -> dict:
+        completed_before = now - timedelta(hours=ARCHIVE_COMPLETED_AFTER_HOURS)
+        idle_before = now - timedelta(days=ARCHIVE_IDLE_AFTER_DAYS)
+        # Sessions from before last_active was stamped go by when they were created. Legacy
+        # created_at values are isoformat strings, which never compare less than a date in
+        # BSON, so those are compared as strings (UTC isoformat sorts chronologically).
+        unstamped = {"last_active": {"$exists": False}}
+        created = [
+            {"status": "completed", "created_at": {"$lt": completed_before}},
+            {"status": "completed", "created_at": {"$type": "string", "$lt": completed_before.isoformat()}},
+            {"created_at": {"$lt": idle_before}},
+            {"created_at": {"$type": "string", "$lt": idle_before.isoformat()}},
+        ]
+        return {"$or": [
+            {"status": "completed", "last_active": {"$lt": completed_before}},
+            {"last_active": {"$lt": idle_before}},
+            *({**unstamped, **clause} for clause in created),
+        ]}
+
+    async def sweep(self, limit: Optional[int] = None) -> int:
+        """Archive every session due now (at most `limit`); returns how many were archived."""
+        self.stats["sweeps"] += 1
+        archived = 0
+        while limit is None or archived < limit:
+            while self.busy():
+                self.stats["busy_pauses"] += 1
+                await asyncio.sleep(ARCHIVE_BUSY_PAUSE_SECONDS)
+            started = time.perf_counter()
+            size = self.batch_size if limit is None else min(self.batch_size, limit - archived)
+            batch = await self.repo.collection.find(
+                self.candidates_query(utc_now()),
+                {"_id": 0, "session_id": 1, "revision": 1, "last_active": 1, "created_at": 1},
+            ).limit(size).to_list(length=size)
+            if not batch:
+                break
+            for doc in batch:
+                archived += await self.archive_one(doc)
+            self.stats["batches"] += 1
+            if len(batch) < size:
+                break
+            elapsed = time.perf_counter() - started
+            await asyncio.sleep(elapsed * (1 - self.duty_cycle) / self.duty_cycle)
+        return archived
+
+    async def archive_one(self, head: dict) -> int:
+        # Never via a restore: a session another sweeper just archived must stay archived
+        session = await self.repo.load(head["session_id"], restore=False)
+        if session is None or session.get("revision", 0) != head.get("revision", 0):
+            return 0
+        # The archive's TTL index only expires real dates, so legacy isoformat strings are parsed
+        await self.archive.put(session, _as_date(head.get("last_active") or head.get("created_at")))
+        if await self.repo.remove(session["session_id"], session.get("revision", 0)):
+            return 1
+        # Written to since it was read: keep it live and drop the copy
+        self.stats["changed_while_archiving"] += 1
+        await self.archive.delete(session["session_id"], session.get("revision", 0))
+        return 0
+
+    def snapshot(self) -> dict:
+        return {**self.stats, **self.archive.snapshot()}
@@ -0,0 +1,89 @@
+"""Compare payload size and end-to-end latency with and without image preprocessing.
+
+The upstream model call is simulated as base64 payload upload over a link of
+--uplink-mbps plus a fixed --model-latency, since that is the part the
+pipeline changes. Run from backend/:
+
+    python benchmarks/bench_image_pipeline.py --width 4032 --height 3024
+"""
+import os
+import io
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from image_pipeline import preprocess_image  # noqa: E402
+
+
+def make_photo(width: int, height: int, seed: int = 7) -> bytes:
+    rng = random.Random(seed)
+    img = Image.effect_noise((width, height), 48).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(40, width // 4), rng.randrange(40, height // 4)
+        draw.rectangle((x, y, x + w, y + h), fill=tuple(rng.randrange(256) for _ in range(3)))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 CW, as phones usually write it
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=92, exif=exif)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--max-edge", type=int, default=1568)
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "WEBP"])
+    parser.add_argument("--quality", type=int, default=82)
+    parser.add_argument("--uplink-mbps", type=float, default=20.0)
+    parser.add_argument("--model-latency", type=float, default=4.0)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    original = make_photo(args.width, args.height)
+    original_b64 = len(base64.b64encode(original))
+
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        processed = preprocess_image(original, args.max_edge, args.format, args.quality)
+        timings.append(time.perf_counter() - start)
+    processed_b64 = len(base64.b64encode(processed))
+    with Image.open(io.BytesIO(processed)) as img:
+        out_size = img.size
+
+    bytes_per_sec = args.uplink_mbps * 1_000_000 / 8
+    before = original_b64 / bytes_per_sec + args.model_latency
+    prep = statistics.median(timings)
+    after = prep + processed_b64 / bytes_per_sec + args.model_latency
+
+    result = {
+        "input": f"{args.width}x{args.height}",
+        "output": f"{out_size[0]}x{out_size[1]}",
+        "payload_before_bytes": original_b64,
+        "payload_after_bytes": processed_b64,
+        "payload_ratio": round(processed_b64 / original_b64, 4),
+        "preprocess_median_ms": round(prep * 1000, 1),
+        "e2e_before_s": round(before, 3),
+        "e2e_after_s": round(after, 3),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:24} {value}")
+
+
+if __name__ == "__main__":
+    main()
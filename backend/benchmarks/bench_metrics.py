@@ -0,0 +1,90 @@
+"""Measure what the metrics instrumentation costs on the hot path.
+
+Times the individual recording primitives, then a trivial ASGI request
+with and without MetricsMiddleware, and how long a scrape takes to render.
+Run from backend/:
+
+    python benchmarks/bench_metrics.py --iterations 200000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import Registry, MetricsMiddleware, phase  # noqa: E402
+
+
+def per_call_ns(fn, iterations: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter_ns() - start) / iterations
+
+
+async def bare_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def request_ns(app, iterations: int) -> float:
+    scope = {"type": "http", "method": "GET", "path": "/api/health"}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter_ns() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--series", type=int, default=300, help="label sets rendered in the scrape test")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    n = args.iterations
+
+    registry = Registry()
+    counter = registry.counter("bench_total", "x", ("route",))
+    histogram = registry.histogram("bench_seconds", "x", ("route",))
+
+    def timed_phase():
+        with phase("bench"):
+            pass
+
+    for i in range(args.series):
+        histogram.observe(0.01 * (i % 50), (f"/route/{i}",))
+    render_start = time.perf_counter()
+    body = registry.render()
+    render_ms = (time.perf_counter() - render_start) * 1000
+
+    bare = asyncio.run(request_ns(bare_app, n))
+    wrapped = asyncio.run(request_ns(MetricsMiddleware(bare_app), n))
+    result = {
+        "counter_inc_ns": round(per_call_ns(lambda: counter.inc(("/a",)), n)),
+        "histogram_observe_ns": round(per_call_ns(lambda: histogram.observe(0.042, ("/a",)), n)),
+        "phase_ns": round(per_call_ns(timed_phase, n)),
+        "request_bare_ns": round(bare),
+        "request_with_middleware_ns": round(wrapped),
+        "middleware_overhead_ns": round(wrapped - bare),
+        "render_ms": round(render_ms, 2),
+        "render_bytes": len(body),
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:28} {value}")
+
+
+if __name__ == "__main__":
+    main()
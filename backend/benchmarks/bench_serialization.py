@@ -0,0 +1,119 @@
+"""Compare session response serialization: jsonable_encoder + json vs response model + orjson.
+
+"before" is what FastAPI did for an untyped route returning a Mongo dict
+(jsonable_encoder, then JSONResponse.render). "after" is the typed route:
+validate into the Session response model, dump in JSON mode with
+exclude_unset, then ORJSONResponse.render. Run from backend/:
+
+    python benchmarks/bench_serialization.py --seconds 1
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+# name -> (tasks, items, zones)
+SIZES = {
+    "small": (5, 0, 2),
+    "medium": (15, 25, 4),
+    "large": (40, 150, 8),
+}
+
+
+def make_session(tasks: int, items: int, zones: int) -> dict:
+    now = datetime.now(timezone.utc)
+    text = "Clear the surface, group similar things together and put back only what belongs here. " * 2
+    return {
+        "session_id": "0" * 32,
+        "revision": 42,
+        "name": "Living room",
+        "status": "in_progress",
+        "analysis": {
+            "overview": text * 3,
+            "encouragement": "You've got this!",
+            "difficulty": 3,
+            "quick_win": text,
+            "zones": [{"name": f"Zone {z}", "description": text, "priority": z % 3 + 1, "estimated_minutes": 15}
+                      for z in range(zones)],
+        },
+        "tasks": [{"task_id": f"task-{i}", "title": f"Task {i}", "description": text, "estimated_minutes": 5,
+                   "category": "pickup", "encouragement": "Nice!", "completed": i % 2 == 0} for i in range(tasks)],
+        "items": [{"item_id": f"item-{i}", "name": f"Item {i}", "description": text, "category": "misc",
+                   "suggestion": "donate", "reason": text, "decision": None} for i in range(items)],
+        "completed_tasks": tasks // 2,
+        "total_tasks": tasks,
+        "streak": tasks // 2,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def before(doc: dict) -> bytes:
+    return JSONResponse(jsonable_encoder(doc)).body
+
+
+def make_after():
+    # Imported lazily: server builds its app and clients at import time
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "bench")
+    from server import Session
+    adapter = TypeAdapter(Session)
+
+    def after(doc: dict) -> bytes:
+        model = adapter.validate_python(doc)
+        return ORJSONResponse(adapter.dump_python(model, mode="json", exclude_unset=True)).body
+    return after
+
+
+def throughput(fn, doc: dict, seconds: float) -> float:
+    fn(doc)
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        fn(doc)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=1.0, help="time spent per size and path")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    after = make_after()
+    results = []
+    for name, shape in SIZES.items():
+        doc = make_session(*shape)
+        # Same payload apart from how the UTC offset is spelled on the timestamps
+        old_body, new_body = json.loads(before(doc)), json.loads(after(doc))
+        assert {k: v for k, v in old_body.items() if not k.endswith("_at")} == \
+            {k: v for k, v in new_body.items() if not k.endswith("_at")}
+        old = throughput(before, doc, args.seconds)
+        new = throughput(after, doc, args.seconds)
+        results.append({
+            "size": name,
+            "bytes": len(after(doc)),
+            "before_per_s": round(old),
+            "after_per_s": round(new),
+            "speedup": round(new / old, 2),
+        })
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'size':8} {'bytes':>8} {'before/s':>10} {'after/s':>10} {'speedup':>8}")
+    for r in results:
+        print(f"{r['size']:8} {r['bytes']:>8} {r['before_per_s']:>10} {r['after_per_s']:>10} {r['speedup']:>7}x")
+
+
+if __name__ == "__main__":
+    main()
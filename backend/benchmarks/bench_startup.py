@@ -0,0 +1,139 @@
+"""Measure cold start: importing server, running its startup, and the first response.
+
+Each run is a fresh interpreter, so module caches from earlier runs don't
+hide import cost. Reported per run (medians over --runs):
+
+  import_ms          `import server`
+  startup_ms         the lifespan startup (MongoDB setup, indexes, workers)
+  first_response_ms  GET /api/health once started
+  ready_ms           all three: how long a new worker takes to serve
+  sdk_import_ms      importing the LLM SDK, which happens after ready_ms
+
+It also checks that importing server leaves the LLM SDK unimported. Runs
+against mongomock-motor unless --mongo-url is given. Run from backend/:
+
+    python benchmarks/bench_startup.py --out startup.json
+    python benchmarks/bench_startup.py --compare startup.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMINGS = ("import_ms", "startup_ms", "first_response_ms", "ready_ms", "sdk_import_ms")
+SDK_MODULE = "emergentintegrations.llm.chat"
+
+
+async def probe(mongo_url):
+    """One cold start, in this (fresh) process."""
+    sys.path.insert(0, BACKEND)
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+    else:
+        from load_test import use_mongomock
+        use_mongomock()
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "nudge_startup")
+    # Timed separately below instead of overlapping the startup
+    os.environ["LLM_PREWARM"] = "0"
+    import httpx
+
+    start = time.perf_counter()
+    import server
+    imported = time.perf_counter()
+    sdk_on_import = SDK_MODULE in sys.modules
+    async with server.lifespan(server.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            status = (await client.get("/api/health")).status_code
+        responded = time.perf_counter()
+        sdk_start = time.perf_counter()
+        await server.app.state.services.llm.ready()
+        sdk_ms = (time.perf_counter() - sdk_start) * 1000
+    return {
+        "import_ms": (imported - start) * 1000,
+        "startup_ms": (started - imported) * 1000,
+        "first_response_ms": (responded - started) * 1000,
+        "ready_ms": (responded - start) * 1000,
+        "sdk_import_ms": sdk_ms,
+        "health_status": status,
+        "sdk_imported_by_server": sdk_on_import,
+    }
+
+
+def run_probe(mongo_url) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "--probe"]
+    if mongo_url:
+        command += ["--mongo-url", mongo_url]
+    out = subprocess.run(command, cwd=BACKEND, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def summarize(runs) -> dict:
+    result = {key: round(statistics.median(run[key] for run in runs), 1) for key in TIMINGS}
+    result["runs"] = len(runs)
+    result["health_status"] = runs[-1]["health_status"]
+    result["sdk_imported_by_server"] = any(run["sdk_imported_by_server"] for run in runs)
+    return result
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> bool:
+    """Print changes; True if import or time-to-ready regressed past threshold, or the SDK is imported eagerly again."""
+    regressed = result["sdk_imported_by_server"] and not baseline.get("sdk_imported_by_server")
+    print(f"\n{'':18} {'before':>9} {'after':>9} {'change':>8}")
+    for key in TIMINGS:
+        then, now = baseline.get(key), result[key]
+        if not then:
+            continue
+        change = (now - then) / then
+        worse = key in ("import_ms", "ready_ms") and change > threshold
+        regressed |= worse
+        print(f"{key:18} {then:>9} {now:>9} {change:>+7.0%}{'!' if worse else ''}")
+    if result["sdk_imported_by_server"]:
+        print("importing server also imported the LLM SDK")
+    return regressed
+
+
+def print_report(result: dict):
+    print(f"cold start, median of {result['runs']} runs (health {result['health_status']})")
+    for key in TIMINGS:
+        print(f"  {key:18} {result[key]:>9}")
+    print(f"  LLM SDK imported with server: {'yes' if result['sdk_imported_by_server'] else 'no'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo-url", help="start against this MongoDB instead of mongomock")
+    parser.add_argument("--out", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="diff against a saved baseline; exits 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="increase counted as a regression")
+    parser.add_argument("--probe", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if args.probe:
+        print(json.dumps(asyncio.run(probe(args.mongo_url))))
+        return
+    result = summarize([run_probe(args.mongo_url) for _ in range(args.runs)])
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(result, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""Drive concurrent session flows against the app with a fake LLM and report latency.
+
+The app runs in-process behind httpx's ASGI transport, against a real
+MongoDB (--mongo-url, a throwaway database is created and dropped) or
+mongomock-motor (the default; in requirements.txt). Model calls go to a
+fake chat with configurable latency and error rate, so results show our own
+overhead and queueing rather than the provider's; the LLM SDK need not be
+installed.
+
+Each virtual user runs: create -> analyze -> generate -> toggle every task
+-> identify -> sort every item. Run from backend/:
+
+    python benchmarks/load_test.py --sessions 200 --concurrency 20 --out baseline.json
+    python benchmarks/load_test.py --sessions 200 --concurrency 20 --compare baseline.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import itertools
+import threading
+import contextvars
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from PIL import Image  # noqa: E402
+
+# Which endpoint the current request belongs to, for attributing Mongo ops
+current_endpoint = contextvars.ContextVar("current_endpoint", default=None)
+
+
+# --- Fake LLM ---
+class FakeProviderError(Exception):
+    """Looks like a provider 503, so the resilience layer retries it."""
+    status_code = 503
+
+
+class FakeChat:
+    def __init__(self, purpose: str, latency: float, jitter: float, error_rate: float, tasks: int, items: int):
+        self.purpose = purpose
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.tasks = tasks
+        self.items = items
+
+    def reply(self) -> str:
+        if self.purpose == "analyze":
+            return json.dumps({
+                "overview": "A lived-in room with a few clear hotspots.",
+                "encouragement": "You can do this one small step at a time.",
+                "difficulty": 3,
+                "quick_win": "Clear the coffee table",
+                "zones": [{"name": f"Zone {i}", "description": "Mixed items", "priority": i + 1,
+                           "estimated_minutes": 10} for i in range(3)],
+            })
+        if self.purpose == "items":
+            return json.dumps([{"name": f"Item {i}", "description": "Something", "category": "misc",
+                                "suggestion": "donate", "reason": "Unused"} for i in range(self.items)])
+        return json.dumps([{"title": f"Task {i}", "description": "Pick up", "estimated_minutes": 5,
+                            "category": "pickup", "encouragement": "Nice!"} for i in range(self.tasks)])
+
+    async def send_message(self, message) -> str:
+        delay = max(0.0, random.gauss(self.latency, self.latency * self.jitter)) if self.latency else 0.0
+        await asyncio.sleep(delay)
+        if random.random() < self.error_rate:
+            raise FakeProviderError("fake provider overloaded")
+        return self.reply()
+
+
+class FakeMessage:
+    def __init__(self, text: str, image_base64=None):
+        self.text = text
+        self.image_base64 = image_base64
+
+
+def use_fake_llm(llm, args):
+    """Route the client's model calls to FakeChat; the LLM SDK is never imported."""
+    async def ready():
+        pass
+
+    llm.ready = ready
+    llm._message = lambda purpose, image_base64, params: FakeMessage(llm.prompts[purpose].render(**params),
+                                                                     image_base64)
+    llm._chat = lambda purpose, target: FakeChat(purpose, args.llm_latency, args.llm_jitter, args.llm_error_rate,
+                                                 args.tasks, args.items)
+
+
+# --- Mongo ---
+def use_mongomock():
+    try:
+        import mongomock.collection as mongomock_collection
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo-url")
+    import motor.motor_asyncio
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+    # mongomock drops the positional ($) match when _id is projected away in
+    # find_one_and_update, and rejects the `sort` argument newer pymongo passes
+    # to bulk updates and replaces; emulate the server so the flows behave as in prod.
+    original_find_and_modify = mongomock_collection.Collection._find_and_modify
+
+    def find_and_modify(self, query, projection=None, update=None, upsert=False, sort=None,
+                        return_document=False, session=None, **kwargs):
+        if kwargs.get("remove") or upsert or not return_document:
+            return original_find_and_modify(self, query, projection, update, upsert, sort, return_document,
+                                            session, **kwargs)
+        old = self.find_one(query, sort=sort)
+        if old is None:
+            return None
+        self._update(query, update, False)
+        return self.find_one({"_id": old["_id"]}, projection)
+
+    mongomock_collection.Collection._find_and_modify = find_and_modify
+    add_update = mongomock_collection.BulkOperationBuilder.add_update
+    mongomock_collection.BulkOperationBuilder.add_update = (
+        lambda self, selector, doc, multi=False, upsert=False, collation=None, array_filters=None, hint=None,
+        sort=None: add_update(self, selector, doc, multi, upsert, collation, array_filters, hint))
+    add_replace = mongomock_collection.BulkOperationBuilder.add_replace
+    mongomock_collection.BulkOperationBuilder.add_replace = (
+        lambda self, selector, doc, upsert, collation=None, hint=None, sort=None:
+        add_replace(self, selector, doc, upsert, collation, hint))
+    monitor_mongomock()
+
+
+# The command each mongomock_motor call stands for, as a driver would send it
+MOCK_COMMANDS = {
+    "find_one": "find", "count_documents": "aggregate", "insert_one": "insert", "insert_many": "insert",
+    "update_one": "update", "update_many": "update", "replace_one": "update", "bulk_write": "update",
+    "delete_one": "delete", "delete_many": "delete", "find_one_and_update": "findAndModify",
+    "find_one_and_replace": "findAndModify", "find_one_and_delete": "findAndModify",
+    "create_index": "createIndexes", "drop": "drop",
+}
+
+
+class MockCommandEvent:
+    """The parts of a pymongo command event that listeners read."""
+    request_ids = itertools.count()
+
+    def __init__(self, command_name: str, collection: str):
+        self.command_name = command_name
+        self.command = {command_name: collection}
+        self.connection_id = ("mongomock", 0)
+        self.request_id = next(self.request_ids)
+        self.duration_micros = 0
+
+
+def monitor_mongomock():
+    """Give mongomock_motor command monitoring: calls reach the client's event_listeners as commands."""
+    import types
+    import mongomock_motor
+
+    def publish(collection, command_name):
+        # Listeners are kept on the underlying mongomock client; `collection` is a mongomock Collection
+        listeners = getattr(collection.database.client, "event_listeners", ())
+        event = MockCommandEvent(command_name, collection.name)
+        for listener in listeners:
+            listener.started(event)
+        return event, listeners
+
+    def finish(event, listeners, start):
+        event.duration_micros = int((time.perf_counter() - start) * 1e6)
+        for listener in listeners:
+            listener.succeeded(event)
+
+    def monitored(method, command_name, collection_of):
+        async def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            event, listeners = publish(collection_of(self), command_name)
+            result = await method(self, *args, **kwargs)
+            finish(event, listeners, start)
+            return result
+        return wrapper
+
+    collection_cls = mongomock_motor.AsyncMongoMockCollection
+    for name, command_name in MOCK_COMMANDS.items():
+        setattr(collection_cls, name, monitored(getattr(collection_cls, name), command_name,
+                                                lambda self: self._AsyncMongoMockCollection__collection))
+    # find() only builds a cursor; the command is sent when it is read
+    cursor_cls = mongomock_motor.AsyncCursor
+    cursor_cls.to_list = monitored(cursor_cls.to_list, "find", lambda self: self.collection)
+
+    client_init = mongomock_motor.AsyncMongoMockClient.__init__
+
+    def init(self, *args, event_listeners=(), **kwargs):
+        client_init(self, *args, **kwargs)
+        listeners = self._AsyncMongoMockClient__client.event_listeners = list(event_listeners)
+        self.options = types.SimpleNamespace(event_listeners=listeners)
+    mongomock_motor.AsyncMongoMockClient.__init__ = init
+
+
+def count_mongo_ops(mongo_client, counts):
+    """Count every command the app sends, per endpoint, via its MongoCommandMetrics listener."""
+    from metrics import MongoCommandMetrics
+    listeners = [listener for listener in mongo_client.options.event_listeners
+                 if isinstance(listener, MongoCommandMetrics)]
+    if not listeners:
+        sys.exit("Mongo ops are counted by the command listener; run with METRICS_ENABLED=1")
+    lock = threading.Lock()
+
+    def counting(started):
+        def wrapper(event):
+            started(event)
+            # Motor runs commands on its executor with the caller's context, so this is the request's endpoint
+            with lock:
+                counts[current_endpoint.get()] += 1
+        return wrapper
+    for listener in listeners:
+        listener.started = counting(listener.started)
+
+
+# --- Flows ---
+def make_image(seed: int) -> str:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+    for _ in range(20):
+        x, y = rng.randrange(600), rng.randrange(440)
+        img.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + 40, y + 40))
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=85)
+    import base64
+    return base64.b64encode(out.getvalue()).decode()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str, **kwargs):
+        token = current_endpoint.set(endpoint)
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        finally:
+            current_endpoint.reset(token)
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+            return None
+        return response.json()
+
+
+async def run_flow(client, recorder: Recorder, image: str):
+    session = await recorder.call(client, "create_session", "POST", "/api/sessions", json={"name": "Load test"})
+    if not session:
+        return
+    sid = session["session_id"]
+    body = {"session_id": sid, "image_base64": image}
+    if not await recorder.call(client, "analyze_space", "POST", "/api/analyze-space", json=body):
+        return
+    planned = await recorder.call(client, "generate_tasks", "POST", "/api/generate-tasks", json={"session_id": sid})
+    for task in (planned or {}).get("tasks", []):
+        await recorder.call(client, "toggle_task", "PUT", f"/api/sessions/{sid}/tasks/{task['task_id']}",
+                            json={"completed": True})
+    identified = await recorder.call(client, "identify_items", "POST", "/api/identify-items", json=body)
+    for item in (identified or {}).get("items", []):
+        await recorder.call(client, "sort_item", "PUT", f"/api/sessions/{sid}/items/{item['item_id']}",
+                            json={"decision": random.choice(("keep", "sell", "donate"))})
+    await recorder.call(client, "get_session", "GET", f"/api/sessions/{sid}")
+
+
+def percentile(ordered, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def summarize(recorder: Recorder, mongo_ops, elapsed: float, args) -> dict:
+    endpoints = {}
+    total = 0
+    for endpoint, samples in sorted(recorder.latencies.items()):
+        ordered = sorted(samples)
+        total += len(ordered)
+        endpoints[endpoint] = {
+            "requests": len(ordered),
+            "errors": recorder.errors[endpoint],
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+            "mongo_ops_per_request": round(mongo_ops[endpoint] / len(ordered), 2),
+        }
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "mongo_url")},
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "flows_per_s": round(args.sessions / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> bool:
+    """Print per-endpoint changes; True if any p95 or ops count regressed past threshold."""
+    regressed = False
+    print(f"\n{'endpoint':16} {'p95 before':>11} {'p95 after':>10} {'change':>8} {'ops before':>11} {'ops after':>10}")
+    for endpoint, now in result["endpoints"].items():
+        then = baseline["endpoints"].get(endpoint)
+        if not then:
+            continue
+        change = (now["p95_ms"] - then["p95_ms"]) / then["p95_ms"] if then["p95_ms"] else 0.0
+        worse = change > threshold or now["mongo_ops_per_request"] > then["mongo_ops_per_request"]
+        regressed |= worse
+        print(f"{endpoint:16} {then['p95_ms']:>11} {now['p95_ms']:>10} {change:>+7.0%}{'!' if worse else ' '}"
+              f" {then['mongo_ops_per_request']:>11} {now['mongo_ops_per_request']:>10}")
+    return regressed
+
+
+def print_report(result: dict):
+    print(f"{result['requests']} requests in {result['elapsed_s']}s: {result['throughput_rps']} req/s, "
+          f"{result['flows_per_s']} flows/s")
+    print(f"{'endpoint':16} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mongo ops':>10}")
+    for endpoint, s in result["endpoints"].items():
+        print(f"{endpoint:16} {s['requests']:>9} {s['errors']:>7} {s['p50_ms']:>8} {s['p95_ms']:>8} "
+              f"{s['p99_ms']:>8} {s['mongo_ops_per_request']:>10}")
+
+
+async def run(args) -> dict:
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+        os.environ["DB_NAME"] = f"nudge_load_{uuid.uuid4().hex[:8]}"
+    else:
+        use_mongomock()
+        os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+        os.environ["DB_NAME"] = "nudge_load"
+    # The flows all come from one client address; per-IP limits would only measure the limiter
+    os.environ.setdefault("RATE_LIMIT_IP_PER_MIN", "0")
+    os.environ.setdefault("RATE_LIMIT_SESSION_PER_MIN", "0")
+    os.environ.setdefault("LLM_BACKOFF_BASE", "0.05")
+
+    os.environ["LLM_PREWARM"] = "0"
+
+    import server
+    mongo_ops = defaultdict(int)
+
+    images = [make_image(i) for i in range(max(1, int(args.sessions * (1 - args.image_reuse))))]
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user(i):
+        async with semaphore:
+            await run_flow(client, recorder, images[i % len(images)])
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with server.lifespan(server.app):
+        services = server.app.state.services
+        use_fake_llm(services.llm, args)
+        count_mongo_ops(services.client, mongo_ops)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=120) as client:
+                start = time.perf_counter()
+                await asyncio.gather(*(user(i) for i in range(args.sessions)))
+                elapsed = time.perf_counter() - start
+        finally:
+            if args.mongo_url:
+                await services.client.drop_database(os.environ["DB_NAME"])
+    return summarize(recorder, mongo_ops, elapsed, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=50, help="flows to run in total")
+    parser.add_argument("--concurrency", type=int, default=10, help="flows running at once")
+    parser.add_argument("--tasks", type=int, default=6, help="tasks the fake model plans per session")
+    parser.add_argument("--items", type=int, default=8, help="items the fake model identifies per session")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean fake model latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.3, help="latency stddev as a fraction of the mean")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="fraction of model calls that fail")
+    parser.add_argument("--image-reuse", type=float, default=0.0, help="fraction of flows reusing an earlier photo")
+    parser.add_argument("--mongo-url", help="run against this MongoDB instead of mongomock")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", help="diff against a saved baseline; exits 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p95 increase counted as a regression")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(result, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import io
+import os
+import mmap
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+BLOB_DIR = os.environ.get("BLOB_DIR", os.path.join(tempfile.gettempdir(), "nudge-blobs"))
+BLOB_MAX_BYTES = int(os.environ.get("BLOB_MAX_BYTES", str(1024 * 1024 * 1024)))
+BLOB_REF_PATTERN = r"^[0-9a-f]{64}$"
+COPY_CHUNK_BYTES = 256 * 1024
+
+
+class BlobStore:
+    """Content-addressed image files on local disk, evicted least-recently-used past a byte cap.
+
+    A blob is named by the sha256 of its bytes, so the same photo is stored
+    once however often it is sent. Derived variants (the downscaled copy sent
+    to the model) live next to their blob and count towards the same cap.
+    Methods do blocking file I/O; call them from a thread.
+    """
+
+    def __init__(self, root: str = BLOB_DIR, max_bytes: int = BLOB_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        # name -> size, least recently used first
+        self._index: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"stored": 0, "deduplicated": 0, "hits": 0, "misses": 0, "evictions": 0}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name)
+
+    def load(self):
+        """Index blobs left by earlier runs, oldest access first, and apply the cap."""
+        os.makedirs(self.root, exist_ok=True)
+        found = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.startswith("."):
+                    # A write that never reached os.replace
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, name, stat.st_size))
+        with self._lock:
+            self._index.clear()
+            self._bytes = 0
+            for _, name, size in sorted(found):
+                self._index[name] = size
+                self._bytes += size
+            self._evict()
+
+    def _add(self, name: str, size: int):
+        with self._lock:
+            self._bytes += size - self._index.pop(name, 0)
+            self._index[name] = size
+            self._evict()
+
+    def _evict(self):
+        # Never evict the entry just added, even if it alone exceeds the cap
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            name, size = self._index.popitem(last=False)
+            self._bytes -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+
+    def _touch(self, name: str) -> bool:
+        """Mark a blob as used; False if it is gone (evicted here or by another worker)."""
+        path = self._path(name)
+        try:
+            # mtime doubles as the access order when the index is rebuilt
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._bytes -= self._index.pop(name, 0)
+            return False
+        with self._lock:
+            if name in self._index:
+                self._index.move_to_end(name)
+            else:
+                # Written by another worker sharing the directory
+                self._index[name] = size
+                self._bytes += size
+                self._evict()
+        return True
+
+    def _write(self, name: str, fileobj) -> int:
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(fileobj, out, COPY_CHUNK_BYTES)
+                size = out.tell()
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self._add(name, size)
+        self.stats["stored"] += 1
+        return size
+
+    def put_file(self, fileobj, sha256: Optional[str] = None) -> str:
+        """Store a seekable file's content; returns its ref. Pass `sha256` if already known."""
+        if sha256 is None:
+            fileobj.seek(0)
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: fileobj.read(COPY_CHUNK_BYTES), b""):
+                digest.update(chunk)
+            sha256 = digest.hexdigest()
+        if self._touch(sha256):
+            self.stats["deduplicated"] += 1
+        else:
+            fileobj.seek(0)
+            self._write(sha256, fileobj)
+        fileobj.seek(0)
+        return sha256
+
+    def put(self, data: bytes) -> str:
+        ref = hashlib.sha256(data).hexdigest()
+        if self._touch(ref):
+            self.stats["deduplicated"] += 1
+        else:
+            self._write(ref, io.BytesIO(data))
+        return ref
+
+    def put_variant(self, ref: str, variant: str, data: bytes):
+        self._write(f"{ref}.{variant}", io.BytesIO(data))
+
+    def path(self, ref: str, variant: Optional[str] = None) -> Optional[str]:
+        """Path of a stored blob (or one of its variants), or None if it is not stored."""
+        name = f"{ref}.{variant}" if variant else ref
+        if self._touch(name):
+            self.stats["hits"] += 1
+            return self._path(name)
+        self.stats["misses"] += 1
+        return None
+
+    def read(self, ref: str, variant: Optional[str] = None) -> Optional[mmap.mmap]:
+        """Read-only memory map of a blob, or None; close it (or use `with`) when done."""
+        path = self.path(ref, variant)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "entries": len(self._index), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
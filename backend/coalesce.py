@@ -0,0 +1,271 @@
+import os
+import copy
+import uuid
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from helpers import utc_now
+from resilience import LlmCallError, LLM_CALL_ERROR_DETAIL
+
+logger = logging.getLogger(__name__)
+
+COALESCE_BACKEND = os.environ.get("COALESCE_BACKEND", "mongo")
+# A leader renews its lease while it runs; others take over once it lapses
+COALESCE_LEASE_SECONDS = int(os.environ.get("COALESCE_LEASE_SECONDS", "30"))
+# How long a finished flight stays readable by followers in other workers
+COALESCE_GRACE_SECONDS = int(os.environ.get("COALESCE_GRACE_SECONDS", "60"))
+COALESCE_POLL_MAX = float(os.environ.get("COALESCE_POLL_MAX", "0.5"))
+# How long responses to requests sent with an Idempotency-Key are replayed
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_KEY_MAX = 255
+
+# Follower outcome meaning "the flight went away; acquire again"
+_RETRY = object()
+
+
+def input_hash(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def flight_key(operation: str, session_id: str, digest: str, idempotency_key: Optional[str] = None) -> str:
+    if idempotency_key is None:
+        return f"{operation}:{session_id}:{digest}"
+    if not idempotency_key or len(idempotency_key) > IDEMPOTENCY_KEY_MAX:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX} characters")
+    return f"{operation}:{session_id}:key:{idempotency_key}"
+
+
+def _mismatch():
+    return HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+
+
+def _decide(doc: dict, digest: str, idempotent: bool, now: datetime):
+    """What to do with an existing flight record: ("replay", result), ("follow", token) or ("take", None)."""
+    if idempotent and doc.get("input_hash") != digest:
+        raise _mismatch()
+    if doc["status"] == "succeeded" and doc.get("idempotent"):
+        return "replay", doc["result"]
+    if doc["status"] == "running" and doc["lease_until"] > now:
+        return "follow", doc["token"]
+    # Failed, finished without a key, or the leader's lease lapsed
+    return "take", None
+
+
+class MemoryFlightStore:
+    """Flight records for a single worker; in-flight joins never reach the store."""
+
+    def __init__(self):
+        self._records: Dict[str, dict] = {}
+
+    async def ensure_indexes(self):
+        return None
+
+    def _get(self, key: str) -> Optional[dict]:
+        doc = self._records.get(key)
+        if doc is not None and doc["expires_at"] <= utc_now():
+            del self._records[key]
+            return None
+        return doc
+
+    async def acquire(self, key: str, digest: str, idempotent: bool, lease_seconds: int) -> Tuple[str, object]:
+        now = utc_now()
+        doc = self._get(key)
+        if doc is not None:
+            state, value = _decide(doc, digest, idempotent, now)
+            if state != "take":
+                return state, copy.deepcopy(value)
+        token = uuid.uuid4().hex
+        self._records[key] = {"token": token, "status": "running", "input_hash": digest, "idempotent": idempotent,
+                              "lease_until": now + timedelta(seconds=lease_seconds),
+                              "expires_at": now + timedelta(seconds=lease_seconds + COALESCE_GRACE_SECONDS)}
+        return "lead", token
+
+    async def renew(self, key: str, token: str, lease_seconds: int):
+        doc = self._get(key)
+        if doc is not None and doc["token"] == token:
+            doc["lease_until"] = utc_now() + timedelta(seconds=lease_seconds)
+            doc["expires_at"] = doc["lease_until"] + timedelta(seconds=COALESCE_GRACE_SECONDS)
+
+    async def finish(self, key: str, token: str, fields: dict, ttl_seconds: int):
+        doc = self._get(key)
+        if doc is not None and doc["token"] == token:
+            doc.update(copy.deepcopy(fields), expires_at=utc_now() + timedelta(seconds=ttl_seconds))
+
+    async def peek(self, key: str, token: str) -> Optional[dict]:
+        doc = self._get(key)
+        return copy.deepcopy(doc) if doc is not None and doc["token"] == token else None
+
+
+class MongoFlightStore:
+    """Flight records shared by all workers, so duplicates on another worker join too."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def acquire(self, key: str, digest: str, idempotent: bool, lease_seconds: int) -> Tuple[str, object]:
+        while True:
+            now = utc_now()
+            token = uuid.uuid4().hex
+            record = {"token": token, "status": "running", "input_hash": digest, "idempotent": idempotent,
+                      "result": None, "error": None, "lease_until": now + timedelta(seconds=lease_seconds),
+                      "expires_at": now + timedelta(seconds=lease_seconds + COALESCE_GRACE_SECONDS)}
+            try:
+                await self.collection.insert_one({"_id": key, **record})
+                return "lead", token
+            except DuplicateKeyError:
+                pass
+            doc = await self.collection.find_one({"_id": key})
+            if doc is None:
+                # Expired between the insert and the read
+                continue
+            state, value = _decide(doc, digest, idempotent, now)
+            if state != "take":
+                return state, value
+            # Compare-and-swap on the old token so only one taker wins
+            taken = await self.collection.find_one_and_update(
+                {"_id": key, "token": doc["token"]}, {"$set": record},
+                projection={"_id": 1}, return_document=ReturnDocument.AFTER)
+            if taken is not None:
+                return "lead", token
+
+    async def renew(self, key: str, token: str, lease_seconds: int):
+        lease_until = utc_now() + timedelta(seconds=lease_seconds)
+        await self.collection.update_one({"_id": key, "token": token}, {"$set": {
+            "lease_until": lease_until,
+            "expires_at": lease_until + timedelta(seconds=COALESCE_GRACE_SECONDS),
+        }})
+
+    async def finish(self, key: str, token: str, fields: dict, ttl_seconds: int):
+        await self.collection.update_one({"_id": key, "token": token}, {"$set": {
+            **fields, "expires_at": utc_now() + timedelta(seconds=ttl_seconds)}})
+
+    async def peek(self, key: str, token: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": key, "token": token}, {"_id": 0})
+
+
+class SingleFlight:
+    """Run one call per key at a time; duplicates wait for its result.
+
+    Within a worker duplicates share the leader's task. Across workers the
+    leader holds a lease in the store and followers poll its record. With
+    `idempotent=True` (an Idempotency-Key was sent) a successful result is
+    also replayed to later requests with the same key.
+    """
+
+    def __init__(self, store, lease_seconds: int = COALESCE_LEASE_SECONDS,
+                 poll_max: float = COALESCE_POLL_MAX, idempotency_ttl: int = IDEMPOTENCY_TTL_SECONDS):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.poll_max = poll_max
+        self.idempotency_ttl = idempotency_ttl
+        self._flights: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.stats = {"led": 0, "joined": 0, "joined_remote": 0, "replayed": 0}
+
+    async def ensure_indexes(self):
+        await self.store.ensure_indexes()
+
+    async def run(self, key: str, digest: str, compute: Callable[[], Awaitable], idempotent: bool = False):
+        current = self._flights.get(key)
+        if current is not None:
+            if current[0] != digest:
+                raise _mismatch()
+            self.stats["joined"] += 1
+            flight = current[1]
+        else:
+            flight = asyncio.ensure_future(self._fly(key, digest, compute, idempotent))
+            self._flights[key] = (digest, flight)
+            flight.add_done_callback(lambda f: self._landed(key, f))
+        # Shielded: a caller that disconnects must not cancel the call the others wait on
+        return await asyncio.shield(flight)
+
+    def _landed(self, key: str, flight: asyncio.Future):
+        if self._flights.get(key, (None, None))[1] is flight:
+            del self._flights[key]
+        if not flight.cancelled():
+            # Mark it retrieved even if every caller went away
+            flight.exception()
+
+    async def _fly(self, key: str, digest: str, compute, idempotent: bool):
+        while True:
+            state, value = await self.store.acquire(key, digest, idempotent, self.lease_seconds)
+            if state == "lead":
+                break
+            if state == "replay":
+                self.stats["replayed"] += 1
+                return value
+            result = await self._follow(key, value)
+            if result is not _RETRY:
+                self.stats["joined_remote"] += 1
+                return result
+        self.stats["led"] += 1
+        return await self._lead(key, value, compute, idempotent)
+
+    async def _lead(self, key: str, token: str, compute, idempotent: bool):
+        heartbeat = asyncio.create_task(self._renew(key, token))
+        try:
+            result = await compute()
+        except HTTPException as exc:
+            await self._finish(key, token, {"status": "failed",
+                                            "error": {"status_code": exc.status_code, "detail": exc.detail}})
+            raise
+        except LlmCallError:
+            # Followers get what the leader's client gets from llm_call_error_handler
+            await self._finish(key, token, {"status": "failed", "error": {
+                "status_code": 502, "detail": LLM_CALL_ERROR_DETAIL, "headers": {"Retry-After": "5"}}})
+            raise
+        except Exception:
+            await self._finish(key, token, {"status": "failed",
+                                            "error": {"status_code": 500, "detail": "Internal Server Error"}})
+            raise
+        finally:
+            heartbeat.cancel()
+        await self._finish(key, token, {"status": "succeeded", "result": result},
+                           self.idempotency_ttl if idempotent else COALESCE_GRACE_SECONDS)
+        return result
+
+    async def _renew(self, key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.store.renew(key, token, self.lease_seconds)
+            except Exception as exc:
+                logger.warning("Could not renew flight %s: %s", key, exc)
+
+    async def _finish(self, key: str, token: str, fields: dict, ttl_seconds: int = COALESCE_GRACE_SECONDS):
+        # The caller already has its result; a store hiccup only costs followers a retry
+        try:
+            await self.store.finish(key, token, fields, ttl_seconds)
+        except Exception as exc:
+            logger.warning("Could not record flight %s: %s", key, exc)
+
+    async def _follow(self, key: str, token: str):
+        delay = 0.05
+        while True:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.poll_max)
+            doc = await self.store.peek(key, token)
+            if doc is None:
+                return _RETRY
+            if doc["status"] == "succeeded":
+                return doc["result"]
+            if doc["status"] == "failed":
+                raise HTTPException(**doc["error"])
+            if doc["lease_until"] <= utc_now():
+                return _RETRY
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._flights)}
@@ -0,0 +1,68 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ConnectionFailure
+
+from metrics import METRICS_ENABLED, MongoCommandMetrics
+
+logger = logging.getLogger(__name__)
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_MS = int(os.environ.get("MONGO_MAX_IDLE_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_RETRY_MAX_SECONDS = float(os.environ.get("MONGO_RETRY_MAX_SECONDS", "60"))
+
+
+def create_client(url: str, **overrides) -> AsyncIOMotorClient:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "retryWrites": True,
+        # Hand back aware UTC datetimes so they serialize with their offset
+        "tz_aware": True,
+    }
+    if METRICS_ENABLED:
+        options["event_listeners"] = [MongoCommandMetrics()]
+    options.update(overrides)
+    return AsyncIOMotorClient(url, **options)
+
+
+async def ping(db) -> float:
+    """Round-trip a ping and return its latency in milliseconds."""
+    start = time.perf_counter()
+    await db.command("ping")
+    return (time.perf_counter() - start) * 1000
+
+
+async def warm_pool(db, connections: int = MONGO_MIN_POOL_SIZE) -> float:
+    """Open `connections` sockets up front so the first requests skip the handshake."""
+    results = await asyncio.gather(*(ping(db) for _ in range(max(1, connections))))
+    return max(results)
+
+
+async def retry_until_connected(operation: Callable[[], Awaitable], what: str):
+    """Run `operation`, retrying with backoff for as long as MongoDB is unreachable.
+
+    Any other error is raised straight away.
+    """
+    delay = 1.0
+    while True:
+        try:
+            return await operation()
+        except ConnectionFailure as exc:
+            logger.warning("%s: MongoDB unreachable, retrying in %.0fs: %s", what, delay, exc)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, MONGO_RETRY_MAX_SECONDS)
@@ -0,0 +1,11 @@
+import os
+from datetime import datetime, timezone
+
+
+def env_flag(name: str, default: str) -> bool:
+    """An on/off setting from the environment: "1", "true" or "yes" (any case) mean on."""
+    return os.environ.get(name, default).lower() in ("1", "true", "yes")
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
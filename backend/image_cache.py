@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import base64
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from PIL import Image
+
+from helpers import env_flag
+
+CACHE_TTL_SECONDS = int(os.environ.get("IMAGE_CACHE_TTL_SECONDS", "86400"))
+CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "512"))
+CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Max Hamming distance between 64-bit dHashes for two photos to count as the same shot
+PHASH_MAX_DISTANCE = int(os.environ.get("IMAGE_CACHE_PHASH_DISTANCE", "4"))
+CACHE_USE_MONGO = env_flag("IMAGE_CACHE_MONGO", "0")
+
+
+def decode_image(image_base64: str) -> bytes:
+    if image_base64.startswith("data:") and "," in image_base64:
+        image_base64 = image_base64.split(",", 1)[1]
+    return base64.b64decode(image_base64)
+
+
+def dhash(fp) -> Optional[int]:
+    """64-bit difference hash of an image file object; None if it is not decodable."""
+    try:
+        img = Image.open(fp)
+        # JPEG draft mode lets the decoder skip most of the full-resolution work
+        img.draft("L", (64, 64))
+        img = img.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    except Exception:
+        return None
+    pixels = list(img.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    # Flat images (blank walls, lens cap, solid fills) all hash to ~0 and would
+    # match each other, so they only ever hit on the exact content hash.
+    if not 2 < bin(value).count("1") < 62:
+        return None
+    return value
+
+
+class ImageKey:
+    def __init__(self, sha256: str, phash: Optional[int]):
+        self.sha256 = sha256
+        self.phash = phash
+
+
+def image_key_from_file(fileobj, chunk_size: int = 64 * 1024) -> ImageKey:
+    """Content hash and perceptual hash of a seekable file, read without loading it whole."""
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    phash = dhash(fileobj)
+    fileobj.seek(0)
+    return ImageKey(digest.hexdigest(), phash)
+
+
+class _Entry:
+    __slots__ = ("payload", "phash", "expires_at")
+
+    def __init__(self, payload: str, phash: Optional[int], expires_at: float):
+        self.payload = payload
+        self.phash = phash
+        self.expires_at = expires_at
+
+
+class AnalysisCache:
+    """Two-tier cache for AI results keyed by image content.
+
+    Tier 1 is an in-process LRU bounded by entry count, payload bytes and TTL.
+    Tier 2 is an optional Mongo collection shared by all workers. Values are
+    stored as JSON so callers always get a fresh copy back.
+    """
+
+    def __init__(self, collection=None, ttl_seconds: int = CACHE_TTL_SECONDS,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 phash_distance: int = PHASH_MAX_DISTANCE):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.phash_distance = phash_distance
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.stats = {
+            "hits": 0,
+            "phash_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    # --- local tier ---
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.payload)
+
+    def _local_get(self, namespace: str, key: ImageKey) -> Optional[str]:
+        now = time.monotonic()
+        full_key = f"{namespace}:{key.sha256}"
+        entry = self._entries.get(full_key)
+        if entry is not None:
+            if entry.expires_at <= now:
+                self._drop(full_key)
+                self.stats["expired"] += 1
+            else:
+                self._entries.move_to_end(full_key)
+                self.stats["hits"] += 1
+                return entry.payload
+
+        if key.phash is None or self.phash_distance < 0:
+            return None
+        prefix = f"{namespace}:"
+        for other_key, entry in list(self._entries.items()):
+            if not other_key.startswith(prefix) or entry.phash is None:
+                continue
+            if entry.expires_at <= now:
+                self._drop(other_key)
+                self.stats["expired"] += 1
+                continue
+            if bin(entry.phash ^ key.phash).count("1") <= self.phash_distance:
+                self._entries.move_to_end(other_key)
+                self.stats["phash_hits"] += 1
+                return entry.payload
+        return None
+
+    def _local_put(self, namespace: str, key: ImageKey, payload: str):
+        full_key = f"{namespace}:{key.sha256}"
+        if full_key in self._entries:
+            self._drop(full_key)
+        if len(payload) > self.max_bytes:
+            return
+        self._entries[full_key] = _Entry(payload, key.phash, time.monotonic() + self.ttl_seconds)
+        self._bytes += len(payload)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
+
+    # --- shared tier ---
+    async def _shared_get(self, namespace: str, key: ImageKey) -> Optional[str]:
+        if self.collection is None:
+            return None
+        now = datetime.now(timezone.utc)
+        query = {"namespace": namespace, "expires_at": {"$gt": now}}
+        if key.phash is not None:
+            query["$or"] = [{"sha256": key.sha256}, {"phash": format(key.phash, "016x")}]
+        else:
+            query["sha256"] = key.sha256
+        doc = await self.collection.find_one(query, {"_id": 0, "payload": 1})
+        if not doc:
+            return None
+        self.stats["shared_hits"] += 1
+        return doc["payload"]
+
+    async def _shared_put(self, namespace: str, key: ImageKey, payload: str):
+        if self.collection is None:
+            return
+        await self.collection.update_one(
+            {"namespace": namespace, "sha256": key.sha256},
+            {"$set": {
+                "phash": format(key.phash, "016x") if key.phash is not None else None,
+                "payload": payload,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+            }},
+            upsert=True,
+        )
+
+    async def ensure_indexes(self):
+        if self.collection is None:
+            return
+        await self.collection.create_index([("namespace", 1), ("sha256", 1)], unique=True)
+        await self.collection.create_index([("namespace", 1), ("phash", 1)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    # --- public API ---
+    async def get(self, namespace: str, key: ImageKey):
+        payload = self._local_get(namespace, key)
+        if payload is None:
+            payload = await self._shared_get(namespace, key)
+            if payload is not None:
+                self._local_put(namespace, key, payload)
+        if payload is None:
+            self.stats["misses"] += 1
+            return None
+        return json.loads(payload)
+
+    async def put(self, namespace: str, key: ImageKey, value):
+        payload = json.dumps(value)
+        self._local_put(namespace, key, payload)
+        await self._shared_put(namespace, key, payload)
+
+    async def get_or_compute(self, namespace: str, key: ImageKey, compute: Callable[[], Awaitable]):
+        cached = await self.get(namespace, key)
+        if cached is not None:
+            return cached
+        value = await compute()
+        await self.put(namespace, key, value)
+        return value
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["phash_hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        hit_total = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "lookups": lookups,
+            "hit_ratio": round(hit_total / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "shared_tier": self.collection is not None,
+        }
@@ -0,0 +1,124 @@
+import os
+import io
+import mmap
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1568"))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "82"))
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Name of the model-ready copy kept next to a stored image; changes with the settings
+PREPARED_VARIANT = f"model-{IMAGE_MAX_EDGE}-{IMAGE_QUALITY}.{IMAGE_FORMAT.lower()}"
+# Images wider than this (width / height) are split into tiles when no count is given
+PANORAMA_ASPECT = float(os.environ.get("PANORAMA_ASPECT", "2.0"))
+# Aspect ratio aimed for per tile, and the share of a tile's width it overlaps its neighbours by
+TILE_ASPECT = 1.5
+TILE_OVERLAP = 0.1
+# EXIF orientations that swap width and height
+_ROTATED = (5, 6, 7, 8)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _decode(image, draft_size) -> Image.Image:
+    img = Image.open(io.BytesIO(image) if isinstance(image, bytes) else image)
+    if img.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when the target allows it
+        img.draft("RGB", draft_size)
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    return img
+
+
+def _encode(img: Image.Image, max_edge: int, fmt: str, quality: int) -> bytes:
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    out = io.BytesIO()
+    if fmt == "WEBP":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def preprocess_image(image, max_edge: int = IMAGE_MAX_EDGE,
+                     fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> bytes:
+    """Decode, apply EXIF orientation, downscale and re-encode without metadata.
+
+    `image` is encoded bytes or a seekable file such as an mmap. Runs in a
+    worker process, so it must stay a plain module-level function.
+    """
+    return _encode(_decode(image, (max_edge, max_edge)), max_edge, fmt, quality)
+
+
+def tile_image(image, tiles: int, max_edge: int = IMAGE_MAX_EDGE,
+               fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> List[bytes]:
+    """Split a wide image into `tiles` side-by-side crops, each prepared like preprocess_image.
+
+    Neighbouring tiles overlap slightly so nothing on a seam is cut in half.
+    """
+    img = _decode(image, (max_edge * tiles, max_edge))
+    width, height = img.size
+    step = width / tiles
+    pad = step * TILE_OVERLAP / 2
+    return [_encode(img.crop((max(0, round(i * step - pad)), 0, min(width, round((i + 1) * step + pad)), height)),
+                    max_edge, fmt, quality)
+            for i in range(tiles)]
+
+
+def panorama_tiles(path: str, max_tiles: int) -> int:
+    """How many tiles to split an image into: 1 unless it is panorama-wide. Reads only the header."""
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112) in _ROTATED:
+            width, height = height, width
+    if not height or width / height < PANORAMA_ASPECT:
+        return 1
+    return max(1, min(max_tiles, round(width / height / TILE_ASPECT)))
+
+
+def _preprocess_path(path: str, tiles: int) -> List[bytes]:
+    # Mapped in the worker, so the image never crosses the process boundary
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return [preprocess_image(mm)] if tiles == 1 else tile_image(mm, tiles)
+
+
+def _read_path(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def prepare_image_path(path: str, tiles: int = 1) -> List[bytes]:
+    """Shrink a stored image for the model off the event loop; returns one encoded image per tile.
+
+    Images that cannot be decoded are passed through untouched, as the only entry.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_executor(), _preprocess_path, path, tiles)
+    except FileNotFoundError:
+        raise
+    except Exception as exc:
+        logger.warning("Image preprocessing failed, sending original: %s", exc)
+        return [await asyncio.to_thread(_read_path, path)]
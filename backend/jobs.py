@@ -0,0 +1,314 @@
+import os
+import copy
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from database import retry_until_connected
+from helpers import utc_now
+from resilience import LlmCallError, LLM_CALL_ERROR_DETAIL
+
+logger = logging.getLogger(__name__)
+
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "mongo")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "8"))
+JOB_MODEL_CONCURRENCY = int(os.environ.get("JOB_MODEL_CONCURRENCY", "4"))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "200"))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "180"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", "86400"))
+# How often each worker picks up jobs whose lease lapsed or that sat queued a whole lease unclaimed
+JOB_RECLAIM_INTERVAL_SECONDS = float(os.environ.get("JOB_RECLAIM_INTERVAL_SECONDS", "60"))
+
+FINISHED = ("succeeded", "failed")
+JOB_PROJECTION = {"_id": 0, "payload": 0}
+
+
+class MemoryJobStore:
+    """In-process job store for tests and single-worker development."""
+
+    def __init__(self):
+        self._jobs: Dict[str, dict] = {}
+        # Finished job ids by expiry; retention is fixed, so finish order is expiry order
+        self._expiring: OrderedDict = OrderedDict()
+
+    async def ensure_indexes(self):
+        pass
+
+    def _purge(self):
+        now = utc_now()
+        while self._expiring and next(iter(self._expiring.values())) <= now:
+            self._jobs.pop(self._expiring.popitem(last=False)[0], None)
+
+    async def create(self, job: dict):
+        self._purge()
+        self._jobs[job["job_id"]] = copy.deepcopy(job)
+
+    async def get(self, job_id: str, with_payload: bool = False) -> Optional[dict]:
+        self._purge()
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job = copy.deepcopy(job)
+        if not with_payload:
+            job.pop("payload", None)
+        return job
+
+    async def claim(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        now = utc_now()
+        if job is None or not (job["status"] == "queued" or
+                               (job["status"] == "running" and job["lease_until"] < now)):
+            return None
+        job.update({"status": "running", "started_at": now.isoformat(),
+                    "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "attempts": job.get("attempts", 0) + 1})
+        return copy.deepcopy(job)
+
+    async def renew(self, job_id: str, attempt: int):
+        job = self._jobs.get(job_id)
+        if job is not None and job["status"] == "running" and job.get("attempts") == attempt:
+            job["lease_until"] = utc_now() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+    async def finish(self, job_id: str, fields: dict):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+            job.pop("payload", None)
+            self._expiring[job_id] = utc_now() + timedelta(seconds=JOB_RETENTION_SECONDS)
+
+    async def unfinished(self, queued_before: datetime):
+        now = utc_now()
+        return [job_id for job_id, job in self._jobs.items()
+                if (job["status"] == "queued" and job["lease_until"] < queued_before) or
+                (job["status"] == "running" and job["lease_until"] < now)]
+
+
+class MongoJobStore:
+    """Jobs persisted in Mongo so queued work survives a worker restart."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("job_id", unique=True)
+        await self.collection.create_index([("status", 1), ("lease_until", 1)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def create(self, job: dict):
+        await self.collection.insert_one({**job})
+
+    async def get(self, job_id: str, with_payload: bool = False) -> Optional[dict]:
+        projection = {"_id": 0} if with_payload else JOB_PROJECTION
+        return await self.collection.find_one({"job_id": job_id}, projection)
+
+    async def claim(self, job_id: str) -> Optional[dict]:
+        now = utc_now()
+        return await self.collection.find_one_and_update(
+            {"job_id": job_id, "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "running", "started_at": now.isoformat(),
+                      "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS)},
+             "$inc": {"attempts": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def renew(self, job_id: str, attempt: int):
+        # The attempt number identifies this claim, so a lapsed and re-claimed job isn't extended by the old runner
+        await self.collection.update_one(
+            {"job_id": job_id, "status": "running", "attempts": attempt},
+            {"$set": {"lease_until": utc_now() + timedelta(seconds=JOB_LEASE_SECONDS)}},
+        )
+
+    async def finish(self, job_id: str, fields: dict):
+        await self.collection.update_one(
+            {"job_id": job_id},
+            {"$set": {**fields, "expires_at": utc_now() + timedelta(seconds=JOB_RETENTION_SECONDS)},
+             "$unset": {"payload": ""}},
+        )
+
+    async def unfinished(self, queued_before: datetime):
+        now = utc_now()
+        cursor = self.collection.find(
+            {"$or": [{"status": "queued", "lease_until": {"$lt": queued_before}},
+                     {"status": "running", "lease_until": {"$lt": now}}]},
+            {"_id": 0, "job_id": 1},
+        ).sort("created_at", 1)
+        return [doc["job_id"] async for doc in cursor]
+
+
+class JobQueue:
+    """Bounded worker pool that runs AI jobs with a concurrency cap per model.
+
+    Handlers are registered per job kind together with the model they call;
+    jobs for the same model share one semaphore so a burst of analyze jobs
+    cannot monopolise the provider.
+    """
+
+    def __init__(self, store, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_MAX,
+                 model_concurrency: int = JOB_MODEL_CONCURRENCY):
+        self.store = store
+        self.workers = workers
+        self.model_concurrency = model_concurrency
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued)
+        self._handlers: Dict[str, tuple] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._listeners: Dict[str, set] = {}
+        # Job ids queued or running in this worker, so reclaiming doesn't queue them twice
+        self._pending: set = set()
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def register(self, kind: str, model: str, handler: Callable[[dict], Awaitable[dict]]):
+        self._handlers[kind] = (model, handler)
+
+    async def start(self):
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+        # In the background, so a MongoDB that is down at startup doesn't keep the server from starting
+        self._tasks.append(asyncio.create_task(self._reclaim()))
+
+    async def _reclaim(self):
+        # At startup everything unfinished is ours to pick up (e.g. after a restart) ...
+        await retry_until_connected(lambda: self._recover(utc_now()), "Recovering unfinished jobs")
+        # ... afterwards only leases that lapsed, or queued jobs no worker took up, such as a crashed one's
+        while True:
+            await asyncio.sleep(JOB_RECLAIM_INTERVAL_SECONDS)
+            try:
+                await self._recover(utc_now() - timedelta(seconds=JOB_LEASE_SECONDS))
+            except Exception:
+                logger.exception("Reclaiming expired job leases failed")
+
+    async def _recover(self, queued_before: datetime):
+        for job_id in await self.store.unfinished(queued_before):
+            if self._queue.full():
+                break
+            if job_id not in self._pending:
+                self._enqueue(job_id)
+
+    def _enqueue(self, job_id: str):
+        self._queue.put_nowait(job_id)
+        self._pending.add(job_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, payload: dict) -> dict:
+        if kind not in self._handlers:
+            raise HTTPException(status_code=400, detail=f"Unknown job kind: {kind}")
+        if self._queue.full():
+            raise HTTPException(status_code=503, detail="Job queue is full, try again shortly",
+                                headers={"Retry-After": "5"})
+        now = utc_now()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "session_id": payload.get("session_id"),
+            "status": "queued",
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "attempts": 0,
+            "lease_until": now,
+            "created_at": now.isoformat(),
+        }
+        await self.store.create(job)
+        self._enqueue(job["job_id"])
+        return {k: v for k, v in job.items() if k not in ("payload", "lease_until")}
+
+    async def get(self, job_id: str) -> dict:
+        job = await self.store.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        job.pop("lease_until", None)
+        job.pop("expires_at", None)
+        return job
+
+    async def wait_for_change(self, job_id: str, timeout: float):
+        """Block until this worker updates the job, or the timeout passes.
+
+        Jobs running in another worker process are only seen by re-reading the
+        store, which is why callers poll with a timeout.
+        """
+        event = asyncio.Event()
+        self._listeners.setdefault(job_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            listeners = self._listeners.get(job_id)
+            if listeners is not None:
+                listeners.discard(event)
+                if not listeners:
+                    self._listeners.pop(job_id, None)
+
+    def _notify(self, job_id: str):
+        for event in self._listeners.get(job_id, ()):
+            event.set()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception:
+                logger.exception("Job %s crashed the worker loop", job_id)
+            finally:
+                self._pending.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        queued = await self.store.get(job_id)
+        if queued is None or queued["status"] in FINISHED:
+            return
+        model, handler = self._handlers[queued["kind"]]
+        semaphore = self._semaphores.setdefault(model, asyncio.Semaphore(self.model_concurrency))
+        # The lease is only taken once a model slot is free, so waiting here can't make it lapse
+        async with semaphore:
+            job = await self.store.claim(job_id)
+            if job is None:
+                # Finished, or claimed by another worker process
+                return
+            self._notify(job_id)
+            heartbeat = asyncio.create_task(self._renew(job_id, job["attempts"]))
+            try:
+                result = await handler(job["payload"])
+                fields = {"status": "succeeded", "result": result}
+            except HTTPException as exc:
+                fields = {"status": "failed", "error": {"status_code": exc.status_code, "detail": exc.detail}}
+            except LlmCallError:
+                logger.warning("Job %s failed: the model call gave up", job_id)
+                fields = {"status": "failed", "error": {"status_code": 502, "detail": LLM_CALL_ERROR_DETAIL}}
+            except Exception:
+                # Pollers see a generic error; the exception is only logged
+                logger.exception("Job %s failed", job_id)
+                fields = {"status": "failed", "error": {"status_code": 500, "detail": "Internal Server Error"}}
+            finally:
+                heartbeat.cancel()
+        fields["finished_at"] = utc_now().isoformat()
+        await self.store.finish(job_id, fields)
+        self._notify(job_id)
+
+    async def _renew(self, job_id: str, attempt: int):
+        # Keeps a long model call from being reclaimed and run a second time
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await self.store.renew(job_id, attempt)
+            except Exception as exc:
+                logger.warning("Could not renew the lease on job %s: %s", job_id, exc)
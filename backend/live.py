@@ -0,0 +1,294 @@
+import os
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+from fastapi import HTTPException
+from pymongo.errors import ConnectionFailure
+
+logger = logging.getLogger(__name__)
+
+# "auto" watches a change stream when MongoDB supports one (replica sets) and
+# otherwise falls back to "local": updates only from writes made by this worker
+LIVE_SOURCE = os.environ.get("LIVE_SOURCE", "auto")
+# Events a slow subscriber may fall behind before it is sent a fresh snapshot instead
+LIVE_QUEUE_MAX = int(os.environ.get("LIVE_QUEUE_MAX", "64"))
+# Writes to one session within this window go out as one event
+LIVE_DEBOUNCE_SECONDS = float(os.environ.get("LIVE_DEBOUNCE_SECONDS", "0.05"))
+LIVE_RETRY_MAX = float(os.environ.get("LIVE_RETRY_MAX", "30"))
+
+# Header fields sent when they change; timestamps change on every write and are left out
+LIVE_FIELDS = ("name", "status", "analysis", "completed_tasks", "total_tasks", "streak", "image_ref")
+# Per list: id field and the fields a delta carries when only entries' state changed
+LIVE_LISTS = {"tasks": ("task_id", "changed_tasks", "completed"),
+              "items": ("item_id", "changed_items", "decision")}
+# Every write bumps the header's revision, in both storage layouts, so the
+# header alone says which session changed. Events carry only the session_id
+# (looked up for updates); deletes have just the _id, mapped back via SessionHub._ids.
+# Inserts matter too: a restored session comes back under a new _id.
+WATCH_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+    {"$project": {"documentKey": 1, "operationType": 1, "fullDocument.session_id": 1}},
+]
+
+
+def session_delta(before: dict, after: dict) -> dict:
+    """The fields of `after` a subscriber holding `before` needs, as a partial session."""
+    delta = {"session_id": after["session_id"], "revision": after.get("revision", 0)}
+    for field in LIVE_FIELDS:
+        if before.get(field) != after.get(field):
+            delta[field] = after.get(field)
+    for name, (key, changed_name, state) in LIVE_LISTS.items():
+        old, new = before.get(name, []), after.get(name, [])
+        if [e[key] for e in old] != [e[key] for e in new]:
+            # Added, removed or reordered: send the whole list
+            delta[name] = new
+            continue
+        changed = []
+        for entry, previous in zip(new, old):
+            if entry == previous:
+                continue
+            if {**entry, state: None} != {**previous, state: None}:
+                # Edited beyond its state (e.g. regenerated): send the whole list
+                changed = None
+                break
+            changed.append({key: entry[key], state: entry.get(state)})
+        if changed is None:
+            delta[name] = new
+        elif changed:
+            delta[changed_name] = changed
+    return delta
+
+
+class Subscription:
+    """One client's view of a session: a bounded queue of events."""
+
+    def __init__(self, hub: "SessionHub", session_id: str, snapshot: dict):
+        self.hub = hub
+        self.session_id = session_id
+        self.snapshot = snapshot
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=LIVE_QUEUE_MAX)
+
+    def push(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Too far behind for deltas to be worth sending; start it over from the current state
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            self.hub.stats["resyncs"] += 1
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """The next event, or None if there was none within `timeout`."""
+        try:
+            event = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if event["type"] == "resync":
+            return {"type": "snapshot", "session": self.hub.current(self.session_id)}
+        return event
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class _Topic:
+    __slots__ = ("subscribers", "state", "dirty", "refresh")
+
+    def __init__(self):
+        self.subscribers: Set[Subscription] = set()
+        self.state: Optional[dict] = None
+        self.dirty = False
+        self.refresh: Optional[asyncio.Task] = None
+
+
+class SessionHub:
+    """Pushes session changes to subscribers (WebSocket/SSE clients) in this worker.
+
+    Each worker keeps one change stream on the sessions collection, whatever
+    the number of subscribers. A change only marks the session dirty; one
+    reload per session then diffs against the last state sent and fans the
+    delta out to every subscriber of that session. Without change streams
+    (standalone MongoDB) the repository reports this worker's own writes instead.
+    """
+
+    def __init__(self, repo, source: str = LIVE_SOURCE, debounce: float = LIVE_DEBOUNCE_SECONDS):
+        self.repo = repo
+        self.requested_source = source
+        self.source = "local"
+        self.debounce = debounce
+        self._topics: Dict[str, _Topic] = {}
+        # Header _id -> session_id, for the sessions someone here is subscribed to;
+        # only delete events need it, every other event names its session
+        self._ids: Dict[object, str] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self.stats = {"events": 0, "refreshes": 0, "resyncs": 0, "changes_seen": 0}
+
+    async def start(self):
+        if self.requested_source == "local":
+            self._use_local()
+            return
+        try:
+            stream = await self._open()
+        except ConnectionFailure as exc:
+            # Not reachable yet; the watcher keeps retrying and local writes still go out meanwhile
+            logger.warning("Could not open the sessions change stream: %s", exc)
+            self._use_local()
+            stream = None
+        except Exception as exc:
+            # A standalone server refuses change streams outright
+            if self.requested_source == "changestream":
+                raise
+            logger.info("Change streams unavailable (%s); live updates cover this worker's writes only", exc)
+            self._use_local()
+            return
+        self._watcher = asyncio.create_task(self._watch(stream))
+
+    async def stop(self):
+        tasks = [self._watcher] if self._watcher else []
+        tasks += [topic.refresh for topic in self._topics.values() if topic.refresh]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._watcher = None
+        self.repo.on_write = None
+
+    def _use_local(self):
+        self.source = "local"
+        self.repo.on_write = self.notify
+
+    async def _open(self):
+        stream = self.repo.collection.watch(WATCH_PIPELINE, full_document="updateLookup")
+        # Opening runs the aggregate, which is where a standalone server refuses
+        return await stream.__aenter__()
+
+    async def _watch(self, stream):
+        delay = 1.0
+        while True:
+            try:
+                if stream is None:
+                    stream = await self._open()
+                    # Rather than resuming, reload what anyone here watches: changes
+                    # made while the stream was down were missed
+                    for session_id in list(self._topics):
+                        self.notify(session_id)
+                self.source = "changestream"
+                self.repo.on_write = None
+                delay = 1.0
+                async for change in stream:
+                    self.stats["changes_seen"] += 1
+                    self._changed(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.warning("Sessions change stream failed, reopening in %.0fs: %s", delay, exc)
+                self._use_local()
+            else:
+                # The server ended the stream (e.g. the collection was dropped); reopen straight away
+                continue
+            finally:
+                if stream is not None:
+                    await self._close(stream)
+                    stream = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LIVE_RETRY_MAX)
+
+    def _changed(self, change: dict):
+        _id = change["documentKey"]["_id"]
+        session_id = (change.get("fullDocument") or {}).get("session_id")
+        if session_id is None:
+            session_id = self._ids.get(_id)
+        elif session_id in self._topics:
+            self._ids[_id] = session_id
+        if session_id is not None:
+            self.notify(session_id)
+
+    async def _close(self, stream):
+        try:
+            await stream.close()
+        except Exception:
+            pass
+
+    async def subscribe(self, session_id: str) -> Subscription:
+        topic = self._topics.setdefault(session_id, _Topic())
+        try:
+            if topic.state is None:
+                # Loading restores an archived session, so the head is only read after it
+                state = await self.repo.load(session_id)
+                if state is None:
+                    raise HTTPException(status_code=404, detail="Session not found")
+                head = await self.repo.collection.find_one({"session_id": session_id}, {"_id": 1})
+                if head is not None:
+                    self._ids[head["_id"]] = session_id
+                if topic.state is None:
+                    topic.state = state
+        except BaseException:
+            if not topic.subscribers:
+                self._drop(session_id)
+            raise
+        subscription = Subscription(self, session_id, topic.state)
+        topic.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        topic = self._topics.get(subscription.session_id)
+        if topic is None:
+            return
+        topic.subscribers.discard(subscription)
+        if not topic.subscribers:
+            self._drop(subscription.session_id)
+
+    def _drop(self, session_id: str):
+        topic = self._topics.pop(session_id, None)
+        if topic is not None and topic.refresh is not None:
+            topic.refresh.cancel()
+        for _id in [k for k, v in self._ids.items() if v == session_id]:
+            del self._ids[_id]
+
+    def current(self, session_id: str) -> Optional[dict]:
+        topic = self._topics.get(session_id)
+        return topic.state if topic else None
+
+    def notify(self, session_id: str):
+        """Mark a session changed; subscribers get one event for a burst of writes."""
+        topic = self._topics.get(session_id)
+        if topic is None:
+            return
+        topic.dirty = True
+        if topic.refresh is None:
+            topic.refresh = asyncio.create_task(self._refresh(session_id, topic))
+
+    async def _refresh(self, session_id: str, topic: _Topic):
+        try:
+            while topic.dirty:
+                await asyncio.sleep(self.debounce)
+                topic.dirty = False
+                self.stats["refreshes"] += 1
+                try:
+                    # Without restoring: a reload must not undo the archiving of a watched session
+                    state = await self.repo.load(session_id, restore=False)
+                    if state is None and self.repo.archive is not None and await self.repo.archive.contains(session_id):
+                        continue
+                except Exception as exc:
+                    logger.warning("Could not reload session %s for live updates: %s", session_id, exc)
+                    continue
+                if state is None:
+                    self._publish(topic, {"type": "deleted", "session": {"session_id": session_id}})
+                    continue
+                if topic.state is not None and state.get("revision", 0) <= topic.state.get("revision", 0):
+                    continue
+                delta = session_delta(topic.state or {}, state)
+                topic.state = state
+                self._publish(topic, {"type": "update", "session": delta})
+        finally:
+            topic.refresh = None
+
+    def _publish(self, topic: _Topic, event: dict):
+        self.stats["events"] += 1
+        for subscription in list(topic.subscribers):
+            subscription.push(event)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "source": self.source, "sessions": len(self._topics),
+                "subscribers": sum(len(t.subscribers) for t in self._topics.values())}
@@ -0,0 +1,360 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from string import Template
+from typing import Dict, Optional, Tuple
+
+from admission import AdmissionController
+from helpers import env_flag
+from metrics import LLM_DURATION, LLM_IN_FLIGHT, phase, record_llm_io
+from resilience import ResilientCaller, parse_fallbacks, LLM_FALLBACK_MODELS
+
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "openai")
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-5.2")
+# Import the SDK in the background at startup instead of on the first model call
+LLM_PREWARM = env_flag("LLM_PREWARM", "1")
+
+logger = logging.getLogger(__name__)
+
+_sdk = None
+
+
+def load_sdk():
+    """The LLM SDK's chat module, imported on first use.
+
+    It pulls in every provider's client library, which takes seconds; nothing
+    that doesn't talk to the model should pay for that.
+    """
+    global _sdk
+    if _sdk is None:
+        from emergentintegrations.llm import chat
+        _sdk = chat
+    return _sdk
+
+
+class Prompt:
+    """A system prompt plus user message template, built once at startup.
+
+    The system text is kept byte-for-byte identical between calls and sent
+    first, which is what provider-side prefix caching (e.g. OpenAI's automatic
+    prompt caching) keys on.
+    """
+
+    def __init__(self, name: str, system: str, user: str):
+        self.name = name
+        self.system = system
+        self._user = Template(user)
+        self._static_user = None if "$" in user else user
+
+    def render(self, **params) -> str:
+        if self._static_user is not None:
+            return self._static_user
+        return self._user.substitute(**params)
+
+
+ANALYZE_PROMPT = Prompt(
+    "analyze",
+    system="""You are Nudge, a gentle and encouraging cleaning assistant designed for neurodivergent people who struggle with task paralysis.
+
+When analyzing a photo of a space, you should:
+1. Assess the overall state warmly and without judgment
+2. Identify the easiest area to start with (the "quick win")
+3. Rate the difficulty from 1-5 (1=light tidying, 5=major declutter)
+4. Identify 3-6 distinct zones/areas that need attention
+5. For each zone, give a brief, encouraging description
+
+ALWAYS respond in valid JSON with this exact structure:
+{
+  "overview": "A warm, non-judgmental description of the space",
+  "encouragement": "A short motivational message",
+  "difficulty": 3,
+  "quick_win": "The easiest thing to tackle first",
+  "zones": [
+    {"name": "Zone name", "description": "What needs doing here", "priority": 1, "estimated_minutes": 10}
+  ]
+}""",
+    user="Please analyze this space and help me figure out where to start cleaning. Remember to be gentle and encouraging - I might be feeling overwhelmed! Respond ONLY with valid JSON.",
+)
+
+TASKS_PROMPT = Prompt(
+    "tasks",
+    system="""You are Nudge, a gentle cleaning coach. Based on a space analysis, create a list of small, manageable cleaning tasks.
+
+RULES:
+- Each task should take 2-10 minutes MAX
+- Start with the easiest tasks (quick wins first!)
+- Use encouraging, gentle language
+- Be specific: "Pick up the 3 cups on the desk" not "Clean the desk"
+- Include small celebration moments between groups of tasks
+
+Respond ONLY with valid JSON array:
+[
+  {"title": "Short task title", "description": "Gentle detailed instruction", "estimated_minutes": 5, "category": "pickup|wipe|organize|sort|celebrate", "encouragement": "You're doing great!"}
+]""",
+    user="Based on this space analysis, create a step-by-step cleaning plan with small, manageable tasks. Here's the analysis:\n$analysis\n\nRespond ONLY with valid JSON array.",
+)
+
+ITEMS_PROMPT = Prompt(
+    "items",
+    system="""You are Nudge, a gentle decluttering assistant. When shown a photo of items/clutter, identify individual items that the user might want to sort into Keep, Sell, or Donate.
+
+Group similar items together. Be specific but kind.
+
+Respond ONLY with valid JSON array:
+[
+  {"name": "Item name", "description": "Brief description", "category": "clothing|electronics|books|kitchenware|decor|toys|misc", "suggestion": "keep|sell|donate", "reason": "Why you suggest this"}
+]""",
+    user="Please identify the items in this photo that I could sort into Keep, Sell, or Donate categories. Be gentle and helpful! Respond ONLY with valid JSON array.",
+)
+
+REPAIR_PROMPT = Prompt(
+    "repair",
+    system="You convert malformed model output into valid JSON. Keep the original content, fix only the structure, and reply with the JSON alone.",
+    user="This output could not be parsed ($error). Return it as valid JSON shaped like:\n$schema\n\nOutput:\n$text",
+)
+
+PROMPTS = {p.name: p for p in (ANALYZE_PROMPT, TASKS_PROMPT, ITEMS_PROMPT, REPAIR_PROMPT)}
+
+
+def parse_target(value: str) -> Tuple[str, str]:
+    provider, _, model = value.partition("/")
+    return (provider, model) if model else (LLM_PROVIDER, provider)
+
+
+class _Pool:
+    def __init__(self):
+        self.in_use = 0
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last: Optional[dict] = None
+
+
+class LlmClientManager:
+    """Hands out LLM clients per provider/model and records call timings.
+
+    LlmChat keeps its own message history, so one instance is built per call;
+    the underlying HTTP transport is shared process-wide by the SDK, which is
+    where keep-alive connection reuse happens. What is pooled here is the
+    precompiled prompts and model routing; per-model concurrency is bounded
+    by the AdmissionController.
+
+    Model routing: LLM_PROVIDER/LLM_MODEL set the default, and
+    LLM_MODEL_ANALYZE / LLM_MODEL_TASKS / LLM_MODEL_ITEMS override a single
+    prompt with "provider/model" or just "model".
+    """
+
+    def __init__(self, api_key: str, prompts: Dict[str, Prompt] = PROMPTS,
+                 admission: Optional[AdmissionController] = None,
+                 resilience: Optional[ResilientCaller] = None):
+        self.api_key = api_key
+        self.prompts = prompts
+        self.admission = admission or AdmissionController()
+        self.resilience = resilience or ResilientCaller(fallbacks=parse_fallbacks(LLM_FALLBACK_MODELS, LLM_PROVIDER),
+                                                        admission=self.admission)
+        self.default_target = (LLM_PROVIDER, LLM_MODEL)
+        self.targets = {}
+        for name in prompts:
+            override = os.environ.get(f"LLM_MODEL_{name.upper()}")
+            self.targets[name] = parse_target(override) if override else self.default_target
+        self._pools: Dict[Tuple[str, str], _Pool] = {}
+        self._loading: Optional[asyncio.Future] = None
+
+    def target(self, purpose: str) -> Tuple[str, str]:
+        return self.targets.get(purpose, self.default_target)
+
+    def model_key(self, purpose: str) -> str:
+        return "/".join(self.target(purpose))
+
+    def _pool(self, target: Tuple[str, str]) -> _Pool:
+        pool = self._pools.get(target)
+        if pool is None:
+            pool = self._pools[target] = _Pool()
+        return pool
+
+    def warm(self):
+        for name in self.prompts:
+            self._pool(self.target(name))
+        if LLM_PREWARM:
+            self._load().add_done_callback(self._warmed)
+
+    def _warmed(self, loading: asyncio.Future):
+        if not loading.cancelled() and loading.exception() is not None:
+            logger.warning("Could not import the LLM SDK: %s", loading.exception())
+
+    def _load(self) -> asyncio.Future:
+        # Imported in a thread so the event loop keeps serving meanwhile; a failed import is retried
+        if self._loading is None or (self._loading.done() and _sdk is None):
+            self._loading = asyncio.ensure_future(asyncio.to_thread(load_sdk))
+        return self._loading
+
+    async def ready(self):
+        """Wait until the SDK is imported."""
+        if _sdk is None:
+            await asyncio.shield(self._load())
+
+    def _chat(self, purpose: str, target: Tuple[str, str]):
+        return load_sdk().LlmChat(
+            api_key=self.api_key,
+            session_id=f"{purpose}-{uuid.uuid4().hex[:8]}",
+            system_message=self.prompts[purpose].system,
+        ).with_model(*target)
+
+    def _message(self, purpose: str, image_base64: Optional[str], params: dict):
+        text = self.prompts[purpose].render(**params)
+        sdk = load_sdk()
+        if image_base64 is None:
+            return sdk.UserMessage(text=text)
+        return sdk.UserMessage(text=text, file_contents=[sdk.ImageContent(image_base64=image_base64)])
+
+    def _text_size(self, purpose: str, message) -> int:
+        return len(self.prompts[purpose].system) + len(message.text)
+
+    def _record(self, pool: _Pool, timing: dict, ok: bool):
+        pool.calls += 1
+        if not ok:
+            pool.errors += 1
+        pool.total_ms += timing["total_ms"]
+        pool.max_ms = max(pool.max_ms, timing["total_ms"])
+        pool.last = timing
+
+    async def send(self, purpose: str, image_base64: Optional[str] = None,
+                   target: Optional[Tuple[str, str]] = None, **params) -> str:
+        target = target or self.target(purpose)
+        pool = self._pool(target)
+        await self.ready()
+        queued = time.perf_counter()
+        model = "/".join(target)
+        # Admission slots are taken per upstream call inside the resilience layer,
+        # so retries, hedges and fallbacks each hold one for the model they go to
+        started = []
+        ok = False
+        message = self._message(purpose, image_base64, params)
+
+        async def attempt(current):
+            if not started:
+                started.append(time.perf_counter())
+            current_pool = self._pool(current)
+            current_model = "/".join(current)
+            current_pool.in_use += 1
+            LLM_IN_FLIGHT.inc((current_model,))
+            try:
+                return await self._chat(purpose, current).send_message(message)
+            finally:
+                current_pool.in_use -= 1
+                LLM_IN_FLIGHT.dec((current_model,))
+
+        try:
+            with phase("llm_call", purpose=purpose, model=model):
+                response = await self.resilience.call(attempt, target)
+            ok = True
+            record_llm_io(purpose, self._text_size(purpose, message), len(image_base64 or ""), len(response))
+            return response
+        finally:
+            end = time.perf_counter()
+            start = started[0] if started else end
+            LLM_DURATION.observe(end - start, (purpose, model, "ok" if ok else "error"))
+            total = round((end - start) * 1000, 1)
+            self._record(pool, {
+                "purpose": purpose,
+                "wait_ms": round((start - queued) * 1000, 1),
+                # send_message returns the whole reply at once, so there is no first byte to time
+                "first_byte_ms": None,
+                "total_ms": total,
+            }, ok)
+
+    async def stream(self, purpose: str, image_base64: Optional[str] = None,
+                     target: Optional[Tuple[str, str]] = None, **params):
+        """Yield reply text as it arrives.
+
+        The first chunk, and each one after it, must arrive within the
+        resilience timeout. If the stream fails before anything was yielded the
+        reply is fetched with send() instead, which retries and falls back to
+        other models; a failure mid-stream is raised as is.
+        """
+        streamed = False
+        try:
+            async for chunk in self._stream(purpose, image_base64, target, params):
+                streamed = True
+                yield chunk
+            return
+        except Exception as exc:
+            if streamed:
+                raise
+            logger.warning("Streaming %s failed before the first chunk, sending instead: %s", purpose, exc)
+        yield await self.send(purpose, image_base64, target, **params)
+
+    async def _stream(self, purpose: str, image_base64: Optional[str], target: Optional[Tuple[str, str]],
+                      params: dict):
+        # Falls back to a single chunk when the client has no stream_message
+        target = target or self.target(purpose)
+        pool = self._pool(target)
+        await self.ready()
+        queued = time.perf_counter()
+        model = "/".join(target)
+        timeout = self.resilience.timeout
+        async with self.admission.slot(model):
+            start = time.perf_counter()
+            first = None
+            pool.in_use += 1
+            LLM_IN_FLIGHT.inc((model,))
+            ok = False
+            received = 0
+            message = None
+            chunks = None
+            try:
+                chat = self._chat(purpose, target)
+                message = self._message(purpose, image_base64, params)
+                stream_message = getattr(chat, "stream_message", None)
+                if stream_message is None:
+                    # The whole reply arrives at once, so as in send() there is no first byte to time
+                    text = await asyncio.wait_for(chat.send_message(message), timeout)
+                    received = len(text)
+                    yield text
+                else:
+                    chunks = stream_message(message).__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+                        except StopAsyncIteration:
+                            break
+                        if first is None:
+                            first = time.perf_counter()
+                        received += len(chunk)
+                        yield chunk
+                ok = True
+            finally:
+                if chunks is not None and hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+                pool.in_use -= 1
+                LLM_IN_FLIGHT.dec((model,))
+                end = time.perf_counter()
+                LLM_DURATION.observe(end - start, (purpose, model, "ok" if ok else "error"))
+                if message is not None:
+                    record_llm_io(purpose, self._text_size(purpose, message), len(image_base64 or ""), received)
+                self._record(pool, {
+                    "purpose": purpose,
+                    "wait_ms": round((start - queued) * 1000, 1),
+                    "first_byte_ms": round((first - start) * 1000, 1) if first is not None else None,
+                    "total_ms": round((end - start) * 1000, 1),
+                }, ok)
+
+    def snapshot(self) -> dict:
+        out = {
+            "targets": {name: "/".join(t) for name, t in self.targets.items()},
+            "resilience": self.resilience.snapshot(),
+            "pools": {},
+        }
+        for target, pool in self._pools.items():
+            out["pools"]["/".join(target)] = {
+                "in_use": pool.in_use,
+                "calls": pool.calls,
+                "errors": pool.errors,
+                "avg_ms": round(pool.total_ms / pool.calls, 1) if pool.calls else 0.0,
+                "max_ms": round(pool.max_ms, 1),
+                "last": pool.last,
+            }
+        return out
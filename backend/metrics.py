@@ -0,0 +1,332 @@
+import os
+import math
+import time
+import logging
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from pymongo import monitoring
+
+from helpers import env_flag
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = env_flag("METRICS_ENABLED", "1")
+# Spans are exported over OTLP/HTTP only when this is set and opentelemetry-sdk is installed
+OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "nudge-api")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+PARSE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, math.inf)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, math.inf)
+# Rough chars-per-token for text; the LLM SDK does not report usage
+CHARS_PER_TOKEN = 4
+
+Labels = Tuple[str, ...]
+# (name, type, help, [(labels, value), ...]) produced by a collector at scrape time
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Family:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Labels, object] = {}
+        # Mongo listeners and executor threads record too, not just the event loop
+        self._lock = threading.Lock()
+
+    def _labels(self, values: Labels) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(self._labels(values), child))
+        return lines
+
+
+class Counter(_Family):
+    type = "counter"
+
+    def inc(self, labels: Labels = (), amount: float = 1):
+        with self._lock:
+            self._children[labels] = self._children.get(labels, 0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._children.get(labels, 0)
+
+    def _render_child(self, labels, value):
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, labels: Labels = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def set(self, value: float, labels: Labels = ()):
+        with self._lock:
+            self._children[labels] = value
+
+
+class Histogram(_Family):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: Labels = ()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(labels)
+            if child is None:
+                child = self._children[labels] = [[0] * len(self.buckets), 0.0, 0]
+            child[0][index] += 1
+            child[1] += value
+            child[2] += 1
+
+    def snapshot(self, labels: Labels = ()) -> dict:
+        """One child as cumulative bucket counts, for the JSON stats endpoints."""
+        counts, total, count = self._children.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            buckets[_format_value(bound)] = cumulative
+        return {"count": count, "sum": round(total, 4), "buckets": buckets}
+
+    def _render_child(self, labels, child):
+        counts, total, count = child
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {total!r}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Metric families plus collectors that turn existing stats snapshots into samples."""
+
+    def __init__(self):
+        self.families: List[_Family] = []
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def add(self, family):
+        self.families.append(family)
+        return family
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.add(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        self.collectors.append(collector)
+
+    def unregister_collector(self, collector: Callable[[], Iterable[Sample]]):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self) -> str:
+        lines = []
+        for family in self.families:
+            lines.extend(family.render())
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception as exc:
+                logger.warning("Metrics collector failed: %s", exc)
+                continue
+            for name, kind, help, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in values)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_DURATION = REGISTRY.histogram("http_request_duration_seconds", "Request latency by route (streams: until the last byte)",
+                                   ("method", "route", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "Requests currently being served")
+PHASE_DURATION = REGISTRY.histogram("phase_duration_seconds", "Time spent in one phase of request handling", ("phase",))
+LLM_DURATION = REGISTRY.histogram("llm_call_duration_seconds", "LLM round-trip including retries, excluding admission wait",
+                                  ("purpose", "model", "outcome"))
+LLM_IN_FLIGHT = REGISTRY.gauge("llm_calls_in_flight", "LLM calls holding an admission slot", ("model",))
+LLM_BYTES = REGISTRY.counter("llm_bytes_total", "Prompt/image bytes sent and reply bytes received", ("purpose", "direction"))
+LLM_TOKENS = REGISTRY.counter("llm_estimated_tokens_total", "Text tokens estimated from characters", ("purpose", "direction"))
+MONGO_DURATION = REGISTRY.histogram("mongodb_command_duration_seconds", "MongoDB command latency from the driver",
+                                    ("command", "collection", "outcome"), buckets=DB_BUCKETS)
+MONGO_IN_FLIGHT = REGISTRY.gauge("mongodb_commands_in_flight", "MongoDB commands sent and not yet answered")
+ADMISSION_WAIT = REGISTRY.histogram("admission_wait_seconds", "Time model calls waited for an admission slot", ("model",))
+PARSE_DURATION = REGISTRY.histogram("model_output_parse_seconds", "Time to extract and validate a model reply",
+                                    ("kind",), buckets=PARSE_BUCKETS)
+
+
+def record_llm_io(purpose: str, text_sent: int, image_sent: int, received: int):
+    """Count one call's payload sizes (in characters) and estimated text tokens."""
+    LLM_BYTES.inc((purpose, "sent"), text_sent + image_sent)
+    LLM_BYTES.inc((purpose, "received"), received)
+    LLM_TOKENS.inc((purpose, "sent"), text_sent // CHARS_PER_TOKEN)
+    LLM_TOKENS.inc((purpose, "received"), received // CHARS_PER_TOKEN)
+
+
+# --- Tracing ---
+_tracer = None
+_provider = None
+
+
+def setup_tracing() -> bool:
+    """Export spans to OTEL_EXPORTER_OTLP_ENDPOINT when configured; a no-op otherwise."""
+    global _tracer, _provider
+    if not OTEL_EXPORTER_OTLP_ENDPOINT or _tracer is not None:
+        return _tracer is not None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        logger.warning("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk/exporter is not installed")
+        return False
+    _provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # The exporter reads the endpoint (and headers) from the standard OTEL_* variables
+    _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(_provider)
+    _tracer = trace.get_tracer("nudge")
+    return True
+
+
+def shutdown_tracing():
+    global _tracer, _provider
+    if _provider is not None:
+        _provider.shutdown()
+    _tracer = _provider = None
+
+
+class phase:
+    """Time a block into phase_duration_seconds, as a child span when tracing is on.
+
+    A plain class rather than @contextmanager: it is entered on every request.
+    """
+
+    __slots__ = ("name", "attributes", "start", "span")
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        if _tracer is not None:
+            self.span = _tracer.start_as_current_span(self.name, attributes=self.attributes)
+            self.span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        PHASE_DURATION.observe(time.perf_counter() - self.start, (self.name,))
+        if self.span is not None:
+            self.span.__exit__(*exc_info)
+        return False
+
+
+# --- HTTP ---
+class MetricsMiddleware:
+    """Plain ASGI middleware: latency per route template and an in-flight gauge.
+
+    Routes are labelled with their template (e.g. /api/sessions/{session_id})
+    so the series count stays bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        span = _tracer.start_span(scope["method"]) if _tracer is not None else None
+        try:
+            if span is None:
+                await self.app(scope, receive, send_wrapper)
+            else:
+                from opentelemetry import trace
+                with trace.use_span(span, end_on_exit=False):
+                    await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_DURATION.observe(time.perf_counter() - start, (scope["method"], route, str(status[0])))
+            if span is not None:
+                span.update_name(f"{scope['method']} {route}")
+                span.set_attribute("http.route", route)
+                span.set_attribute("http.response.status_code", status[0])
+                span.end()
+
+
+# --- MongoDB ---
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Driver command timings, registered on the Motor client as an event listener."""
+
+    def __init__(self):
+        self._collections: Dict[tuple, str] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        collection = target if isinstance(target, str) else ""
+        self._collections[(event.connection_id, event.request_id)] = collection
+        MONGO_IN_FLIGHT.inc()
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_IN_FLIGHT.dec()
+        MONGO_DURATION.observe(event.duration_micros / 1e6, (event.command_name, collection, outcome))
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
@@ -0,0 +1,122 @@
+"""Move session tasks/items between embedded arrays and their own collections.
+
+Run from backend/ before switching SESSION_STORAGE to "split":
+
+    python migrate_sessions.py --dry-run
+    python migrate_sessions.py
+    python migrate_sessions.py --reverse        # back to embedded arrays
+    python migrate_sessions.py --purge-orphans  # drop children of expired sessions
+    python migrate_sessions.py --convert-dates  # ISO-string timestamps to dates
+
+Each session is converted independently and the conversion is idempotent, so
+an interrupted run can simply be restarted.
+"""
+import os
+import asyncio
+import argparse
+from datetime import datetime
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from database import create_client  # noqa: E402
+from session_repo import SplitSessionRepository, LIST_FIELDS  # noqa: E402
+
+
+DATE_FIELDS = ("created_at", "updated_at")
+
+
+def repository(db) -> SplitSessionRepository:
+    return SplitSessionRepository(db["sessions"], db["session_tasks"], db["session_items"])
+
+
+async def split_sessions(repo: SplitSessionRepository, batch_size: int, dry_run: bool) -> int:
+    query = {"$or": [{name: {"$exists": True}} for name in LIST_FIELDS]}
+    projection = {"_id": 0, "session_id": 1, **{name: 1 for name in LIST_FIELDS}}
+    moved = 0
+    async for doc in repo.collection.find(query, projection, batch_size=batch_size):
+        moved += 1
+        if dry_run:
+            continue
+        # Children first: a crash between the two writes leaves both copies, and a
+        # rerun rewrites the children from the arrays that are still there.
+        await asyncio.gather(*(repo.write_list(name, doc["session_id"], doc[name])
+                               for name in LIST_FIELDS if name in doc))
+        await repo.collection.update_one({"session_id": doc["session_id"]},
+                                         {"$unset": {name: "" for name in LIST_FIELDS}})
+    return moved
+
+
+async def embed_sessions(repo: SplitSessionRepository, batch_size: int, dry_run: bool) -> int:
+    # Sessions that still have embedded arrays were never split; leave them alone
+    query = {name: {"$exists": False} for name in LIST_FIELDS}
+    moved = 0
+    async for doc in repo.collection.find(query, {"_id": 0, "session_id": 1}, batch_size=batch_size):
+        moved += 1
+        if dry_run:
+            continue
+        lists = await asyncio.gather(*(repo.read_list(name, doc["session_id"]) for name in LIST_FIELDS))
+        await repo.collection.update_one({"session_id": doc["session_id"]},
+                                         {"$set": dict(zip(LIST_FIELDS, lists))})
+        await asyncio.gather(*(repo.children[name].delete_many({"session_id": doc["session_id"]})
+                               for name in LIST_FIELDS))
+    return moved
+
+
+async def purge_orphans(repo: SplitSessionRepository, dry_run: bool) -> int:
+    purged = set()
+    for name in LIST_FIELDS:
+        for session_id in await repo.children[name].distinct("session_id"):
+            if await repo.collection.find_one({"session_id": session_id}, {"_id": 1}):
+                continue
+            purged.add(session_id)
+            if not dry_run:
+                await repo.children[name].delete_many({"session_id": session_id})
+    return len(purged)
+
+
+async def convert_dates(repo: SplitSessionRepository, batch_size: int, dry_run: bool) -> int:
+    """Rewrite created_at/updated_at stored as isoformat() strings as BSON dates."""
+    query = {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
+    converted = 0
+    async for doc in repo.collection.find(query, {"_id": 0, "session_id": 1, **dict.fromkeys(DATE_FIELDS, 1)},
+                                          batch_size=batch_size):
+        converted += 1
+        if not dry_run:
+            dates = {f: datetime.fromisoformat(doc[f]) for f in DATE_FIELDS if isinstance(doc.get(f), str)}
+            await repo.collection.update_one({"session_id": doc["session_id"]}, {"$set": dates})
+    return converted
+
+
+async def run(args) -> dict:
+    client = create_client(os.environ["MONGO_URL"])
+    repo = repository(client[os.environ["DB_NAME"]])
+    try:
+        if not args.dry_run:
+            await repo.ensure_indexes()
+        if args.convert_dates:
+            return {"sessions_with_string_dates": await convert_dates(repo, args.batch_size, args.dry_run)}
+        if args.purge_orphans:
+            return {"orphaned_sessions": await purge_orphans(repo, args.dry_run)}
+        convert = embed_sessions if args.reverse else split_sessions
+        return {"sessions": await convert(repo, args.batch_size, args.dry_run)}
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reverse", action="store_true", help="move children back into embedded arrays")
+    parser.add_argument("--purge-orphans", action="store_true", help="delete children whose session is gone")
+    parser.add_argument("--convert-dates", action="store_true", help="store string timestamps as dates")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true", help="only count what would change")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    verb = "would change" if args.dry_run else "changed"
+    for key, value in result.items():
+        print(f"{verb} {value} {key.replace('_', ' ')}")
+
+
+if __name__ == "__main__":
+    main()
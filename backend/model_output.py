@@ -0,0 +1,348 @@
+import time
+import json
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+from metrics import PARSE_DURATION
+
+
+class OutputParseError(ValueError):
+    pass
+
+
+# --- Schemas ---
+class _Lenient(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+class Zone(_Lenient):
+    name: str = "Zone"
+    description: str = ""
+    priority: int = 1
+    estimated_minutes: int = 10
+
+
+class SpaceAnalysis(_Lenient):
+    overview: str = ""
+    encouragement: str = ""
+    difficulty: int = 3
+    quick_win: str = ""
+    zones: List[Zone] = []
+
+    @field_validator("zones", mode="before")
+    @classmethod
+    def _lenient_zones(cls, value):
+        if not isinstance(value, list):
+            return []
+        zones = []
+        for zone in value:
+            try:
+                zones.append(_validate(Zone, zone))
+            except ValidationError:
+                continue
+        return zones
+
+
+class TaskDraft(_Lenient):
+    title: str = "Task"
+    description: str = ""
+    estimated_minutes: int = 5
+    category: str = "pickup"
+    encouragement: str = "You're doing amazing!"
+
+
+class ItemDraft(_Lenient):
+    name: str = "Item"
+    description: str = ""
+    category: str = "misc"
+    suggestion: str = "keep"
+    reason: str = ""
+
+
+# kind -> (top-level JSON type, schema)
+SCHEMAS = {
+    "analysis": ("{", SpaceAnalysis),
+    "tasks": ("[", TaskDraft),
+    "items": ("[", ItemDraft),
+}
+
+
+# --- Extraction ---
+def extract_json(text: str, opener: str = "{[") -> tuple:
+    """Find and repair the first JSON object/array in `text` in one pass.
+
+    Skips prose and code fences before the payload, drops trailing commas,
+    and closes a truncated payload at the last complete element. Returns
+    (json_text, repaired).
+    """
+    start = -1
+    for i, ch in enumerate(text):
+        if ch in opener:
+            start = i
+            break
+    if start < 0:
+        raise OutputParseError("no JSON payload found")
+
+    out = []
+    stack = []
+    in_string = False
+    escape = False
+    repaired = False
+    safe = (0, ())
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in "{[":
+            nested = bool(stack)
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+            # A nested object cut off before its first member would close as a phantom `{}` entry
+            if ch == "[" or not nested:
+                safe = (len(out), tuple(stack))
+        elif ch in "}]":
+            # Trailing comma before a closer
+            j = len(out) - 1
+            while j >= 0 and out[j] in " \t\r\n":
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j:]
+                repaired = True
+            if not stack or stack[-1] != ch:
+                raise OutputParseError(f"unbalanced '{ch}' at offset {i}")
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                return "".join(out), repaired
+            safe = (len(out), tuple(stack))
+        elif ch == ",":
+            safe = (len(out), tuple(stack))
+            out.append(ch)
+        else:
+            out.append(ch)
+
+    # Truncated: keep everything up to the last complete element and close it off
+    length, open_stack = safe
+    body = "".join(out[:length]).rstrip().rstrip(",")
+    return body + "".join(reversed(open_stack)), True
+
+
+def _validate(schema, data):
+    """Validate, dropping fields that fail so defaults apply instead of rejecting the object."""
+    try:
+        return schema.model_validate(data).model_dump()
+    except ValidationError as exc:
+        if not isinstance(data, dict):
+            raise
+        bad = {err["loc"][0] for err in exc.errors() if err["loc"]}
+        return schema.model_validate({k: v for k, v in data.items() if k not in bad}).model_dump()
+
+
+def coerce(kind: str, data: dict) -> dict:
+    """Fit an already-stored object to its schema, dropping fields that don't validate."""
+    return _validate(SCHEMAS[kind][1], data)
+
+
+class ArrayStream:
+    """Incrementally pull validated entries out of a streamed JSON array.
+
+    Model output arrives in arbitrary text chunks, possibly wrapped in a
+    ```json fence or preceded by prose. Everything before the first `[` is
+    ignored; after that each top-level `{...}` goes through the same repair
+    and validation as OutputParser.parse as soon as its closing brace
+    arrives. Entries that still don't fit are dropped rather than failing the
+    whole stream. Call close() when the stream ends to record the parse.
+    """
+
+    def __init__(self, parser: "OutputParser", kind: str):
+        self.parser = parser
+        self.kind = kind
+        self.elapsed = 0.0
+        self.repaired = False
+        self.entries = 0
+        self.dropped = 0
+        self._buf = ""
+        self._pos = 0
+        self._started = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = -1
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def feed(self, chunk: str) -> List[dict]:
+        if self._finished:
+            return []
+        start = time.perf_counter()
+        try:
+            return self._scan(chunk)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def _scan(self, chunk: str) -> List[dict]:
+        self._buf += chunk
+        out = []
+        buf = self._buf
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            ch = buf[i]
+            if not self._started:
+                if ch == "[":
+                    self._started = True
+                i += 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0 and ch == "]":
+                    self._finished = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start >= 0:
+                    entry = self._entry(buf[self._obj_start:i + 1])
+                    if entry is not None:
+                        out.append(entry)
+                    self._obj_start = -1
+            i += 1
+
+        # Drop consumed text so the buffer only holds the object in progress
+        keep_from = self._obj_start if self._obj_start >= 0 else i
+        self._buf = buf[keep_from:]
+        self._pos = i - keep_from
+        if self._obj_start >= 0:
+            self._obj_start = 0
+        return out
+
+    def _entry(self, text: str) -> Optional[dict]:
+        try:
+            payload, repaired = extract_json(text, "{")
+            value = json.loads(payload)
+        except ValueError:
+            self.dropped += 1
+            self.parser.stats[self.kind]["dropped_entries"] += 1
+            return None
+        entry = self.parser.validate_entry(self.kind, value)
+        if entry is None:
+            self.dropped += 1
+            return None
+        self.repaired = self.repaired or repaired
+        self.entries += 1
+        return entry
+
+    def close(self):
+        """Record the parse like OutputParser.parse; raises if nothing usable arrived."""
+        stats = self.parser.stats[self.kind]
+        PARSE_DURATION.observe(self.elapsed, (self.kind,))
+        if not self._started:
+            stats["failed"] += 1
+            raise OutputParseError("no JSON payload found")
+        if self.dropped and not self.entries:
+            stats["failed"] += 1
+            raise OutputParseError("no valid entries in array")
+        stats["ok"] += 1
+        if self.repaired or not self._finished:
+            stats["repaired"] += 1
+
+
+class OutputParser:
+    """Parses model replies into validated dicts and keeps success/latency stats."""
+
+    def __init__(self):
+        self.stats = {kind: {"ok": 0, "repaired": 0, "reprompted": 0, "failed": 0, "dropped_entries": 0}
+                      for kind in SCHEMAS}
+
+    def parse(self, text: str, kind: str, reprompted: bool = False):
+        opener, schema = SCHEMAS[kind]
+        stats = self.stats[kind]
+        start = time.perf_counter()
+        try:
+            payload, repaired = extract_json(text, opener)
+            try:
+                data = json.loads(payload)
+            except ValueError as exc:
+                raise OutputParseError(f"invalid JSON: {exc}")
+            if opener == "[":
+                if not isinstance(data, list):
+                    raise OutputParseError("expected a JSON array")
+                result = []
+                for entry in data:
+                    try:
+                        result.append(_validate(schema, entry))
+                    except ValidationError:
+                        stats["dropped_entries"] += 1
+                if data and not result:
+                    raise OutputParseError("no valid entries in array")
+            else:
+                try:
+                    result = _validate(schema, data)
+                except ValidationError as exc:
+                    raise OutputParseError(str(exc))
+        except OutputParseError:
+            stats["failed"] += 1
+            raise
+        finally:
+            PARSE_DURATION.observe(time.perf_counter() - start, (kind,))
+
+        stats["ok"] += 1
+        if repaired:
+            stats["repaired"] += 1
+        if reprompted:
+            stats["reprompted"] += 1
+        return result
+
+    def validate_entry(self, kind: str, entry) -> Optional[dict]:
+        """Validate one streamed array entry; None if it has to be dropped."""
+        try:
+            return _validate(SCHEMAS[kind][1], entry)
+        except ValidationError:
+            self.stats[kind]["dropped_entries"] += 1
+            return None
+
+    def stream(self, kind: str) -> ArrayStream:
+        """An incremental parser for a streamed reply of an array `kind`."""
+        return ArrayStream(self, kind)
+
+    def snapshot(self) -> dict:
+        out = {}
+        for kind, stats in self.stats.items():
+            attempts = stats["ok"] + stats["failed"]
+            out[kind] = {
+                **stats,
+                "success_rate": round(stats["ok"] / attempts, 4) if attempts else None,
+                "parse_seconds": PARSE_DURATION.snapshot((kind,)),
+            }
+        return out
+
+
+def schema_hint(kind: Optional[str]) -> str:
+    opener, schema = SCHEMAS[kind]
+    shape = json.dumps(schema().model_dump())
+    return f"[{shape}, ...]" if opener == "[" else shape
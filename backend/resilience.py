@@ -0,0 +1,192 @@
+import os
+import random
+import asyncio
+import logging
+from collections import deque
+from contextlib import nullcontext
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from helpers import env_flag
+
+logger = logging.getLogger(__name__)
+
+LLM_CALL_TIMEOUT = float(os.environ.get("LLM_CALL_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.environ.get("LLM_BACKOFF_MAX", "8"))
+LLM_HEDGE = env_flag("LLM_HEDGE", "0")
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Comma-separated "provider/model" entries tried in order once the primary gives up
+LLM_FALLBACK_MODELS = os.environ.get("LLM_FALLBACK_MODELS", "")
+
+# What clients are told once every attempt failed; the attempts themselves stay server-side
+LLM_CALL_ERROR_DETAIL = "The assistant is having trouble right now, please try again"
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+RETRYABLE_NAMES = ("timeout", "ratelimit", "connection", "serviceunavailable", "internalserver", "overloaded")
+
+Target = Tuple[str, str]
+
+
+class LlmCallError(Exception):
+    def __init__(self, message: str, attempts: List[dict]):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    name = type(exc).__name__.lower()
+    return any(marker in name for marker in RETRYABLE_NAMES)
+
+
+def parse_fallbacks(value: str, default_provider: str) -> List[Target]:
+    targets = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        provider, _, model = entry.partition("/")
+        targets.append((provider, model) if model else (default_provider, provider))
+    return targets
+
+
+class LatencyTracker:
+    """Recent successful call latencies per target, for picking a hedge delay."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[Target, deque] = {}
+
+    def observe(self, target: Target, seconds: float):
+        self._samples.setdefault(target, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, target: Target, q: float) -> Optional[float]:
+        samples = self._samples.get(target)
+        if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ResilientCaller:
+    """Timeouts, retries with backoff, optional hedging and a fallback chain.
+
+    `attempt(target)` performs one upstream call. Each target in the chain
+    gets up to `max_retries` retries on retryable errors; with hedging on, a
+    second identical call is started once the first has run longer than the
+    target's recent p95, and whichever finishes first wins.
+
+    With an AdmissionController, every call holds a slot of the model it goes
+    to: the first try, each retry and fallback, and the hedge, which is only
+    sent when that model has a slot free. Slots are released during backoff.
+    """
+
+    def __init__(self, timeout: float = LLM_CALL_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE, backoff_max: float = LLM_BACKOFF_MAX,
+                 hedge: bool = LLM_HEDGE, hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+                 fallbacks: Sequence[Target] = (), admission=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.fallbacks = list(fallbacks)
+        self.admission = admission
+        self.latency = LatencyTracker()
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0,
+                      "fallbacks": 0, "failures": 0}
+
+    def _backoff(self, retry: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** retry))
+        return random.uniform(delay / 2, delay)
+
+    async def _timed(self, attempt: Callable[[Target], Awaitable], target: Target):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await asyncio.wait_for(attempt(target), self.timeout)
+        self.latency.observe(target, loop.time() - start)
+        return result
+
+    def _slot(self, target: Target):
+        return self.admission.slot("/".join(target)) if self.admission is not None else nullcontext()
+
+    async def _backup(self, attempt: Callable[[Target], Awaitable], target: Target):
+        async with self._slot(target):
+            return await self._timed(attempt, target)
+
+    async def _hedged(self, attempt: Callable[[Target], Awaitable], target: Target):
+        delay = self.latency.percentile(target, self.hedge_percentile) if self.hedge else None
+        primary = asyncio.ensure_future(self._timed(attempt, target))
+        pending = {primary}
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+            if self.admission is not None and not self.admission.has_free_slot("/".join(target)):
+                # A hedge would queue behind other callers' first tries; not worth it under load
+                self.stats["hedges_skipped"] += 1
+                return await primary
+
+            self.stats["hedges"] += 1
+            backup = asyncio.ensure_future(self._backup(attempt, target))
+            pending.add(backup)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also when the caller is cancelled while waiting out the hedge delay
+            for task in pending:
+                task.cancel()
+
+    async def call(self, attempt: Callable[[Target], Awaitable], target: Target):
+        self.stats["calls"] += 1
+        attempts = []
+        chain = [target] + [t for t in self.fallbacks if t != target]
+        for position, current in enumerate(chain):
+            if position:
+                self.stats["fallbacks"] += 1
+                logger.warning("Falling back to %s/%s", *current)
+            for retry in range(self.max_retries + 1):
+                # Being shed or timing out in the admission queue is raised as is, not retried
+                async with self._slot(current):
+                    try:
+                        return await self._hedged(attempt, current)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as exc:
+                        error = exc
+                retryable = is_retryable(error)
+                attempts.append({"target": "/".join(current), "error": f"{type(error).__name__}: {error}",
+                                 "retryable": retryable})
+                if not retryable:
+                    break
+                if retry < self.max_retries:
+                    self.stats["retries"] += 1
+                    await asyncio.sleep(self._backoff(retry))
+        self.stats["failures"] += 1
+        raise LlmCallError(f"LLM call failed after {len(attempts)} attempts", attempts)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "timeout_s": self.timeout,
+            "max_retries": self.max_retries,
+            "hedging": self.hedge,
+            "fallback_models": ["/".join(t) for t in self.fallbacks],
+        }
@@ -1,36 +1,107 @@
 import os
+import json
+import orjson
 import uuid
+import logging
+import asyncio
 import base64
-import tempfile
+import zlib
+from contextlib import asynccontextmanager
+from functools import partial
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Annotated, Dict, List, Optional
+from urllib.parse import urlencode
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from motor.motor_asyncio import AsyncIOMotorClient
-from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
+from fastapi.requests import HTTPConnection
+from fastapi.responses import JSONResponse, ORJSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
 
-app = FastAPI(title="Nudge API")
+from image_cache import AnalysisCache, CACHE_USE_MONGO, ImageKey, decode_image, dhash, image_key_from_file
+from uploads import read_image_upload
+from image_pipeline import PREPARED_VARIANT, panorama_tiles, prepare_image_path, shutdown_executor
+from analysis_merge import merge_analyses
+from blob_store import BlobStore, BLOB_REF_PATTERN
+from session_repo import create_repository
+from database import create_client, ping, retry_until_connected, warm_pool
+from llm import LlmClientManager
+from model_output import OutputParser, OutputParseError, SpaceAnalysis, coerce, schema_hint
+from admission import AdmissionController
+from resilience import LlmCallError, LLM_CALL_ERROR_DETAIL
+from jobs import JobQueue, MongoJobStore, MemoryJobStore, JOB_BACKEND, FINISHED
+from live import SessionHub
+from archive import Archiver, SessionArchive, ARCHIVE_ENABLED
+from coalesce import SingleFlight, MongoFlightStore, MemoryFlightStore, COALESCE_BACKEND, flight_key, input_hash
+from metrics import REGISTRY, METRICS_ENABLED, HTTP_IN_FLIGHT, MetricsMiddleware, phase, setup_tracing, shutdown_tracing
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
 
 MONGO_URL = os.environ.get("MONGO_URL")
 DB_NAME = os.environ.get("DB_NAME")
 EMERGENT_LLM_KEY = os.environ.get("EMERGENT_LLM_KEY")
+# Most changes accepted by one batch request
+BATCH_MAX_CHANGES = int(os.environ.get("BATCH_MAX_CHANGES", "500"))
+DECISIONS = ("keep", "sell", "donate")
+# Multi-image analysis: photos per request, tiles per photo, model calls per request
+# (photos x tiles) and how many of those calls run at once
+ANALYZE_MAX_IMAGES = int(os.environ.get("ANALYZE_MAX_IMAGES", "6"))
+ANALYZE_MAX_TILES = int(os.environ.get("ANALYZE_MAX_TILES", "4"))
+ANALYZE_MAX_PARTS = int(os.environ.get("ANALYZE_MAX_PARTS", "12"))
+ANALYZE_FANOUT = int(os.environ.get("ANALYZE_FANOUT", "6"))
+# Idle live-update streams get a comment line this often so proxies keep them open
+LIVE_KEEPALIVE_SECONDS = float(os.environ.get("LIVE_KEEPALIVE_SECONDS", "15"))
+# Session archiving waits while more requests than this are being served by the worker
+ARCHIVE_BUSY_REQUESTS = int(os.environ.get("ARCHIVE_BUSY_REQUESTS", "4"))
+
+
+class Services:
+    """Everything the handlers share, created per app when it starts (see connect()).
+
+    Building the MongoDB client resolves the URL and starts the driver's
+    threads, so none of this happens on import. The app keeps it on
+    `app.state.services`; nothing is held in module globals, so two apps in
+    one process (tests, benchmarks) don't share model slots, stats or blobs.
+    """
+
+    def __init__(self, client, db):
+        self.client = client
+        self.db = db
+        self.admission = AdmissionController()
+        self.llm = LlmClientManager(EMERGENT_LLM_KEY, admission=self.admission)
+        self.output_parser = OutputParser()
+        self.blobs = BlobStore()
+        # Stored images being downscaled, by (ref, tiles), so concurrent calls on one photo share the work
+        self.preparing: Dict[tuple, asyncio.Future] = {}
+        self.sessions = create_repository(db)
+        self.sessions.archive = SessionArchive(db["sessions_archive"])
+        self.job_queue = JobQueue(MongoJobStore(db["jobs"]) if JOB_BACKEND == "mongo" else MemoryJobStore())
+        register_jobs(self.job_queue, self)
+        self.image_cache = AnalysisCache(collection=db["image_cache"] if CACHE_USE_MONGO else None)
+        self.flights = SingleFlight(MongoFlightStore(db["flights"]) if COALESCE_BACKEND == "mongo" else MemoryFlightStore())
+        self.live_hub = SessionHub(self.sessions)
+        # Open event streams stay in flight for as long as they are connected, so they don't count as load
+        self.archiver = Archiver(self.sessions, self.sessions.archive, busy=lambda: (
+            HTTP_IN_FLIGHT.value() > ARCHIVE_BUSY_REQUESTS + self.live_hub.snapshot()["subscribers"]))
+        self.index_setup: Optional[asyncio.Task] = None
+        self.stats_collector = partial(collect_stats, self)
+
 
-client = AsyncIOMotorClient(MONGO_URL)
-db = client[DB_NAME]
-sessions_col = db["sessions"]
+def connect() -> Services:
+    client = create_client(MONGO_URL)
+    return Services(client, client[DB_NAME])
+
+
+def get_services(connection: HTTPConnection) -> Services:
+    return connection.app.state.services
+
+
+AppServices = Annotated[Services, Depends(get_services)]
 
 
 # --- Models ---
@@ -43,144 +114,434 @@ class TaskUpdate(BaseModel):
 class ItemSort(BaseModel):
     decision: str  # keep, sell, donate
 
-class AnalyzeRequest(BaseModel):
+class TaskChange(BaseModel):
+    task_id: str
+    completed: bool
+
+class ItemChange(BaseModel):
+    item_id: str
+    decision: str
+
+class TaskBatch(BaseModel):
+    changes: List[TaskChange] = Field(min_length=1, max_length=BATCH_MAX_CHANGES)
+
+class ItemBatch(BaseModel):
+    changes: List[ItemChange] = Field(min_length=1, max_length=BATCH_MAX_CHANGES)
+
+class ImageInput(BaseModel):
+    """An image sent inline, or the `image_ref` of one stored by an earlier request.
+
+    With neither, the session's most recent image is used.
+    """
+    image_base64: Optional[str] = None
+    image_ref: Optional[str] = Field(None, pattern=BLOB_REF_PATTERN)
+
+    @model_validator(mode="after")
+    def _one_image(self):
+        if self.image_base64 is not None and self.image_ref is not None:
+            raise ValueError("Send image_base64 or image_ref, not both")
+        return self
+
+class ImageRequest(ImageInput):
     session_id: str
-    image_base64: str
+
+class AnalyzeRequest(ImageRequest):
+    pass
 
 class GenerateTasksRequest(BaseModel):
     session_id: str
 
-class IdentifyItemsRequest(BaseModel):
+class IdentifyItemsRequest(ImageRequest):
+    pass
+
+class PipelineRequest(ImageRequest):
+    identify_items: bool = False
+
+class MultiAnalyzeRequest(BaseModel):
     session_id: str
-    image_base64: str
+    images: List[ImageInput] = Field(min_length=1, max_length=ANALYZE_MAX_IMAGES)
+    # Tiles per photo; by default only panorama-wide photos are split
+    tiles: Optional[int] = Field(None, ge=1, le=ANALYZE_MAX_TILES)
 
 
-def serialize_doc(doc):
-    if doc and "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
+# Response models. Every field has a default so projected (`fields=`) and
+# delta responses validate too; routes use response_model_exclude_unset so
+# only what was loaded gets serialized.
+class _Document(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    @model_validator(mode="wrap")
+    @classmethod
+    def _lenient(cls, data, handler):
+        # Documents written before the schemas existed may carry odd values;
+        # send the field's default in their place rather than fail the response.
+        # The default is set explicitly so response_model_exclude_unset keeps it.
+        try:
+            return handler(data)
+        except ValidationError as exc:
+            if not isinstance(data, dict):
+                raise
+            bad = {err["loc"][0] for err in exc.errors() if err["loc"]}
+            fixed = {k: v for k, v in data.items() if k not in bad}
+            for name in bad:
+                field = cls.model_fields.get(name)
+                if field is not None and not field.is_required():
+                    fixed[name] = field.get_default(call_default_factory=True)
+            return handler(fixed)
+
+class Task(_Document):
+    task_id: str
+    title: str = "Task"
+    description: str = ""
+    estimated_minutes: int = 5
+    category: str = "pickup"
+    encouragement: str = ""
+    completed: bool = False
+
+class Item(_Document):
+    item_id: str
+    name: str = "Item"
+    description: str = ""
+    category: str = "misc"
+    suggestion: str = "keep"
+    reason: str = ""
+    decision: Optional[str] = None
+
+class TaskState(BaseModel):
+    task_id: str
+    completed: bool
+
+class ItemState(BaseModel):
+    item_id: str
+    decision: str
+
+class Session(_Document):
+    session_id: str
+    revision: int = 0
+    name: Optional[str] = None
+    status: str = "created"
+    analysis: Optional[SpaceAnalysis] = None
+    tasks: List[Task] = []
+    items: List[Item] = []
+    completed_tasks: int = 0
+    total_tasks: int = 0
+    streak: int = 0
+    image_ref: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    # Only present in delta responses
+    task: Optional[TaskState] = None
+    item: Optional[ItemState] = None
+    changed_tasks: Optional[List[TaskState]] = None
+    changed_items: Optional[List[ItemState]] = None
+
+    @field_validator("analysis", mode="before")
+    @classmethod
+    def _lenient_analysis(cls, value):
+        return coerce("analysis", value) if isinstance(value, dict) else value
+
+SESSION_RESPONSE = {"response_model": Session, "response_model_exclude_unset": True}
 
 
 # --- AI Helpers ---
-async def analyze_space_with_ai(image_base64: str) -> dict:
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"analyze-{uuid.uuid4().hex[:8]}",
-        system_message="""You are Nudge, a gentle and encouraging cleaning assistant designed for neurodivergent people who struggle with task paralysis. 
-        
-When analyzing a photo of a space, you should:
-1. Assess the overall state warmly and without judgment
-2. Identify the easiest area to start with (the "quick win")
-3. Rate the difficulty from 1-5 (1=light tidying, 5=major declutter)
-4. Identify 3-6 distinct zones/areas that need attention
-5. For each zone, give a brief, encouraging description
-
-ALWAYS respond in valid JSON with this exact structure:
-{
-  "overview": "A warm, non-judgmental description of the space",
-  "encouragement": "A short motivational message",
-  "difficulty": 3,
-  "quick_win": "The easiest thing to tackle first",
-  "zones": [
-    {"name": "Zone name", "description": "What needs doing here", "priority": 1, "estimated_minutes": 10}
-  ]
-}"""
-    ).with_model("openai", "gpt-5.2")
-
-    image_content = ImageContent(image_base64=image_base64)
-    user_msg = UserMessage(
-        text="Please analyze this space and help me figure out where to start cleaning. Remember to be gentle and encouraging - I might be feeling overwhelmed! Respond ONLY with valid JSON.",
-        file_contents=[image_content]
-    )
-    response = await chat.send_message(user_msg)
-    
-    import json
-    cleaned = response.strip()
-    if cleaned.startswith("```json"):
-        cleaned = cleaned[7:]
-    if cleaned.startswith("```"):
-        cleaned = cleaned[3:]
-    if cleaned.endswith("```"):
-        cleaned = cleaned[:-3]
-    return json.loads(cleaned.strip())
-
-
-async def generate_tasks_with_ai(analysis: dict) -> list:
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"tasks-{uuid.uuid4().hex[:8]}",
-        system_message="""You are Nudge, a gentle cleaning coach. Based on a space analysis, create a list of small, manageable cleaning tasks.
-
-RULES:
-- Each task should take 2-10 minutes MAX
-- Start with the easiest tasks (quick wins first!)
-- Use encouraging, gentle language
-- Be specific: "Pick up the 3 cups on the desk" not "Clean the desk"
-- Include small celebration moments between groups of tasks
-
-Respond ONLY with valid JSON array:
-[
-  {"title": "Short task title", "description": "Gentle detailed instruction", "estimated_minutes": 5, "category": "pickup|wipe|organize|sort|celebrate", "encouragement": "You're doing great!"}
-]"""
-    ).with_model("openai", "gpt-5.2")
-
-    import json
-    user_msg = UserMessage(
-        text=f"Based on this space analysis, create a step-by-step cleaning plan with small, manageable tasks. Here's the analysis:\n{json.dumps(analysis)}\n\nRespond ONLY with valid JSON array."
-    )
-    response = await chat.send_message(user_msg)
-    
-    cleaned = response.strip()
-    if cleaned.startswith("```json"):
-        cleaned = cleaned[7:]
-    if cleaned.startswith("```"):
-        cleaned = cleaned[3:]
-    if cleaned.endswith("```"):
-        cleaned = cleaned[:-3]
-    return json.loads(cleaned.strip())
-
-
-async def identify_items_with_ai(image_base64: str) -> list:
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"items-{uuid.uuid4().hex[:8]}",
-        system_message="""You are Nudge, a gentle decluttering assistant. When shown a photo of items/clutter, identify individual items that the user might want to sort into Keep, Sell, or Donate.
-
-Group similar items together. Be specific but kind.
-
-Respond ONLY with valid JSON array:
-[
-  {"name": "Item name", "description": "Brief description", "category": "clothing|electronics|books|kitchenware|decor|toys|misc", "suggestion": "keep|sell|donate", "reason": "Why you suggest this"}
-]"""
-    ).with_model("openai", "gpt-5.2")
-
-    image_content = ImageContent(image_base64=image_base64)
-    user_msg = UserMessage(
-        text="Please identify the items in this photo that I could sort into Keep, Sell, or Donate categories. Be gentle and helpful! Respond ONLY with valid JSON array.",
-        file_contents=[image_content]
-    )
-    response = await chat.send_message(user_msg)
-    
-    import json
-    cleaned = response.strip()
-    if cleaned.startswith("```json"):
-        cleaned = cleaned[7:]
-    if cleaned.startswith("```"):
-        cleaned = cleaned[3:]
-    if cleaned.endswith("```"):
-        cleaned = cleaned[:-3]
-    return json.loads(cleaned.strip())
+REPAIR_MAX_CHARS = 12000
+UNPARSEABLE_REPLY_DETAIL = "The assistant's reply could not be understood, please try again"
+
+
+async def parse_model_output(services: Services, response: str, kind: str):
+    try:
+        with phase("json_parse"):
+            return services.output_parser.parse(response, kind)
+    except OutputParseError as exc:
+        # Last resort: one cheap text-only call to fix the structure instead of
+        # failing the request and having the user redo the whole image call.
+        fixed = await services.llm.send("repair", error=str(exc)[:200], schema=schema_hint(kind),
+                               text=response[:REPAIR_MAX_CHARS])
+        try:
+            with phase("json_parse"):
+                return services.output_parser.parse(fixed, kind, reprompted=True)
+        except OutputParseError:
+            raise HTTPException(status_code=502, detail=UNPARSEABLE_REPLY_DETAIL)
+
+
+
+async def store_image(services: Services, session_id: str, image_base64: Optional[str],
+                      image_ref: Optional[str]) -> str:
+    """Resolve a request's image to a blob ref, storing inline bytes first."""
+    if image_base64 is not None:
+        try:
+            data = await asyncio.to_thread(decode_image, image_base64)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+        if not data:
+            raise HTTPException(status_code=400, detail="Image is empty")
+        with phase("image_store"):
+            return await asyncio.to_thread(services.blobs.put, data)
+    if image_ref is None:
+        doc = await services.sessions.get_or_404(session_id, {"_id": 0, "session_id": 1, "image_ref": 1})
+        image_ref = doc.get("image_ref")
+        if not image_ref:
+            raise HTTPException(status_code=400, detail="Send image_base64 or image_ref")
+    if await asyncio.to_thread(services.blobs.path, image_ref) is None:
+        raise HTTPException(status_code=404, detail="Image not found, please upload it again")
+    return image_ref
+
+
+def image_key_for_ref(blobs: BlobStore, image_ref: str) -> ImageKey:
+    # The ref is the sha256 of the image bytes, so only the perceptual hash is computed
+    image = blobs.read(image_ref)
+    if image is None:
+        return ImageKey(image_ref, None)
+    with image:
+        return ImageKey(image_ref, dhash(image))
+
+
+def _read_base64(path: str) -> str:
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+
+def _variants(tiles: int) -> List[str]:
+    if tiles == 1:
+        return [PREPARED_VARIANT]
+    return [f"{PREPARED_VARIANT}.{i + 1}of{tiles}" for i in range(tiles)]
+
+
+async def _prepare_model_images(services: Services, image_ref: str, tiles: int) -> List[str]:
+    variants = _variants(tiles)
+    paths = [await asyncio.to_thread(services.blobs.path, image_ref, variant) for variant in variants]
+    if None not in paths:
+        return [await asyncio.to_thread(_read_base64, path) for path in paths]
+    path = await asyncio.to_thread(services.blobs.path, image_ref)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found, please upload it again")
+    with phase("image_preprocess"):
+        try:
+            images = await prepare_image_path(path, tiles)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found, please upload it again")
+    # An image that could not be decoded comes back whole and is not kept as a variant
+    if len(images) == len(variants):
+        for variant, data in zip(variants, images):
+            await asyncio.to_thread(services.blobs.put_variant, image_ref, variant, data)
+    return [base64.b64encode(data).decode("ascii") for data in images]
+
+
+async def model_images(services: Services, image_ref: str, tiles: int = 1) -> List[str]:
+    """Base64 of the downscaled copy (or tiles) sent to the model, prepared once per stored image."""
+    key = (image_ref, tiles)
+    pending = services.preparing.get(key)
+    if pending is None:
+        pending = services.preparing[key] = asyncio.ensure_future(_prepare_model_images(services, image_ref, tiles))
+        pending.add_done_callback(lambda _: services.preparing.pop(key, None))
+    return await asyncio.shield(pending)
+
+
+async def analyze_space_with_ai(services: Services, image_ref: str, tiles: int = 1, tile: int = 0) -> dict:
+    images = await model_images(services, image_ref, tiles)
+    response = await services.llm.send("analyze", image_base64=images[min(tile, len(images) - 1)])
+    return await parse_model_output(services, response, "analysis")
+
+
+async def generate_tasks_with_ai(services: Services, analysis: dict) -> list:
+    response = await services.llm.send("tasks", analysis=json.dumps(analysis))
+    return await parse_model_output(services, response, "tasks")
+
+
+async def stream_tasks_with_ai(services: Services, analysis: dict):
+    parser = services.output_parser.stream("tasks")
+    async for chunk in services.llm.stream("tasks", analysis=json.dumps(analysis)):
+        for task in parser.feed(chunk):
+            yield task
+        if parser.finished:
+            break
+    parser.close()
+
+
+async def identify_items_with_ai(services: Services, image_ref: str) -> list:
+    response = await services.llm.send("items", image_base64=(await model_images(services, image_ref))[0])
+    return await parse_model_output(services, response, "items")
+
+
+def build_item(i: int, item: dict) -> dict:
+    return {
+        "item_id": f"item-{i}",
+        "name": item.get("name", "Item"),
+        "description": item.get("description", ""),
+        "category": item.get("category", "misc"),
+        "suggestion": item.get("suggestion", "keep"),
+        "reason": item.get("reason", ""),
+        "decision": None,
+    }
+
+
+def build_task(i: int, t: dict) -> dict:
+    return {
+        "task_id": f"task-{i}",
+        "title": t.get("title", "Task"),
+        "description": t.get("description", ""),
+        "estimated_minutes": t.get("estimated_minutes", 5),
+        "category": t.get("category", "pickup"),
+        "encouragement": t.get("encouragement", "You're doing amazing!"),
+        "completed": False,
+    }
 
 
 # --- Endpoints ---
-@app.get("/api/health")
-async def health():
-    return {"status": "ok", "service": "nudge"}
+async def llm_call_error_handler(request: Request, exc: LlmCallError):
+    return JSONResponse(status_code=502, content={"detail": LLM_CALL_ERROR_DETAIL}, headers={"Retry-After": "5"})
+
+
+async def read_model_upload(request: Request, services: Services):
+    """Store a multipart image upload; returns (session_id, image_ref, cache key).
+
+    The session's rate limit is checked once the form names it, before the
+    image is hashed and stored.
+    """
+    with phase("upload_read"):
+        session_id, image = await read_image_upload(request)
+    try:
+        services.admission.check_rate(request, session_id)
+        if not image.size:
+            raise HTTPException(status_code=400, detail="Image is empty")
+        with phase("image_hash"):
+            key = await asyncio.to_thread(image_key_from_file, image.file)
+        with phase("image_store"):
+            image_ref = await asyncio.to_thread(services.blobs.put_file, image.file, key.sha256)
+    finally:
+        await image.close()
+    return session_id, image_ref, key
+
+
+async def startup(app: FastAPI):
+    setup_tracing()
+    services = app.state.services = connect()
+    # Imports the LLM SDK in the background; requests that don't call the model never wait for it
+    services.llm.warm()
+    await asyncio.to_thread(services.blobs.load)
+    try:
+        await warm_pool(services.db)
+    except Exception as exc:
+        # Start degraded: serve what doesn't need MongoDB and create the indexes once it is back
+        logger.warning("MongoDB not reachable at startup: %s", exc)
+        services.index_setup = asyncio.create_task(
+            retry_until_connected(partial(ensure_indexes, services), "Creating indexes"))
+    else:
+        # Reachable, so a failure here is a real problem (e.g. a conflicting index): fail fast
+        await ensure_indexes(services)
+    await services.live_hub.start()
+    await services.job_queue.start()
+    if ARCHIVE_ENABLED:
+        services.archiver.start()
+    REGISTRY.register_collector(services.stats_collector)
+
+
+async def ensure_indexes(services: Services):
+    for store in (services.sessions, services.image_cache, services.flights, services.sessions.archive,
+                  services.job_queue.store):
+        await store.ensure_indexes()
+
+
+async def shutdown(app: FastAPI):
+    services = app.state.services
+    REGISTRY.unregister_collector(services.stats_collector)
+    if services.index_setup is not None:
+        services.index_setup.cancel()
+        await asyncio.gather(services.index_setup, return_exceptions=True)
+    await services.archiver.stop()
+    await services.job_queue.stop()
+    await services.live_hub.stop()
+    services.client.close()
+    shutdown_executor()
+    shutdown_tracing()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup(app)
+    try:
+        yield
+    finally:
+        await shutdown(app)
+
+
+@router.get("/api/health")
+async def health(services: AppServices):
+    try:
+        latency = await asyncio.wait_for(ping(services.db), timeout=2)
+    except Exception as exc:
+        return JSONResponse(status_code=503, content={
+            "status": "degraded",
+            "service": "nudge",
+            "db": {"ready": False, "error": type(exc).__name__},
+        })
+    return {"status": "ok", "service": "nudge", "db": {"ready": True, "latency_ms": round(latency, 2)}}
+
+
+@router.get("/api/cache/stats")
+async def cache_stats(services: AppServices):
+    return {**services.image_cache.snapshot(), "blobs": services.blobs.snapshot()}
+
+
+@router.get("/api/llm/stats")
+async def llm_stats(services: AppServices):
+    return {**services.llm.snapshot(), "parsing": services.output_parser.snapshot(),
+            "coalescing": services.flights.snapshot()}
+
+
+@router.get("/api/admission/stats")
+async def admission_stats(services: AppServices):
+    return services.admission.snapshot()
+
+
+@router.get("/api/archive/stats")
+async def archive_stats(services: AppServices):
+    return services.archiver.snapshot()
+
+
+def collect_stats(services: Services):
+    """Expose the existing in-process stats snapshots as Prometheus samples."""
+    gates = services.admission.snapshot()["models"]
+    yield ("admission_active", "gauge", "Model calls holding an admission slot",
+           [({"model": m}, g["active"]) for m, g in gates.items()])
+    yield ("admission_queue_depth", "gauge", "Callers waiting for an admission slot",
+           [({"model": m}, g["queue_depth"]) for m, g in gates.items()])
+    yield ("admission_rejected_total", "counter", "Calls shed or timed out while queued",
+           [({"model": m, "reason": r}, g[r]) for m, g in gates.items() for r in ("shed", "timed_out")])
+    cache = services.image_cache.snapshot()
+    yield ("image_cache_lookups_total", "counter", "Analysis cache lookups by result",
+           [({"result": r}, cache[r]) for r in ("hits", "phash_hits", "shared_hits", "misses")])
+    yield ("image_cache_bytes", "gauge", "Bytes held by the in-process analysis cache", [({}, cache["bytes"])])
+    blob = services.blobs.snapshot()
+    yield ("blob_store_bytes", "gauge", "Bytes of stored images and their variants", [({}, blob["bytes"])])
+    yield ("blob_store_evictions_total", "counter", "Stored images evicted to stay under the cap", [({}, blob["evictions"])])
+    yield ("jobs_queued", "gauge", "Async jobs waiting for a worker", [({}, services.job_queue.depth)])
+    coalescing = services.flights.snapshot()
+    yield ("coalesced_requests_total", "counter", "AI requests that led a call, joined one or replayed a result",
+           [({"outcome": o}, coalescing[o]) for o in ("led", "joined", "joined_remote", "replayed")])
+    live = services.live_hub.snapshot()
+    yield ("live_subscribers", "gauge", "Clients subscribed to live session updates", [({}, live["subscribers"])])
+    yield ("live_events_total", "counter", "Live session events fanned out to subscribers", [({}, live["events"])])
+    archived = services.archiver.snapshot()
+    yield ("sessions_archived_total", "counter", "Idle or completed sessions moved to the archive",
+           [({}, archived["archived"])])
+    yield ("sessions_restored_total", "counter", "Archived sessions brought back on access", [({}, archived["restored"])])
+    parsing = services.output_parser.snapshot()
+    yield ("model_output_parse_total", "counter", "Model replies parsed, by kind and outcome",
+           [({"kind": k, "outcome": o}, v[o]) for k, v in parsing.items() for o in ("ok", "repaired", "reprompted", "failed")])
+
+
 
+@router.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of request, phase, LLM, MongoDB and queue metrics."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
-@app.post("/api/sessions")
-async def create_session(body: SessionCreate):
+
+@router.post("/api/sessions", **SESSION_RESPONSE)
+async def create_session(body: SessionCreate, services: AppServices):
     session_id = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
     session = {
         "session_id": session_id,
         "name": body.name,
@@ -191,175 +552,519 @@ async def create_session(body: SessionCreate):
         "completed_tasks": 0,
         "total_tasks": 0,
         "streak": 0,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "updated_at": datetime.now(timezone.utc).isoformat(),
+        "created_at": now,
+        "updated_at": now,
     }
-    await sessions_col.insert_one({**session})
-    return session
+    return await services.sessions.create(session)
+
+
+def parse_fields(fields: Optional[str]):
+    return [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
+
+def page(offset: int, limit: Optional[int]):
+    if offset < 0 or (limit is not None and limit < 1):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit >= 1")
+    if not offset and limit is None:
+        return None
+    return offset, limit if limit is not None else 10 ** 6
+
 
+def session_etag(session_id: str, revision: int, variant: str = "") -> str:
+    # Projected/paged reads are different representations of the same revision
+    suffix = f"-{zlib.crc32(variant.encode()):08x}" if variant else ""
+    return f'"{session_id}-{revision}{suffix}"'
 
-@app.get("/api/sessions/{session_id}")
-async def get_session(session_id: str):
-    doc = await sessions_col.find_one({"session_id": session_id}, {"_id": 0})
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+@router.get("/api/sessions/{session_id}", **SESSION_RESPONSE)
+async def get_session(session_id: str, request: Request, response: Response, services: AppServices,
+                      fields: Optional[str] = None,
+                      tasks_offset: int = 0, tasks_limit: Optional[int] = None,
+                      items_offset: int = 0, items_limit: Optional[int] = None):
+    """`fields` is a comma-separated list of top-level fields to return;
+    tasks/items can be paged with *_offset and *_limit.
+
+    Responses carry an ETag for the session revision; a matching
+    If-None-Match is answered with 304 after reading only the revision.
+    """
+    variant = urlencode(sorted(request.query_params.multi_items()))
+    if request.headers.get("if-none-match"):
+        revision = await services.sessions.revision(session_id)
+        if revision is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        etag = session_etag(session_id, revision, variant)
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+    doc = await services.sessions.load(session_id, parse_fields(fields),
+                              page(tasks_offset, tasks_limit), page(items_offset, items_limit))
     if not doc:
         raise HTTPException(status_code=404, detail="Session not found")
+    response.headers["ETag"] = session_etag(session_id, doc.get("revision", 0), variant)
     return doc
 
 
-@app.post("/api/analyze-space")
-async def analyze_space(body: AnalyzeRequest):
-    doc = await sessions_col.find_one({"session_id": body.session_id}, {"_id": 0})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def run_analyze_space(services: Services, session_id: str, image_ref: str, key=None):
+    # One indexed read so a stale session id fails before it costs a model call
+    await services.sessions.get_or_404(session_id, {"_id": 1})
+    if key is None:
+        key = await asyncio.to_thread(image_key_for_ref, services.blobs, image_ref)
+    analysis = await services.image_cache.get_or_compute("analyze", key,
+                                                         lambda: analyze_space_with_ai(services, image_ref))
+    return await services.sessions.update_or_404(session_id, {"$set": {
+        "analysis": analysis,
+        "status": "analyzed",
+        "image_ref": image_ref,
+    }})
 
-    analysis = await analyze_space_with_ai(body.image_base64)
-    
-    await sessions_col.update_one(
-        {"session_id": body.session_id},
-        {"$set": {
-            "analysis": analysis,
-            "status": "analyzed",
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
-    
-    updated = await sessions_col.find_one({"session_id": body.session_id}, {"_id": 0})
-    return updated
 
+async def coalesced(request: Request, services: Services, operation: str, session_id: str, digest: str, compute):
+    """Run `compute` once per (session, operation, input); duplicates in flight share its result.
 
-@app.post("/api/generate-tasks")
-async def generate_tasks(body: GenerateTasksRequest):
-    doc = await sessions_col.find_one({"session_id": body.session_id}, {"_id": 0})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Session not found")
+    With an Idempotency-Key header the key replaces the input hash and a
+    successful result is replayed to retries sent with the same key.
+    """
+    idempotency_key = request.headers.get("Idempotency-Key")
+    key = flight_key(operation, session_id, digest, idempotency_key)
+    return await services.flights.run(key, digest, compute, idempotent=idempotency_key is not None)
+
+
+@router.post("/api/analyze-space", **SESSION_RESPONSE)
+async def analyze_space(body: AnalyzeRequest, request: Request, services: AppServices, mode: Optional[str] = None):
+    services.admission.check_rate(request, body.session_id)
+    if mode == "async":
+        return await submit_job(services, "analyze-space", body)
+    image_ref = await store_image(services, body.session_id, body.image_base64, body.image_ref)
+    return await coalesced(request, services, "analyze-space", body.session_id, image_ref,
+                           lambda: run_analyze_space(services, body.session_id, image_ref))
+
+
+async def tile_counts(services: Services, image_refs: List[str], tiles: Optional[int]) -> List[int]:
+    if tiles is not None:
+        return [tiles] * len(image_refs)
+    counts = []
+    for image_ref in image_refs:
+        path = await asyncio.to_thread(services.blobs.path, image_ref)
+        try:
+            counts.append(await asyncio.to_thread(panorama_tiles, path, ANALYZE_MAX_TILES))
+        except Exception:
+            # Undecodable here means undecodable for the model too; send it whole
+            counts.append(1)
+    return counts
+
+
+async def run_analyze_multi(services: Services, session_id: str, image_refs: List[str], tiles: Optional[int]):
+    await services.sessions.get_or_404(session_id, {"_id": 1})
+    counts = await tile_counts(services, image_refs, tiles)
+    if sum(counts) > ANALYZE_MAX_PARTS:
+        raise HTTPException(status_code=400, detail=f"At most {ANALYZE_MAX_PARTS} photos and tiles per analysis")
+    semaphore = asyncio.Semaphore(ANALYZE_FANOUT)
+
+    async def analyze_part(image_ref: str, count: int, tile: int) -> dict:
+        async with semaphore:
+            if count == 1:
+                key = await asyncio.to_thread(image_key_for_ref, services.blobs, image_ref)
+            else:
+                # Tiles are only ever looked up by exact content
+                key = ImageKey(f"{image_ref}.{tile + 1}of{count}", None)
+            return await services.image_cache.get_or_compute(
+                "analyze", key, lambda: analyze_space_with_ai(services, image_ref, count, tile))
+
+    parts = [asyncio.ensure_future(analyze_part(image_ref, count, tile))
+             for image_ref, count in zip(image_refs, counts) for tile in range(count)]
+    try:
+        with phase("analyze_fanout", parts=len(parts)):
+            results = await asyncio.gather(*parts)
+    except BaseException:
+        for part in parts:
+            part.cancel()
+        raise
+    return await services.sessions.update_or_404(session_id, {"$set": {
+        "analysis": merge_analyses(results),
+        "status": "analyzed",
+        "image_ref": image_refs[0],
+    }})
+
+
+@router.post("/api/analyze-space/multi", **SESSION_RESPONSE)
+async def analyze_space_multi(body: MultiAnalyzeRequest, request: Request, services: AppServices):
+    """Analyze several photos of one room, or tiles of a panorama, and merge the results.
+
+    The per-photo model calls run concurrently (up to ANALYZE_FANOUT at a
+    time), so the request takes about as long as the slowest single call.
+    """
+    services.admission.check_rate(request, body.session_id)
+    image_refs = list(await asyncio.gather(*(store_image(services, body.session_id, image.image_base64, image.image_ref)
+                                             for image in body.images)))
+    return await coalesced(request, services, "analyze-space-multi", body.session_id,
+                           input_hash(*image_refs, str(body.tiles)),
+                           lambda: run_analyze_multi(services, body.session_id, image_refs, body.tiles))
+
+
+@router.post("/api/analyze-space/upload", **SESSION_RESPONSE)
+async def analyze_space_upload(request: Request, services: AppServices):
+    session_id, image_ref, key = await read_model_upload(request, services)
+    return await coalesced(request, services, "analyze-space", session_id, image_ref,
+                           lambda: run_analyze_space(services, session_id, image_ref, key=key))
+
+
+@router.post("/api/generate-tasks", **SESSION_RESPONSE)
+async def generate_tasks(body: GenerateTasksRequest, request: Request, services: AppServices,
+                         mode: Optional[str] = None):
+    services.admission.check_rate(request, body.session_id)
+    if mode == "async":
+        return await submit_job(services, "generate-tasks", body)
+    return await coalesced(request, services, "generate-tasks", body.session_id, input_hash(body.session_id),
+                           lambda: run_generate_tasks(services, body.session_id))
+
+
+async def run_generate_tasks(services: Services, session_id: str):
+    doc = await services.sessions.get_or_404(session_id, {"_id": 0, "analysis": 1})
     if not doc.get("analysis"):
         raise HTTPException(status_code=400, detail="Space must be analyzed first")
 
-    tasks_raw = await generate_tasks_with_ai(doc["analysis"])
-    tasks = []
-    for i, t in enumerate(tasks_raw):
-        tasks.append({
-            "task_id": f"task-{i}",
-            "title": t.get("title", "Task"),
-            "description": t.get("description", ""),
-            "estimated_minutes": t.get("estimated_minutes", 5),
-            "category": t.get("category", "pickup"),
-            "encouragement": t.get("encouragement", "You're doing amazing!"),
-            "completed": False,
-        })
+    tasks_raw = await generate_tasks_with_ai(services, doc["analysis"])
+    tasks = [build_task(i, t) for i, t in enumerate(tasks_raw)]
 
-    await sessions_col.update_one(
-        {"session_id": body.session_id},
-        {"$set": {
-            "tasks": tasks,
-            "total_tasks": len(tasks),
-            "completed_tasks": 0,
-            "status": "in_progress",
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    return await services.sessions.replace_lists(session_id, tasks=tasks, header={
+        "total_tasks": len(tasks),
+        "completed_tasks": 0,
+        "status": "in_progress",
+    })
 
-    updated = await sessions_col.find_one({"session_id": body.session_id}, {"_id": 0})
-    return updated
 
+@router.post("/api/generate-tasks/stream")
+async def generate_tasks_stream(body: GenerateTasksRequest, request: Request, services: AppServices,
+                                format: str = "ndjson"):
+    """Stream tasks as the model writes them, persisting each one on arrival.
 
-@app.put("/api/sessions/{session_id}/tasks/{task_id}")
-async def update_task(session_id: str, task_id: str, body: TaskUpdate):
-    doc = await sessions_col.find_one({"session_id": session_id}, {"_id": 0})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Session not found")
+    `format=ndjson` (default) emits one JSON event per line; `format=sse`
+    emits the same events as Server-Sent Events.
+    """
+    services.admission.check_rate(request, body.session_id)
+    # The stream has started by the time a model slot is awaited, so shed load up front
+    services.admission.ensure_capacity(services.llm.model_key("tasks"))
+    sessions = services.sessions
+    doc = await sessions.get_or_404(body.session_id, {"_id": 0, "analysis": 1, "total_tasks": 1})
+    if not doc.get("analysis"):
+        raise HTTPException(status_code=400, detail="Space must be analyzed first")
+    # The current plan stays until the first new task arrives, so an aborted stream loses nothing
+    await sessions.update(body.session_id, {"$set": {"status": "generating"}}, projection={"_id": 0, "session_id": 1})
+    previous_status = "in_progress" if doc.get("total_tasks") else "analyzed"
 
-    tasks = doc.get("tasks", [])
-    found = False
-    for task in tasks:
-        if task["task_id"] == task_id:
-            task["completed"] = body.completed
-            found = True
-            break
+    def encode(event: dict) -> str:
+        if format == "sse":
+            return f"event: {event['type']}\ndata: {orjson.dumps(event).decode()}\n\n"
+        return orjson.dumps(event).decode() + "\n"
 
-    if not found:
-        raise HTTPException(status_code=404, detail="Task not found")
-
-    completed_count = sum(1 for t in tasks if t["completed"])
-    total = len(tasks)
-    status = "completed" if completed_count == total else "in_progress"
-    streak = doc.get("streak", 0)
-    if body.completed:
-        streak += 1
-
-    await sessions_col.update_one(
-        {"session_id": session_id},
-        {"$set": {
-            "tasks": tasks,
-            "completed_tasks": completed_count,
-            "status": status,
-            "streak": streak,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    async def stream():
+        count = 0
+        finished = False
+        try:
+            async for raw in stream_tasks_with_ai(services, doc["analysis"]):
+                task = build_task(count, raw)
+                if count:
+                    await sessions.append_task(body.session_id, task)
+                else:
+                    await sessions.replace_lists(body.session_id, tasks=[task], header={
+                        "total_tasks": 1,
+                        "completed_tasks": 0,
+                    }, projection={"_id": 0, "session_id": 1})
+                count += 1
+                yield encode({"type": "task", "task": task})
+            session = await sessions.update(body.session_id, {"$set": {"status": "in_progress"}})
+            finished = True
+            yield encode({"type": "done", "session": session})
+        except HTTPException as exc:
+            yield encode({"type": "error", "detail": exc.detail, "tasks_saved": count})
+        except LlmCallError:
+            yield encode({"type": "error", "detail": LLM_CALL_ERROR_DETAIL, "tasks_saved": count})
+        except OutputParseError:
+            yield encode({"type": "error", "detail": UNPARSEABLE_REPLY_DETAIL, "tasks_saved": count})
+        except Exception:
+            # The response has started, so this is the only place the failure gets logged
+            logger.exception("Task stream for session %s failed", body.session_id)
+            yield encode({"type": "error", "detail": "Something went wrong, please try again", "tasks_saved": count})
+        finally:
+            # Also on client disconnect (CancelledError/GeneratorExit), or the session stays "generating"
+            if not finished:
+                await asyncio.shield(sessions.update(
+                    body.session_id, {"$set": {"status": "in_progress" if count else previous_status}},
+                    projection={"_id": 0, "session_id": 1}))
 
-    updated = await sessions_col.find_one({"session_id": session_id}, {"_id": 0})
-    return updated
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
-@app.post("/api/identify-items")
-async def identify_items(body: IdentifyItemsRequest):
-    doc = await sessions_col.find_one({"session_id": body.session_id}, {"_id": 0})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Session not found")
+@router.post("/api/analyze-and-plan", **SESSION_RESPONSE)
+async def analyze_and_plan(body: PipelineRequest, request: Request, services: AppServices):
+    """Analyze, generate tasks and optionally identify items in one request.
 
-    items_raw = await identify_items_with_ai(body.image_base64)
-    items = []
-    for i, item in enumerate(items_raw):
-        items.append({
-            "item_id": f"item-{i}",
-            "name": item.get("name", "Item"),
-            "description": item.get("description", ""),
-            "category": item.get("category", "misc"),
-            "suggestion": item.get("suggestion", "keep"),
-            "reason": item.get("reason", ""),
-            "decision": None,
-        })
+    The analysis write runs alongside the task-generation call instead of
+    before it, and item identification runs on the same image from the start.
+    """
+    services.admission.check_rate(request, body.session_id)
+    await services.sessions.get_or_404(body.session_id, {"_id": 1})
+    image_ref = await store_image(services, body.session_id, body.image_base64, body.image_ref)
+    key = await asyncio.to_thread(image_key_for_ref, services.blobs, image_ref)
+    image_cache = services.image_cache
+    items_job = None
+    if body.identify_items:
+        items_job = asyncio.ensure_future(
+            image_cache.get_or_compute("identify", key, lambda: identify_items_with_ai(services, image_ref)))
+    pending = [items_job] if items_job else []
+    try:
+        analysis = await image_cache.get_or_compute("analyze", key, lambda: analyze_space_with_ai(services, image_ref))
+        plan_job = asyncio.ensure_future(generate_tasks_with_ai(services, analysis))
+        pending.append(plan_job)
+        await services.sessions.update_or_404(body.session_id, {"$set": {
+            "analysis": analysis,
+            "status": "analyzed",
+            "image_ref": image_ref,
+        }}, projection={"_id": 0, "session_id": 1})
+        tasks_raw = await plan_job
+        items_raw = await items_job if items_job else None
+    except BaseException:
+        for job in pending:
+            job.cancel()
+        raise
 
-    await sessions_col.update_one(
-        {"session_id": body.session_id},
-        {"$set": {
-            "items": items,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+    return await services.sessions.replace_lists(
+        body.session_id,
+        tasks=[build_task(i, t) for i, t in enumerate(tasks_raw)],
+        items=[build_item(i, item) for i, item in enumerate(items_raw)] if items_raw is not None else None,
+        header={"total_tasks": len(tasks_raw), "completed_tasks": 0, "status": "in_progress"},
     )
 
-    updated = await sessions_col.find_one({"session_id": body.session_id}, {"_id": 0})
-    return updated
 
+@router.put("/api/sessions/{session_id}/tasks/{task_id}", **SESSION_RESPONSE)
+async def update_task(session_id: str, task_id: str, body: TaskUpdate, response: Response, services: AppServices,
+                      fields: Optional[str] = None, delta: bool = False):
+    """With `delta=true`, only the toggled task, the counters and the new revision are returned."""
+    if delta:
+        fields = "completed_tasks,total_tasks,streak,status"
+    doc = await services.sessions.toggle_task(session_id, task_id, body.completed, parse_fields(fields))
+    response.headers["ETag"] = session_etag(session_id, doc.get("revision", 0))
+    if delta:
+        return {**doc, "task": {"task_id": task_id, "completed": body.completed}}
+    return doc
+
+
+async def run_identify_items(services: Services, session_id: str, image_ref: str, key=None):
+    await services.sessions.get_or_404(session_id, {"_id": 1})
+    if key is None:
+        key = await asyncio.to_thread(image_key_for_ref, services.blobs, image_ref)
+    items_raw = await services.image_cache.get_or_compute("identify", key,
+                                                          lambda: identify_items_with_ai(services, image_ref))
+    items = [build_item(i, item) for i, item in enumerate(items_raw)]
+
+    return await services.sessions.replace_lists(session_id, items=items, header={"image_ref": image_ref})
 
-@app.put("/api/sessions/{session_id}/items/{item_id}")
-async def sort_item(session_id: str, item_id: str, body: ItemSort):
-    if body.decision not in ["keep", "sell", "donate"]:
+
+@router.post("/api/identify-items", **SESSION_RESPONSE)
+async def identify_items(body: IdentifyItemsRequest, request: Request, services: AppServices,
+                         mode: Optional[str] = None):
+    services.admission.check_rate(request, body.session_id)
+    if mode == "async":
+        return await submit_job(services, "identify-items", body)
+    image_ref = await store_image(services, body.session_id, body.image_base64, body.image_ref)
+    return await coalesced(request, services, "identify-items", body.session_id, image_ref,
+                           lambda: run_identify_items(services, body.session_id, image_ref))
+
+
+@router.post("/api/identify-items/upload", **SESSION_RESPONSE)
+async def identify_items_upload(request: Request, services: AppServices):
+    session_id, image_ref, key = await read_model_upload(request, services)
+    return await coalesced(request, services, "identify-items", session_id, image_ref,
+                           lambda: run_identify_items(services, session_id, image_ref, key=key))
+
+
+@router.put("/api/sessions/{session_id}/items/{item_id}", **SESSION_RESPONSE)
+async def sort_item(session_id: str, item_id: str, body: ItemSort, response: Response, services: AppServices,
+                    fields: Optional[str] = None, delta: bool = False):
+    """With `delta=true`, only the sorted item and the new revision are returned."""
+    if body.decision not in DECISIONS:
         raise HTTPException(status_code=400, detail="Decision must be keep, sell, or donate")
+    doc = await services.sessions.decide_item(session_id, item_id, body.decision,
+                                              ["revision"] if delta else parse_fields(fields))
+    response.headers["ETag"] = session_etag(session_id, doc.get("revision", 0))
+    if delta:
+        return {**doc, "item": {"item_id": item_id, "decision": body.decision}}
+    return doc
 
-    doc = await sessions_col.find_one({"session_id": session_id}, {"_id": 0})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Session not found")
 
-    items = doc.get("items", [])
-    found = False
-    for item in items:
-        if item["item_id"] == item_id:
-            item["decision"] = body.decision
-            found = True
-            break
+@router.post("/api/sessions/{session_id}/tasks/batch", **SESSION_RESPONSE)
+async def update_tasks(session_id: str, body: TaskBatch, response: Response, services: AppServices,
+                       fields: Optional[str] = None, delta: bool = False):
+    """Apply many task toggles at once (e.g. a flushed offline queue); later changes to a task win."""
+    changes = {change.task_id: change.completed for change in body.changes}
+    if delta:
+        fields = "completed_tasks,total_tasks,streak,status"
+    doc = await services.sessions.toggle_tasks(session_id, changes, parse_fields(fields))
+    response.headers["ETag"] = session_etag(session_id, doc.get("revision", 0))
+    if delta:
+        return {**doc, "changed_tasks": [{"task_id": t, "completed": c} for t, c in changes.items()]}
+    return doc
+
+
+@router.post("/api/sessions/{session_id}/items/batch", **SESSION_RESPONSE)
+async def sort_items(session_id: str, body: ItemBatch, response: Response, services: AppServices,
+                     fields: Optional[str] = None, delta: bool = False):
+    """Apply many item decisions at once; nothing is written if any change is invalid."""
+    invalid = sorted({c.item_id for c in body.changes if c.decision not in DECISIONS})
+    if invalid:
+        raise HTTPException(status_code=400, detail={
+            "message": "Decision must be keep, sell, or donate", "invalid": invalid})
+    changes = {change.item_id: change.decision for change in body.changes}
+    doc = await services.sessions.decide_items(session_id, changes, ["revision"] if delta else parse_fields(fields))
+    response.headers["ETag"] = session_etag(session_id, doc.get("revision", 0))
+    if delta:
+        return {**doc, "changed_items": [{"item_id": i, "decision": d} for i, d in changes.items()]}
+    return doc
+
+
+# --- Live updates ---
+@router.get("/api/sessions/{session_id}/events")
+async def session_events(session_id: str, request: Request, services: AppServices):
+    """Server-sent events: a `snapshot` of the session, then an `update` with only what changed.
+
+    Updates carry `revision` plus the changed header fields, and `changed_tasks`/
+    `changed_items` when only task/item state changed (whole lists otherwise).
+    """
+    subscription = await services.live_hub.subscribe(session_id)
+
+    async def stream():
+        try:
+            yield f"event: snapshot\ndata: {orjson.dumps(subscription.snapshot).decode()}\n\n"
+            while not await request.is_disconnected():
+                event = await subscription.next(LIVE_KEEPALIVE_SECONDS)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {orjson.dumps(event['session']).decode()}\n\n"
+                if event["type"] == "deleted":
+                    return
+        finally:
+            subscription.close()
 
-    if not found:
-        raise HTTPException(status_code=404, detail="Item not found")
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    await sessions_col.update_one(
-        {"session_id": session_id},
-        {"$set": {
-            "items": items,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
+
+async def _until_closed(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
+
+@router.websocket("/api/sessions/{session_id}/ws")
+async def session_socket(websocket: WebSocket, session_id: str, services: AppServices):
+    """The same events as /events, one JSON message each: {"type": ..., "session": {...}}."""
+    try:
+        subscription = await services.live_hub.subscribe(session_id)
+    except HTTPException as exc:
+        await websocket.close(code=4000 + exc.status_code, reason=exc.detail)
+        return
+    await websocket.accept()
+    closed = asyncio.create_task(_until_closed(websocket))
+    try:
+        await websocket.send_text(orjson.dumps({"type": "snapshot", "session": subscription.snapshot}).decode())
+        while not closed.done():
+            event = await subscription.next(1.0)
+            if event is None:
+                continue
+            await websocket.send_text(orjson.dumps(event).decode())
+            if event["type"] == "deleted":
+                await websocket.close()
+                return
+    except Exception as exc:
+        # Usually the client going away mid-send
+        logger.debug("Live socket for %s closed: %s", session_id, exc)
+    finally:
+        closed.cancel()
+        subscription.close()
+
+
+# --- Async jobs ---
+async def payload_image(services: Services, payload: dict) -> str:
+    # image_base64 only in jobs queued before images were stored on submit
+    return await store_image(services, payload["session_id"], payload.get("image_base64"), payload.get("image_ref"))
+
+
+async def run_analyze_job(services: Services, payload: dict):
+    return await run_analyze_space(services, payload["session_id"], await payload_image(services, payload))
+
+
+async def run_identify_job(services: Services, payload: dict):
+    return await run_identify_items(services, payload["session_id"], await payload_image(services, payload))
+
+
+def register_jobs(queue: JobQueue, services: Services):
+    llm = services.llm
+    queue.register("analyze-space", llm.model_key("analyze"), partial(run_analyze_job, services))
+    queue.register("generate-tasks", llm.model_key("tasks"), lambda p: run_generate_tasks(services, p["session_id"]))
+    queue.register("identify-items", llm.model_key("items"), partial(run_identify_job, services))
+
+
+async def submit_job(services: Services, kind: str, body: BaseModel):
+    payload = body.model_dump(exclude={"image_base64"})
+    image_base64 = getattr(body, "image_base64", None)
+    if image_base64 is not None:
+        # The job document keeps the blob ref rather than the whole image
+        payload["image_ref"] = await store_image(services, body.session_id, image_base64, None)
+    job = await services.job_queue.submit(kind, payload)
+    return JSONResponse(status_code=202, content=job, headers={"Location": f"/api/jobs/{job['job_id']}"})
+
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, services: AppServices):
+    return await services.job_queue.get(job_id)
+
+
+@router.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, services: AppServices):
+    job_queue = services.job_queue
+    job = await job_queue.get(job_id)
+
+    async def stream():
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                yield f"event: {last_status}\ndata: {orjson.dumps(current).decode()}\n\n"
+            if current["status"] in FINISHED or await request.is_disconnected():
+                return
+            await job_queue.wait_for_change(job_id, timeout=1.0)
+            current = await job_queue.get(job_id)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def create_app() -> FastAPI:
+    """The ASGI app. Its services are created on startup and kept on `app.state`."""
+    app = FastAPI(title="Nudge API", default_response_class=ORJSONResponse, lifespan=lifespan)
+    if METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag", "Retry-After", "Location"],
     )
+    app.add_exception_handler(LlmCallError, llm_call_error_handler)
+    app.include_router(router)
+    return app
+
 
-    updated = await sessions_col.find_one({"session_id": session_id}, {"_id": 0})
-    return updated
+app = create_app()
@@ -0,0 +1,527 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+SESSION_PROJECTION = {"_id": 0, "last_active": 0}
+CHILD_PROJECTION = {"_id": 0, "session_id": 0, "position": 0, "last_active": 0}
+# Sessions untouched for this long are removed by Mongo's TTL monitor
+SESSION_TTL_DAYS = int(os.environ.get("SESSION_TTL_DAYS", "30"))
+# Split storage: how stale a session's task/item documents' last_active may get
+# before a write to the session refreshes it, keeping them clear of their TTL
+CHILD_TOUCH_SECONDS = 86400
+# "embedded" keeps tasks and items as arrays inside the session document;
+# "split" keeps a small session header and one document per task/item
+SESSION_STORAGE = os.environ.get("SESSION_STORAGE", "embedded")
+LIST_FIELDS = ("tasks", "items")
+# The id field of each list's entries
+LIST_KEYS = {"tasks": "task_id", "items": "item_id"}
+# Header fields the task toggle needs back to decide whether the session is done
+TOGGLE_FIELDS = ("completed_tasks", "total_tasks", "status")
+# Always returned, so every response can carry the session's ETag
+ALWAYS_FIELDS = ("session_id", "revision")
+
+# (offset, limit) into a task/item list
+Page = Optional[Tuple[int, int]]
+
+
+class SessionRepository:
+    """All reads and writes of the sessions collection go through here.
+
+    Mutations are a single find_one_and_update that checks existence, applies
+    the change and returns the new document, instead of find/update/find.
+    Reads and writes take optional `fields` to return only part of a session.
+    Every write bumps `revision`, which clients use as the session's version.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        # Told the session_id after each write, for live updates without change streams
+        self.on_write: Optional[Callable[[str], None]] = None
+        # Where archived sessions are looked up when a session is not found (archive.SessionArchive)
+        self.archive = None
+
+    def _written(self, session_id: str):
+        if self.on_write is not None:
+            self.on_write(session_id)
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("session_id", unique=True)
+        if SESSION_TTL_DAYS > 0:
+            await self.collection.create_index("last_active", expireAfterSeconds=SESSION_TTL_DAYS * 86400)
+
+    def projection(self, fields: Optional[List[str]] = None, tasks_page: Page = None,
+                   items_page: Page = None) -> dict:
+        if fields:
+            projection = {"_id": 0, **{f: 1 for f in (*ALWAYS_FIELDS, *fields)}}
+        else:
+            projection = dict(SESSION_PROJECTION)
+        for name, page in zip(LIST_FIELDS, (tasks_page, items_page)):
+            if page and (not fields or name in fields):
+                projection[name] = {"$slice": list(page)}
+        return projection
+
+    async def _hydrate(self, doc: dict, fields: Optional[List[str]] = None, tasks_page: Page = None,
+                       items_page: Page = None) -> dict:
+        return doc
+
+    async def create(self, session: dict) -> dict:
+        session = {**session, "revision": 0}
+        await self.collection.insert_one({**session, "last_active": datetime.now(timezone.utc)})
+        return session
+
+    async def load(self, session_id: str, fields: Optional[List[str]] = None, tasks_page: Page = None,
+                   items_page: Page = None, restore: bool = True) -> Optional[dict]:
+        """The session, restored from the archive if it is only there (unless `restore` is False)."""
+        doc = await self.collection.find_one({"session_id": session_id},
+                                             self.projection(fields, tasks_page, items_page))
+        if doc is None:
+            if restore and await self.restore(session_id):
+                return await self.load(session_id, fields, tasks_page, items_page)
+            return None
+        return await self._hydrate(doc, fields, tasks_page, items_page)
+
+    async def revision(self, session_id: str) -> Optional[int]:
+        doc = await self.get(session_id, {"_id": 0, "revision": 1})
+        return None if doc is None else doc.get("revision", 0)
+
+    async def get(self, session_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        """A full session, or just the header fields in `projection`."""
+        if projection is None:
+            return await self.load(session_id)
+        doc = await self.collection.find_one({"session_id": session_id}, projection)
+        if doc is None and await self.restore(session_id):
+            return await self.get(session_id, projection)
+        return doc
+
+    async def get_or_404(self, session_id: str, projection: Optional[dict] = None) -> dict:
+        doc = await self.get(session_id, projection)
+        if not doc:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return doc
+
+    async def update(self, session_id: str, update: dict, match: Optional[dict] = None,
+                     projection: Optional[dict] = None, fields: Optional[List[str]] = None) -> Optional[dict]:
+        """Apply `update` and return the updated session, or None if nothing matched.
+
+        `match` narrows the filter beyond session_id (e.g. an array element),
+        `updated_at`/`last_active` are stamped and `revision` bumped on every
+        write. An explicit `projection` returns raw header fields; otherwise
+        the session (limited to `fields`) is returned.
+        """
+        doc = await self.collection.find_one_and_update(
+            {"session_id": session_id, **(match or {})},
+            self._stamped(update),
+            projection=projection or self.projection(fields),
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            # `match` may have missed because the whole session was archived
+            if await self.restore(session_id):
+                return await self.update(session_id, update, match, projection, fields)
+            return None
+        self._written(session_id)
+        if projection is None:
+            doc = await self._hydrate(doc, fields)
+        return doc
+
+    def _stamped(self, update: dict) -> dict:
+        now = datetime.now(timezone.utc)
+        return {
+            **update,
+            "$set": {**update.get("$set", {}), "updated_at": now, "last_active": now},
+            "$inc": {**update.get("$inc", {}), "revision": 1},
+        }
+
+    async def update_or_404(self, session_id: str, update: dict, projection: Optional[dict] = None,
+                            fields: Optional[List[str]] = None) -> dict:
+        doc = await self.update(session_id, update, projection=projection, fields=fields)
+        if doc is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return doc
+
+    async def mark_completed(self, session_id: str, total_tasks: int) -> bool:
+        """Flip status to completed, only if every task is still done."""
+        result = await self.collection.update_one(
+            {"session_id": session_id, "completed_tasks": total_tasks},
+            {"$set": {"status": "completed"}, "$inc": {"revision": 1}},
+        )
+        if not result.modified_count:
+            return False
+        self._written(session_id)
+        return True
+
+    # --- Archiving ---
+    async def restore(self, session_id: str) -> bool:
+        """Move an archived session back in; False if it is not archived.
+
+        Called wherever a session is not found, so archiving is invisible to callers.
+        """
+        if self.archive is None:
+            return False
+        session = await self.archive.get(session_id)
+        if session is None:
+            return False
+        try:
+            await self.insert_full(session)
+        except (DuplicateKeyError, BulkWriteError):
+            # Another request restored it first
+            pass
+        await self.archive.delete(session_id)
+        self.archive.stats["restored"] += 1
+        return True
+
+    async def insert_full(self, session: dict):
+        await self.collection.insert_one({**session, "last_active": datetime.now(timezone.utc)})
+
+    async def remove(self, session_id: str, revision: int) -> bool:
+        """Delete a session, only if it is still at `revision`."""
+        # Sessions never written since revisions were added have none, which reads as 0
+        match = {"$in": [0, None]} if revision == 0 else revision
+        result = await self.collection.delete_one({"session_id": session_id, "revision": match})
+        return result.deleted_count > 0
+
+    # --- Tasks and items ---
+    async def replace_lists(self, session_id: str, tasks: Optional[list] = None, items: Optional[list] = None,
+                            header: Optional[dict] = None, projection: Optional[dict] = None) -> dict:
+        """Replace the task and/or item list, setting `header` fields in the same write."""
+        update = dict(header or {})
+        if tasks is not None:
+            update["tasks"] = tasks
+        if items is not None:
+            update["items"] = items
+        return await self.update_or_404(session_id, {"$set": update}, projection=projection)
+
+    async def append_task(self, session_id: str, task: dict):
+        await self.update(session_id, {"$push": {"tasks": task}, "$inc": {"total_tasks": 1}},
+                          projection={"_id": 0, "session_id": 1})
+
+    def _toggle_update(self, completed: bool) -> dict:
+        update = {"$set": {}, "$inc": {"completed_tasks": 1 if completed else -1}}
+        if completed:
+            update["$inc"]["streak"] = 1
+        else:
+            update["$set"]["status"] = "in_progress"
+        return update
+
+    async def _toggled(self, session_id: str, updated: dict, completed: bool) -> dict:
+        if completed and updated["completed_tasks"] >= updated["total_tasks"] and updated["status"] != "completed":
+            if await self.mark_completed(session_id, updated["total_tasks"]):
+                updated["status"] = "completed"
+                updated["revision"] += 1
+        return updated
+
+    async def _toggle_miss(self, session_id: str, task_id: str, fields: Optional[List[str]]) -> dict:
+        if not await self._has_child("tasks", session_id, "task_id", task_id):
+            raise HTTPException(status_code=404, detail="Task not found")
+        # Already in the requested state
+        return await self.load(session_id, fields)
+
+    async def _has_child(self, name: str, session_id: str, key: str, value: str) -> bool:
+        doc = await self.get_or_404(session_id, {"_id": 0, name: {"$elemMatch": {key: value}}})
+        return bool(doc.get(name))
+
+    async def toggle_task(self, session_id: str, task_id: str, completed: bool,
+                          fields: Optional[List[str]] = None) -> dict:
+        # Only match while the task is in the opposite state, so a toggle is applied
+        # (and counted) exactly once even when taps from several devices race.
+        update = self._toggle_update(completed)
+        update["$set"]["tasks.$.completed"] = completed
+        updated = await self.update(
+            session_id, update,
+            match={"tasks": {"$elemMatch": {"task_id": task_id, "completed": {"$ne": completed}}}},
+            fields=fields and [*fields, *TOGGLE_FIELDS],
+        )
+        if updated is None:
+            return await self._toggle_miss(session_id, task_id, fields)
+        return await self._toggled(session_id, updated, completed)
+
+    async def decide_item(self, session_id: str, item_id: str, decision: str,
+                          fields: Optional[List[str]] = None) -> dict:
+        updated = await self.update(
+            session_id,
+            {"$set": {"items.$.decision": decision}},
+            match={"items.item_id": item_id},
+            fields=fields,
+        )
+        if updated is None:
+            await self.get_or_404(session_id, {"_id": 1})
+            raise HTTPException(status_code=404, detail="Item not found")
+        return updated
+
+    async def _missing(self, name: str, session_id: str, key: str, ids: List[str]) -> List[str]:
+        doc = await self.get_or_404(session_id, {"_id": 0, f"{name}.{key}": 1})
+        existing = {entry[key] for entry in doc.get(name, [])}
+        return [i for i in ids if i not in existing]
+
+    async def _check_batch(self, name: str, session_id: str, key: str, ids: List[str]):
+        """Reject the whole batch, before writing anything, if any id is unknown."""
+        missing = await self._missing(name, session_id, key, ids)
+        if missing:
+            raise HTTPException(status_code=404, detail={"message": f"{key} not found", "missing": missing})
+
+    async def toggle_tasks(self, session_id: str, changes: Dict[str, bool],
+                           fields: Optional[List[str]] = None) -> dict:
+        """Apply many task toggles in one bulk write; each is counted only if it changes state."""
+        await self._check_batch("tasks", session_id, "task_id", list(changes))
+        ops = []
+        for task_id, completed in changes.items():
+            update = self._stamped(self._toggle_update(completed))
+            update["$set"]["tasks.$.completed"] = completed
+            ops.append(UpdateOne(
+                {"session_id": session_id,
+                 "tasks": {"$elemMatch": {"task_id": task_id, "completed": {"$ne": completed}}}},
+                update,
+            ))
+        result = await self.collection.bulk_write(ops, ordered=True)
+        self._written(session_id)
+        updated = await self.load(session_id, fields and [*fields, *TOGGLE_FIELDS])
+        return await self._toggled(session_id, updated, result.modified_count > 0 and any(changes.values()))
+
+    async def decide_items(self, session_id: str, changes: Dict[str, str],
+                           fields: Optional[List[str]] = None) -> dict:
+        await self._check_batch("items", session_id, "item_id", list(changes))
+        ops = [
+            UpdateOne({"session_id": session_id, "items.item_id": item_id},
+                      self._stamped({"$set": {"items.$.decision": decision}}))
+            for item_id, decision in changes.items()
+        ]
+        await self.collection.bulk_write(ops, ordered=True)
+        self._written(session_id)
+        return await self.load(session_id, fields)
+
+
+class SplitSessionRepository(SessionRepository):
+    """Session headers in `sessions`, tasks and items as their own documents.
+
+    Toggling a task or sorting an item rewrites one small document plus the
+    header counters, and reads only fetch the lists (or pages of them) that
+    were asked for. Children carry a `position` to keep the original order.
+    """
+
+    def __init__(self, collection, tasks_collection, items_collection, max_touched: int = 10000):
+        super().__init__(collection)
+        self.children = {"tasks": tasks_collection, "items": items_collection}
+        # session_id -> when this worker last refreshed its children's last_active
+        self._touched: OrderedDict = OrderedDict()
+        self.max_touched = max_touched
+
+    async def ensure_indexes(self):
+        await super().ensure_indexes()
+        for name, key in LIST_KEYS.items():
+            await self.children[name].create_index([("session_id", 1), (key, 1)], unique=True)
+            await self.children[name].create_index([("session_id", 1), ("position", 1)])
+            if SESSION_TTL_DAYS > 0:
+                # Children expire like their header, so a session removed by TTL leaves none behind
+                await self.children[name].create_index("last_active", expireAfterSeconds=SESSION_TTL_DAYS * 86400)
+
+    def _mark_touched(self, session_id: str):
+        self._touched[session_id] = time.monotonic()
+        self._touched.move_to_end(session_id)
+        while len(self._touched) > self.max_touched:
+            self._touched.popitem(last=False)
+
+    async def _touch_children(self, session_id: str):
+        """Refresh the children's last_active along with the header's, about once a day."""
+        touched = self._touched.get(session_id)
+        if touched is not None and time.monotonic() - touched < CHILD_TOUCH_SECONDS:
+            return
+        self._mark_touched(session_id)
+        now = datetime.now(timezone.utc)
+        await asyncio.gather(*(self.children[name].update_many(
+            # Also children written before they carried last_active
+            {"session_id": session_id, "last_active": {"$not": {"$gte": now - timedelta(seconds=CHILD_TOUCH_SECONDS)}}},
+            {"$set": {"last_active": now}},
+        ) for name in LIST_FIELDS))
+
+    async def update(self, session_id: str, update: dict, match: Optional[dict] = None,
+                     projection: Optional[dict] = None, fields: Optional[List[str]] = None) -> Optional[dict]:
+        doc = await super().update(session_id, update, match, projection, fields)
+        if doc is not None:
+            await self._touch_children(session_id)
+        return doc
+
+    def projection(self, fields: Optional[List[str]] = None, tasks_page: Page = None,
+                   items_page: Page = None) -> dict:
+        if fields:
+            return {"_id": 0, **{f: 1 for f in (*ALWAYS_FIELDS, *fields) if f not in LIST_FIELDS}}
+        return dict(SESSION_PROJECTION)
+
+    async def read_list(self, name: str, session_id: str, page: Page = None) -> list:
+        cursor = self.children[name].find({"session_id": session_id}, CHILD_PROJECTION).sort("position", 1)
+        if page:
+            cursor = cursor.skip(page[0]).limit(page[1])
+        return await cursor.to_list(length=None)
+
+    async def _hydrate(self, doc: dict, fields: Optional[List[str]] = None, tasks_page: Page = None,
+                       items_page: Page = None) -> dict:
+        pages = dict(zip(LIST_FIELDS, (tasks_page, items_page)))
+        wanted = [name for name in LIST_FIELDS if not fields or name in fields]
+        lists = await asyncio.gather(*(self.read_list(name, doc["session_id"], pages[name]) for name in wanted))
+        doc.update(zip(wanted, lists))
+        return doc
+
+    async def create(self, session: dict) -> dict:
+        session = {**session, "revision": 0}
+        header = {k: v for k, v in session.items() if k not in LIST_FIELDS}
+        await self.collection.insert_one({**header, "last_active": datetime.now(timezone.utc)})
+        self._mark_touched(session["session_id"])
+        return session
+
+    async def insert_full(self, session: dict):
+        # Children first: the session only becomes visible once the header is in
+        await asyncio.gather(*(self.write_list(name, session["session_id"], session.get(name, []))
+                               for name in LIST_FIELDS))
+        header = {k: v for k, v in session.items() if k not in LIST_FIELDS}
+        await self.collection.insert_one({**header, "last_active": datetime.now(timezone.utc)})
+
+    async def remove(self, session_id: str, revision: int) -> bool:
+        # Only children written before the header goes: a restore racing with this
+        # rewrites them with a newer last_active, and those must stay
+        cutoff = datetime.now(timezone.utc)
+        if not await super().remove(session_id, revision):
+            return False
+        await asyncio.gather(*(self.children[name].delete_many(
+            {"session_id": session_id, "last_active": {"$not": {"$gt": cutoff}}}) for name in LIST_FIELDS))
+        self._touched.pop(session_id, None)
+        return True
+
+    async def write_list(self, name: str, session_id: str, entries: list):
+        """Replace every child document of one list (also used by the migration tool).
+
+        Entries are upserted in place and only then are leftovers deleted, so a
+        reader never finds the list empty halfway through.
+        """
+        key = LIST_KEYS[name]
+        now = datetime.now(timezone.utc)
+        if entries:
+            await self.children[name].bulk_write([
+                ReplaceOne({"session_id": session_id, key: entry[key]},
+                           {**entry, "session_id": session_id, "position": i, "last_active": now}, upsert=True)
+                for i, entry in enumerate(entries)
+            ], ordered=False)
+        await self.children[name].delete_many({"session_id": session_id, key: {"$nin": [e[key] for e in entries]}})
+        self._mark_touched(session_id)
+
+    async def replace_lists(self, session_id: str, tasks: Optional[list] = None, items: Optional[list] = None,
+                            header: Optional[dict] = None, projection: Optional[dict] = None) -> dict:
+        await self.update_or_404(session_id, {"$set": dict(header or {})}, projection={"_id": 0, "session_id": 1})
+        writes = [self.write_list(name, session_id, entries)
+                  for name, entries in (("tasks", tasks), ("items", items)) if entries is not None]
+        await asyncio.gather(*writes)
+        # Bump the revision again once the children are in place, so a reader that
+        # caught the header mid-write doesn't keep a stale list under a current ETag
+        return await self.update_or_404(session_id, {}, projection=projection)
+
+    async def append_task(self, session_id: str, task: dict):
+        head = await self.update(session_id, {"$inc": {"total_tasks": 1}}, projection={"_id": 0, "total_tasks": 1})
+        if head is not None:
+            await self.children["tasks"].insert_one({**task, "session_id": session_id,
+                                                     "position": head["total_tasks"] - 1,
+                                                     "last_active": datetime.now(timezone.utc)})
+            await self.update(session_id, {}, projection={"_id": 0, "session_id": 1})
+
+    async def _has_child(self, name: str, session_id: str, key: str, value: str) -> bool:
+        if await self.children[name].find_one({"session_id": session_id, key: value}, {"_id": 1}):
+            return True
+        await self.get_or_404(session_id, {"_id": 1})
+        return False
+
+    async def toggle_task(self, session_id: str, task_id: str, completed: bool,
+                          fields: Optional[List[str]] = None) -> dict:
+        # Header first, guarded by the revision read along with the task, so the
+        # revision never lags a flipped task; any write in between makes it retry
+        while True:
+            head, task = await asyncio.gather(
+                self.collection.find_one({"session_id": session_id}, {"_id": 0, "revision": 1}),
+                self.children["tasks"].find_one({"session_id": session_id, "task_id": task_id},
+                                                {"_id": 0, "completed": 1}),
+            )
+            if head is None and await self.restore(session_id):
+                continue
+            if head is None or task is None or task.get("completed") == completed:
+                return await self._toggle_miss(session_id, task_id, fields)
+            revision = head.get("revision", 0)
+            counted = await self.update(session_id, self._toggle_update(completed),
+                                        match={"revision": {"$in": [0, None]} if revision == 0 else revision},
+                                        projection={"_id": 0, "session_id": 1})
+            if counted is not None:
+                break
+        # Still conditional: a toggle that read the task before this one wrote it got counted too
+        result = await self.children["tasks"].update_one(
+            {"session_id": session_id, "task_id": task_id, "completed": {"$ne": completed}},
+            {"$set": {"completed": completed}},
+        )
+        if not result.matched_count:
+            undo = {"$inc": {"completed_tasks": -1 if completed else 1}}
+            if completed:
+                undo["$inc"]["streak"] = -1
+            await self.update(session_id, undo, projection={"_id": 0, "session_id": 1})
+            return await self._toggle_miss(session_id, task_id, fields)
+        # Bumped again with the task in place, so a reader that caught the header
+        # in between doesn't keep the old task under the current ETag
+        updated = await self.update_or_404(session_id, {}, fields=fields and [*fields, *TOGGLE_FIELDS])
+        return await self._toggled(session_id, updated, completed)
+
+    async def decide_item(self, session_id: str, item_id: str, decision: str,
+                          fields: Optional[List[str]] = None) -> dict:
+        result = await self.children["items"].update_one(
+            {"session_id": session_id, "item_id": item_id},
+            {"$set": {"decision": decision}},
+        )
+        if not result.matched_count:
+            if await self.restore(session_id):
+                return await self.decide_item(session_id, item_id, decision, fields)
+            await self.get_or_404(session_id, {"_id": 1})
+            raise HTTPException(status_code=404, detail="Item not found")
+        return await self.update_or_404(session_id, {}, fields=fields)
+
+    async def _missing(self, name: str, session_id: str, key: str, ids: List[str]) -> List[str]:
+        existing = set(await self.children[name].distinct(key, {"session_id": session_id, key: {"$in": ids}}))
+        missing = [i for i in ids if i not in existing]
+        if missing:
+            if await self.restore(session_id):
+                return await self._missing(name, session_id, key, ids)
+            await self.get_or_404(session_id, {"_id": 1})
+        return missing
+
+    async def toggle_tasks(self, session_id: str, changes: Dict[str, bool],
+                           fields: Optional[List[str]] = None) -> dict:
+        await self._check_batch("tasks", session_id, "task_id", list(changes))
+        # One bulk write per direction, so each result says how many toggles really flipped
+        by_state = {state: [task_id for task_id, completed in changes.items() if completed is state]
+                    for state in (True, False)}
+        results = await asyncio.gather(*(
+            self.children["tasks"].update_many(
+                {"session_id": session_id, "task_id": {"$in": ids}, "completed": {"$ne": state}},
+                {"$set": {"completed": state}},
+            )
+            for state, ids in by_state.items()
+        ))
+        done, undone = (result.modified_count for result in results)
+        update = {"$inc": {"completed_tasks": done - undone, "streak": done}}
+        if undone:
+            update["$set"] = {"status": "in_progress"}
+        updated = await self.update_or_404(session_id, update, fields=fields and [*fields, *TOGGLE_FIELDS])
+        return await self._toggled(session_id, updated, done > 0)
+
+    async def decide_items(self, session_id: str, changes: Dict[str, str],
+                           fields: Optional[List[str]] = None) -> dict:
+        await self._check_batch("items", session_id, "item_id", list(changes))
+        await self.children["items"].bulk_write([
+            UpdateOne({"session_id": session_id, "item_id": item_id}, {"$set": {"decision": decision}})
+            for item_id, decision in changes.items()
+        ], ordered=False)
+        return await self.update_or_404(session_id, {}, fields=fields)
+
+
+def create_repository(db) -> SessionRepository:
+    if SESSION_STORAGE == "split":
+        return SplitSessionRepository(db["sessions"], db["session_tasks"], db["session_items"])
+    return SessionRepository(db["sessions"])
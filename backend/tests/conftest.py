@@ -0,0 +1,53 @@
+"""Local tests: run from backend/ with `python -m pytest -q tests`.
+
+MongoDB is mongomock-motor (requirements.txt) and model calls go to the
+load test's fake chat, so nothing outside the process is needed.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [BACKEND, os.path.join(BACKEND, "benchmarks")]
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nudge_test")
+os.environ.setdefault("LLM_PREWARM", "0")
+os.environ.setdefault("ARCHIVE_ENABLED", "0")
+os.environ.setdefault("RATE_LIMIT_IP_PER_MIN", "0")
+os.environ.setdefault("RATE_LIMIT_SESSION_PER_MIN", "0")
+
+import motor.motor_asyncio  # noqa: E402
+
+# Kept for the tests that need a driver which really fails to connect
+MOTOR_CLIENT = motor.motor_asyncio.AsyncIOMotorClient
+
+from load_test import use_mongomock  # noqa: E402
+
+use_mongomock()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    from mongomock_motor import AsyncMongoMockClient
+    # tz_aware like the app's client (database.create_client)
+    return AsyncMongoMockClient(tz_aware=True)[f"test_{uuid.uuid4().hex}"]
+
+
+@pytest.fixture(params=["embedded", "split"])
+def repo(request, db):
+    from archive import SessionArchive
+    from session_repo import SessionRepository, SplitSessionRepository
+    if request.param == "split":
+        repo = SplitSessionRepository(db["sessions"], db["session_tasks"], db["session_items"])
+    else:
+        repo = SessionRepository(db["sessions"])
+    repo.archive = SessionArchive(db["sessions_archive"])
+    return repo
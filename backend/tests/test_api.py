@@ -0,0 +1,102 @@
+import io
+import base64
+import json
+from argparse import Namespace
+
+import httpx
+import pytest
+from PIL import Image
+
+import server
+from admission import TokenBucketLimiter
+from load_test import use_fake_llm
+
+pytestmark = pytest.mark.anyio
+
+FAKE_LLM = Namespace(llm_latency=0.0, llm_jitter=0.0, llm_error_rate=0.0, tasks=3, items=2)
+
+
+@pytest.fixture
+async def app():
+    app = server.create_app()
+    async with server.lifespan(app):
+        use_fake_llm(app.state.services.llm, FAKE_LLM)
+        yield app
+
+
+@pytest.fixture
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), "red").save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def model_calls(app) -> int:
+    return sum(pool["calls"] for pool in app.state.services.llm.snapshot()["pools"].values())
+
+
+async def test_unknown_session_is_404_before_any_model_call(app, client):
+    calls = model_calls(app)
+    for path in ("/api/analyze-space/upload", "/api/identify-items/upload"):
+        response = await client.post(path, data={"session_id": "missing"}, files={"image": ("a.jpg", jpeg(), "image/jpeg")})
+        assert response.status_code == 404
+    image = base64.b64encode(jpeg()).decode()
+    for path in ("/api/analyze-space", "/api/analyze-space/multi", "/api/identify-items", "/api/analyze-and-plan"):
+        body = {"session_id": "missing", "image_base64": image, "images": [{"image_base64": image}]}
+        assert (await client.post(path, json=body)).status_code == 404
+    assert model_calls(app) == calls
+
+
+async def test_uploads_count_against_the_session_rate_limit(app, client):
+    app.state.services.admission.session_limiter = TokenBucketLimiter(1, 1)
+    session_id = (await client.post("/api/sessions", json={"name": "x"})).json()["session_id"]
+    upload = {"data": {"session_id": session_id}, "files": {"image": ("a.jpg", jpeg(), "image/jpeg")}}
+    assert (await client.post("/api/analyze-space/upload", **upload)).status_code == 200
+    response = await client.post("/api/identify-items/upload", **upload)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+
+
+async def test_stream_errors_do_not_leak_exception_text(app, client):
+    session_id = (await client.post("/api/sessions", json={"name": "x"})).json()["session_id"]
+    upload = {"data": {"session_id": session_id}, "files": {"image": ("a.jpg", jpeg(), "image/jpeg")}}
+    assert (await client.post("/api/analyze-space/upload", **upload)).status_code == 200
+
+    class Broken:
+        async def stream_message(self, message):
+            yield '[{"title": "a"}, '
+            raise RuntimeError("secret upstream detail")
+
+    app.state.services.llm._chat = lambda purpose, target: Broken()
+    response = await client.post("/api/generate-tasks/stream", json={"session_id": session_id})
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[-1] == {"type": "error", "detail": "Something went wrong, please try again", "tasks_saved": 1}
+
+
+async def test_apps_do_not_share_model_state(app):
+    other = server.create_app()
+    async with server.lifespan(other):
+        mine, theirs = app.state.services, other.state.services
+        assert mine.llm is not theirs.llm and mine.admission is not theirs.admission
+        assert mine.blobs is not theirs.blobs and mine.preparing is not theirs.preparing
+
+
+async def test_item_batch_with_an_invalid_decision_writes_nothing(app, client):
+    session_id = (await client.post("/api/sessions", json={"name": "x"})).json()["session_id"]
+    items = [{"item_id": f"item-{i}", "name": "Mug"} for i in range(2)]
+    await app.state.services.sessions.replace_lists(session_id, items=items)
+    before = (await client.get(f"/api/sessions/{session_id}")).json()
+
+    changes = [{"item_id": "item-0", "decision": "keep"}, {"item_id": "item-1", "decision": "burn"}]
+    response = await client.post(f"/api/sessions/{session_id}/items/batch", json={"changes": changes})
+    assert response.status_code == 400
+    assert response.json()["detail"] == {"message": "Decision must be keep, sell, or donate", "invalid": ["item-1"]}
+    assert (await client.get(f"/api/sessions/{session_id}")).json() == before
+
+    response = await client.post(f"/api/sessions/{session_id}/tasks/batch", json={"changes": []})
+    assert response.status_code == 422
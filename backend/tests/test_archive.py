@@ -0,0 +1,77 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from archive import Archiver
+from helpers import utc_now
+from live import SessionHub
+
+pytestmark = pytest.mark.anyio
+
+
+def legacy_session(session_id: str, age: timedelta, status: str) -> dict:
+    # As the original server wrote them: isoformat dates, no revision or last_active
+    created = (utc_now() - age).isoformat()
+    return {"session_id": session_id, "name": "Old", "status": status, "analysis": None,
+            "tasks": [{"task_id": "task-0", "title": "Sweep", "completed": True}], "items": [],
+            "completed_tasks": 1, "total_tasks": 1, "streak": 1, "created_at": created, "updated_at": created}
+
+
+async def new_session(repo, session_id: str) -> dict:
+    now = utc_now()
+    await repo.create({"session_id": session_id, "name": "New", "status": "created", "analysis": None,
+                       "tasks": [], "items": [], "completed_tasks": 0, "total_tasks": 0, "streak": 0,
+                       "created_at": now, "updated_at": now})
+    await repo.replace_lists(session_id, tasks=[{"task_id": "task-0", "title": "Sweep", "completed": False}])
+    return await repo.collection.find_one({"session_id": session_id},
+                                          {"_id": 0, "session_id": 1, "revision": 1, "last_active": 1})
+
+
+async def test_legacy_sessions_are_archived_and_restored(db):
+    from session_repo import SessionRepository
+    from archive import SessionArchive
+    repo = SessionRepository(db["sessions"])
+    repo.archive = SessionArchive(db["sessions_archive"])
+    await repo.collection.insert_many([
+        legacy_session("done", timedelta(days=2), "completed"),
+        legacy_session("idle", timedelta(days=30), "in_progress"),
+        legacy_session("recent", timedelta(hours=1), "completed"),
+    ])
+
+    assert await Archiver(repo, repo.archive).sweep() == 2
+    live = sorted([doc["session_id"] async for doc in repo.collection.find({}, {"session_id": 1})])
+    assert live == ["recent"]
+    archived = await repo.archive.collection.find_one({"session_id": "idle"})
+    # The TTL clock starts from when the session was created, not when it was archived
+    assert archived["last_active"] < utc_now() - timedelta(days=29)
+
+    restored = await repo.load("done")
+    assert restored["tasks"][0]["title"] == "Sweep"
+    assert not await repo.archive.contains("done")
+
+
+async def test_archiving_never_restores(repo):
+    head = await new_session(repo, "s1")
+    archiver = Archiver(repo, repo.archive)
+    assert await archiver.archive_one(head) == 1
+    # A second sweeper that read the same head before the first one archived it
+    assert await archiver.archive_one(head) == 0
+    assert await repo.collection.find_one({"session_id": "s1"}) is None
+    assert await repo.archive.contains("s1")
+
+
+async def test_live_reload_leaves_archived_sessions_archived(repo):
+    head = await new_session(repo, "s1")
+    hub = SessionHub(repo)
+    hub.debounce = 0
+    subscription = await hub.subscribe("s1")
+    try:
+        await Archiver(repo, repo.archive).archive_one(head)
+        hub.notify("s1")
+        assert await subscription.next(0.2) is None
+        assert await repo.archive.contains("s1")
+        assert await repo.collection.find_one({"session_id": "s1"}) is None
+    finally:
+        subscription.close()
+        await asyncio.sleep(0)
@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from coalesce import MongoFlightStore, SingleFlight
+from resilience import LlmCallError, LLM_CALL_ERROR_DETAIL
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_remote_follower_sees_the_leaders_status(db):
+    # Two workers sharing one flight collection
+    leader, follower = SingleFlight(MongoFlightStore(db["flights"])), SingleFlight(MongoFlightStore(db["flights"]))
+    started = asyncio.Event()
+
+    async def failing():
+        started.set()
+        await asyncio.sleep(0.1)
+        raise LlmCallError("LLM call failed after 3 attempts", [{"error": "secret upstream detail"}])
+
+    lead = asyncio.ensure_future(leader.run("k", "d", failing))
+    await started.wait()
+    with pytest.raises(HTTPException) as raised:
+        await follower.run("k", "d", failing)
+    assert follower.stats["joined_remote"] == 0 and follower.stats["led"] == 0
+    assert raised.value.status_code == 502
+    assert raised.value.detail == LLM_CALL_ERROR_DETAIL
+    assert raised.value.headers == {"Retry-After": "5"}
+    with pytest.raises(LlmCallError):
+        await lead
@@ -0,0 +1,60 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_pipeline import IMAGE_MAX_EDGE, panorama_tiles, prepare_image_path, preprocess_image, shutdown_executor, tile_image
+
+pytestmark = pytest.mark.anyio
+
+
+def jpeg(size, orientation=None) -> bytes:
+    img = Image.new("RGB", size, "blue")
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    out = io.BytesIO()
+    img.save(out, "JPEG", exif=exif)
+    return out.getvalue()
+
+
+def opened(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+def test_preprocess_downscales_applies_orientation_and_drops_exif():
+    # Orientation 6: stored landscape, shown portrait
+    img = opened(preprocess_image(jpeg((800, 400), orientation=6), max_edge=200))
+    assert img.format == "JPEG" and img.size == (100, 200)
+    assert not img.getexif()
+
+
+def test_small_images_are_not_upscaled():
+    assert opened(preprocess_image(jpeg((120, 80)), max_edge=200)).size == (120, 80)
+
+
+def test_tiles_cover_the_image_with_overlap():
+    tiles = [opened(tile) for tile in tile_image(jpeg((900, 300)), 3, max_edge=1000)]
+    assert len(tiles) == 3
+    assert all(tile.height == 300 for tile in tiles)
+    assert sum(tile.width for tile in tiles) > 900
+
+
+def test_only_panoramas_are_tiled(tmp_path):
+    for size, orientation, expected in (((600, 400), None, 1), ((1800, 400), None, 3),
+                                        ((1800, 400), 6, 1), ((6000, 400), None, 4)):
+        path = tmp_path / "photo.jpg"
+        path.write_bytes(jpeg(size, orientation))
+        assert panorama_tiles(str(path), max_tiles=4) == expected
+
+
+async def test_undecodable_images_are_sent_as_they_are(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"not an image")
+    try:
+        assert await prepare_image_path(str(path)) == [b"not an image"]
+        path.write_bytes(jpeg((3000, 1000)))
+        [prepared] = await prepare_image_path(str(path))
+        assert max(opened(prepared).size) <= IMAGE_MAX_EDGE
+    finally:
+        shutdown_executor()
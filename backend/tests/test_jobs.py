@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+import jobs
+from helpers import utc_now
+from jobs import JobQueue, MemoryJobStore, MongoJobStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def store(request, db):
+    return MemoryJobStore() if request.param == "memory" else MongoJobStore(db["jobs"])
+
+
+@pytest.fixture
+def short_lease(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(jobs, "JOB_RECLAIM_INTERVAL_SECONDS", 0.05)
+
+
+async def wait_finished(queue: JobQueue, job_id: str) -> dict:
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["status"] in jobs.FINISHED:
+            return job
+        await asyncio.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+async def test_long_job_keeps_its_lease(store, short_lease):
+    calls = []
+
+    async def slow(payload):
+        calls.append(payload["n"])
+        await asyncio.sleep(1.0)
+        return {"n": payload["n"]}
+
+    queue = JobQueue(store, workers=2, model_concurrency=1)
+    queue.register("slow", "model", slow)
+    await queue.start()
+    try:
+        # The second job waits behind the first for longer than a lease
+        submitted = [await queue.submit("slow", {"n": n}) for n in range(2)]
+        finished = [await wait_finished(queue, job["job_id"]) for job in submitted]
+    finally:
+        await queue.stop()
+    assert sorted(calls) == [0, 1]
+    assert [job["status"] for job in finished] == ["succeeded", "succeeded"]
+    assert [job["attempts"] for job in finished] == [1, 1]
+
+
+async def test_lapsed_lease_is_reclaimed(store, short_lease):
+    async def handler(payload):
+        return {"ok": True}
+
+    queue = JobQueue(store)
+    queue.register("work", "model", handler)
+    await queue.start()
+    try:
+        # After the startup recovery, so only the periodic check can pick it up
+        await asyncio.sleep(0.1)
+        # Claimed by a worker that died: running, with a lease that has run out
+        await store.create({"job_id": "orphan", "kind": "work", "session_id": None, "status": "running",
+                            "payload": {}, "result": None, "error": None, "attempts": 1,
+                            "lease_until": utc_now(), "created_at": utc_now().isoformat()})
+        job = await wait_finished(queue, "orphan")
+    finally:
+        await queue.stop()
+    assert job["status"] == "succeeded"
+    assert job["attempts"] == 2
+
+
+async def test_memory_store_drops_finished_jobs(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETENTION_SECONDS", 0)
+    store = MemoryJobStore()
+    await store.create({"job_id": "done", "status": "queued", "lease_until": utc_now()})
+    await store.finish("done", {"status": "succeeded"})
+    assert await store.get("done") is None
+
+
+async def test_failed_job_reports_no_exception_text(store):
+    async def broken(payload):
+        raise RuntimeError("secret upstream detail")
+
+    queue = JobQueue(store, workers=1)
+    queue.register("broken", "model", broken)
+    await queue.start()
+    try:
+        job = await wait_finished(queue, (await queue.submit("broken", {}))["job_id"])
+    finally:
+        await queue.stop()
+    assert job["error"] == {"status_code": 500, "detail": "Internal Server Error"}
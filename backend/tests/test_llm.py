@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from llm import LlmClientManager
+from resilience import ResilientCaller
+
+pytestmark = pytest.mark.anyio
+
+
+class Message:
+    def __init__(self, text):
+        self.text = text
+
+
+class StalledChat:
+    """Streams `chunks`, then hangs; send_message returns the whole reply."""
+
+    def __init__(self, chunks, reply="[1, 2]"):
+        self.chunks = chunks
+        self.reply = reply
+
+    async def send_message(self, message):
+        return self.reply
+
+    async def stream_message(self, message):
+        for chunk in self.chunks:
+            yield chunk
+        await asyncio.sleep(60)
+
+
+def manager(chat) -> LlmClientManager:
+    llm = LlmClientManager("key", resilience=ResilientCaller(timeout=0.1, max_retries=0))
+
+    async def ready():
+        pass
+
+    llm.ready = ready
+    llm._message = lambda purpose, image_base64, params: Message("hi")
+    llm._chat = lambda purpose, target: chat
+    return llm
+
+
+async def test_stream_that_never_starts_falls_back_to_send():
+    llm = manager(StalledChat([]))
+    chunks = [chunk async for chunk in llm.stream("items")]
+    assert chunks == ["[1, 2]"]
+    assert llm.snapshot()["pools"]["/".join(llm.target("items"))]["calls"] == 2
+
+
+async def test_stream_that_stalls_midway_times_out():
+    llm = manager(StalledChat(["[1,"]))
+    chunks = []
+    with pytest.raises(asyncio.TimeoutError):
+        async for chunk in llm.stream("items"):
+            chunks.append(chunk)
+    assert chunks == ["[1,"]
+
+
+async def test_unstreamed_reply_has_no_first_byte_time():
+    class Chat:
+        async def send_message(self, message):
+            return "[]"
+
+    llm = manager(Chat())
+    assert [chunk async for chunk in llm.stream("items")] == ["[]"]
+    assert llm.snapshot()["pools"]["/".join(llm.target("items"))]["last"]["first_byte_ms"] is None
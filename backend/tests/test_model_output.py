@@ -0,0 +1,41 @@
+import pytest
+
+from model_output import OutputParseError, OutputParser
+
+
+def test_truncated_reply_keeps_complete_entries():
+    parser = OutputParser()
+    tasks = parser.parse('[{"title":"a"},{"ti', "tasks")
+    # No phantom entry from the cut-off object
+    assert [task["title"] for task in tasks] == ["a"]
+    assert parser.stats["tasks"]["repaired"] == 1
+
+
+def test_stream_yields_entries_as_they_close():
+    parser = OutputParser()
+    stream = parser.stream("tasks")
+    assert stream.feed('Sure!\n```json\n[{"title": "a", "note": "}{"') == []
+    assert [task["title"] for task in stream.feed('},\n{"title": "b",},')] == ["a", "b"]
+    assert stream.feed('{"title": "c" "d"}]\n```') == []
+    assert stream.finished
+    stream.close()
+    stats = parser.stats["tasks"]
+    assert stats["ok"] == 1 and stats["repaired"] == 1 and stats["dropped_entries"] == 1
+
+
+def test_stream_matches_whole_reply_parse():
+    reply = '[{"title": "a", "estimated_minutes": "ten"}, {"title": "b"},]'
+    whole = OutputParser().parse(reply, "tasks")
+    stream = OutputParser().stream("tasks")
+    streamed = [task for char in reply for task in stream.feed(char)]
+    stream.close()
+    assert streamed == whole
+
+
+def test_stream_without_payload_fails():
+    parser = OutputParser()
+    stream = parser.stream("tasks")
+    stream.feed("I can't help with that.")
+    with pytest.raises(OutputParseError):
+        stream.close()
+    assert parser.stats["tasks"]["failed"] == 1
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController
+from resilience import ResilientCaller
+
+pytestmark = pytest.mark.anyio
+
+TARGET = ("openai", "test")
+
+
+async def test_cancelled_call_cancels_its_attempt():
+    caller = ResilientCaller(hedge=True, max_retries=0)
+    for _ in range(50):
+        caller.latency.observe(TARGET, 0.5)
+    cancelled = asyncio.Event()
+
+    async def attempt(target):
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    # Cancelled while waiting out the hedge delay, before any backup is sent
+    call = asyncio.ensure_future(caller.call(attempt, TARGET))
+    await asyncio.sleep(0.1)
+    call.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+PRIMARY, FALLBACK = ("fake", "primary"), ("fake", "fallback")
+
+
+async def scenario(max_concurrent, replies):
+    """Run one call; `replies` maps a target to what each of its calls does in turn."""
+    admission = AdmissionController(max_concurrent=max_concurrent)
+    caller = ResilientCaller(backoff_base=0, hedge=True, fallbacks=[FALLBACK], admission=admission)
+    for _ in range(50):
+        caller.latency.observe(PRIMARY, 0.01)
+    active = []
+
+    async def attempt(target):
+        active.append({model: gate.active for model, gate in admission._gates.items()})
+        delay, reply = replies[target].pop(0)
+        await asyncio.sleep(delay)
+        if reply is None:
+            raise asyncio.TimeoutError()
+        return reply
+
+    result = await caller.call(attempt, PRIMARY)
+    return result, caller.stats, active, admission
+
+
+async def test_retry_holds_one_slot():
+    result, stats, active, _ = await scenario(4, {PRIMARY: [(0, None), (0, "retried")]})
+    assert result == "retried" and stats["retries"] == 1
+    assert all(a["fake/primary"] == 1 for a in active)
+
+
+async def test_hedge_takes_a_slot_of_its_own():
+    result, stats, active, _ = await scenario(4, {PRIMARY: [(1, "slow"), (0, "hedged")]})
+    assert result == "hedged" and stats["hedge_wins"] == 1
+    assert active[-1]["fake/primary"] == 2
+
+
+async def test_no_hedge_without_a_free_slot():
+    result, stats, _, _ = await scenario(1, {PRIMARY: [(0.1, "waited")]})
+    assert result == "waited" and not stats["hedges"] and stats["hedges_skipped"] == 1
+
+
+async def test_fallback_is_admitted_for_its_own_model():
+    result, stats, active, admission = await scenario(4, {PRIMARY: [(0, None)] * 3, FALLBACK: [(0, "fell back")]})
+    assert result == "fell back" and stats["fallbacks"] == 1
+    assert active[-1] == {"fake/primary": 0, "fake/fallback": 1}
+    assert admission._gates["fake/fallback"].admitted == 1
@@ -0,0 +1,9 @@
+from server import Session
+
+
+def test_invalid_legacy_fields_are_sent_as_defaults():
+    doc = {"session_id": "s", "streak": "n/a",
+           "tasks": [{"task_id": "task-0", "title": None, "estimated_minutes": "ten", "completed": True}]}
+    out = Session.model_validate(doc).model_dump(mode="json", exclude_unset=True)
+    assert out == {"session_id": "s", "streak": 0,
+                   "tasks": [{"task_id": "task-0", "title": "Task", "estimated_minutes": 5, "completed": True}]}
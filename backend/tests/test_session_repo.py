@@ -0,0 +1,107 @@
+import asyncio
+import random
+
+import pytest
+from fastapi import HTTPException
+
+from helpers import utc_now
+
+pytestmark = pytest.mark.anyio
+
+
+async def session_with_tasks(repo, session_id: str, count: int = 3):
+    now = utc_now()
+    await repo.create({"session_id": session_id, "name": "Room", "status": "created", "analysis": None,
+                       "tasks": [], "items": [], "completed_tasks": 0, "total_tasks": 0, "streak": 0,
+                       "created_at": now, "updated_at": now})
+    tasks = [{"task_id": f"task-{i}", "title": "Sweep", "completed": False} for i in range(count)]
+    await repo.replace_lists(session_id, tasks=tasks, header={"total_tasks": count, "status": "in_progress"})
+
+
+async def test_toggle_is_counted_once_when_taps_race(repo):
+    await session_with_tasks(repo, "s")
+    await asyncio.gather(*(repo.toggle_task("s", "task-0", True) for _ in range(5)))
+    session = await repo.load("s")
+    assert session["completed_tasks"] == 1 and session["streak"] == 1
+    assert [task["completed"] for task in session["tasks"]] == [True, False, False]
+
+
+async def test_counters_match_tasks_after_mixed_toggles(repo):
+    await session_with_tasks(repo, "s")
+    rng = random.Random(7)
+    changes = [(f"task-{rng.randrange(3)}", rng.random() < 0.6) for _ in range(30)]
+    await asyncio.gather(*(repo.toggle_task("s", task_id, completed) for task_id, completed in changes))
+    session = await repo.load("s")
+    assert session["completed_tasks"] == sum(task["completed"] for task in session["tasks"])
+
+
+async def test_toggle_returns_the_revision_it_wrote(repo):
+    await session_with_tasks(repo, "s")
+    toggled = await repo.toggle_task("s", "task-1", True)
+    stored = await repo.load("s")
+    assert toggled["revision"] == stored["revision"]
+    assert toggled["tasks"] == stored["tasks"] and stored["tasks"][1]["completed"]
+
+
+async def test_toggle_to_current_state_changes_nothing(repo):
+    await session_with_tasks(repo, "s")
+    before = await repo.load("s")
+    after = await repo.toggle_task("s", "task-0", False)
+    assert after["revision"] == before["revision"] and after["completed_tasks"] == 0
+
+
+async def test_toggle_of_missing_task_or_session_is_404(repo):
+    await session_with_tasks(repo, "s")
+    with pytest.raises(HTTPException) as raised:
+        await repo.toggle_task("s", "task-9", True)
+    assert (raised.value.status_code, raised.value.detail) == (404, "Task not found")
+    with pytest.raises(HTTPException) as raised:
+        await repo.toggle_task("missing", "task-0", True)
+    assert (raised.value.status_code, raised.value.detail) == (404, "Session not found")
+
+
+async def test_last_toggle_completes_the_session(repo):
+    await session_with_tasks(repo, "s", count=2)
+    await repo.toggle_task("s", "task-0", True)
+    session = await repo.toggle_task("s", "task-1", True)
+    assert session["status"] == "completed" and session["completed_tasks"] == 2
+
+
+async def test_split_toggle_bumps_the_header_before_the_task(db):
+    from session_repo import SplitSessionRepository
+    repo = SplitSessionRepository(db["sessions"], db["session_tasks"], db["session_items"])
+    await session_with_tasks(repo, "s")
+    before = (await repo.load("s"))["revision"]
+    tasks = repo.children["tasks"]
+    update_one = tasks.update_one
+    seen = []
+
+    async def spy(query, update, **kwargs):
+        seen.append((await repo.collection.find_one({"session_id": "s"}))["revision"])
+        return await update_one(query, update, **kwargs)
+
+    tasks.update_one = spy
+    await repo.toggle_task("s", "task-0", True)
+    # Whoever reads the task flipped also reads a newer revision than before
+    assert seen and seen[0] > before
+
+
+async def test_batch_toggle_counts_only_real_flips(repo):
+    await session_with_tasks(repo, "s")
+    await repo.toggle_task("s", "task-0", True)
+    session = await repo.toggle_tasks("s", {"task-0": True, "task-1": True, "task-2": False})
+    assert session["completed_tasks"] == 2 and session["streak"] == 2
+    assert [task["completed"] for task in session["tasks"]] == [True, True, False]
+
+
+async def test_batch_toggle_with_unknown_task_writes_nothing(repo):
+    await session_with_tasks(repo, "s")
+    before = await repo.load("s")
+    with pytest.raises(HTTPException) as raised:
+        await repo.toggle_tasks("s", {"task-0": True, "task-7": True, "task-9": False})
+    assert raised.value.status_code == 404
+    assert raised.value.detail == {"message": "task_id not found", "missing": ["task-7", "task-9"]}
+    assert await repo.load("s") == before
+    with pytest.raises(HTTPException) as raised:
+        await repo.toggle_tasks("missing", {"task-0": True})
+    assert (raised.value.status_code, raised.value.detail) == (404, "Session not found")
@@ -0,0 +1,25 @@
+import httpx
+import pytest
+
+import database
+import server
+from conftest import MOTOR_CLIENT
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_starts_degraded_while_mongo_is_unreachable(monkeypatch):
+    monkeypatch.setattr(database, "AsyncIOMotorClient", MOTOR_CLIENT)
+    monkeypatch.setattr(database, "MONGO_SERVER_SELECTION_TIMEOUT_MS", 200)
+    monkeypatch.setattr(server, "MONGO_URL", "mongodb://127.0.0.1:9")
+    app = server.create_app()
+    async with server.lifespan(app):
+        services = app.state.services
+        # Index creation waits in the background instead of failing startup
+        assert services.index_setup is not None and not services.index_setup.done()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            health = await client.get("/api/health")
+            assert health.status_code == 503 and health.json()["db"]["ready"] is False
+            assert (await client.get("/api/llm/stats")).status_code == 200
+    assert services.index_setup.cancelled()
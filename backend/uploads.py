@@ -0,0 +1,53 @@
+import os
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartParser, MultiPartException
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+async def _limited_stream(request: Request, max_bytes: int):
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+        yield chunk
+
+
+async def read_image_upload(request: Request, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Parse a multipart body with `session_id` and `image` fields.
+
+    The body is streamed chunk by chunk into a spooled temp file (Starlette
+    spills to disk past 1MB), so the raw upload is never held in memory as a
+    second copy. Oversized uploads are rejected from Content-Length before any
+    body is read, or as soon as the running byte count crosses the cap.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise HTTPException(status_code=415, detail="Expected multipart/form-data")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {max_bytes} bytes")
+
+    parser = MultiPartParser(request.headers, _limited_stream(request, max_bytes), max_files=1, max_fields=4)
+    try:
+        form = await parser.parse()
+    except MultiPartException as exc:
+        raise HTTPException(status_code=400, detail=exc.message)
+
+    session_id = form.get("session_id")
+    image = form.get("image")
+    if not isinstance(session_id, str) or not session_id:
+        await form.close()
+        raise HTTPException(status_code=422, detail="session_id is required")
+    if not isinstance(image, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=422, detail="image file is required")
+    if image.content_type and image.content_type not in ALLOWED_IMAGE_TYPES:
+        await form.close()
+        raise HTTPException(status_code=415, detail="Image must be JPEG, PNG or WEBP")
+    return session_id, image
+
@@ -2,12 +2,14 @@ import requests
 import sys
 import base64
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 class NudgeAPITester:
     def __init__(self, base_url="https://ebce61ab-0068-4c48-bf95-2c50be88844c.preview.emergentagent.com"):
         self.base_url = base_url
         self.session_id = None
+        self.image_ref = None
         self.tests_run = 0
         self.tests_passed = 0
         
@@ -51,13 +53,13 @@ class NudgeAPITester:
             self.log(f"❌ FAILED - {name} - Exception: {str(e)}")
             return False, {}
     
-    def create_test_image_base64(self):
+    def create_test_image_base64(self, color='red'):
         """Create a simple test image as base64"""
         # Create a minimal PNG image (1x1 pixel red dot)
         import io
         try:
             from PIL import Image
-            img = Image.new('RGB', (100, 100), color='red')
+            img = Image.new('RGB', (100, 100), color=color)
             buffer = io.BytesIO()
             img.save(buffer, format='JPEG')
             return base64.b64encode(buffer.getvalue()).decode('utf-8')
@@ -116,10 +118,35 @@ class NudgeAPITester:
             }
         )
         if success and response.get('analysis'):
+            self.image_ref = response.get('image_ref')
             self.log(f"   Analysis result: {response['analysis'].get('overview', 'No overview')[:50]}...")
             return True
         return False
     
+    def test_analyze_multi(self):
+        """Analyze two photos of the space at once and get one merged analysis"""
+        if not self.session_id:
+            self.log("❌ No session ID available for test")
+            return False
+
+        success, response = self.run_test(
+            "Analyze Space (Multiple Photos)",
+            "POST",
+            "api/analyze-space/multi",
+            200,
+            data={
+                "session_id": self.session_id,
+                "images": [
+                    {"image_base64": self.create_test_image_base64()},
+                    {"image_base64": self.create_test_image_base64('blue')}
+                ]
+            }
+        )
+        if success and response.get('analysis', {}).get('zones'):
+            self.log(f"   Merged into {len(response['analysis']['zones'])} zones")
+            return True
+        return False
+
     def test_generate_tasks(self):
         """Test task generation after analysis"""
         if not self.session_id:
@@ -166,6 +193,86 @@ class NudgeAPITester:
             data={"completed": True}
         )[0]
     
+    def test_parallel_task_toggles(self, repeats=4):
+        """Fire concurrent toggles for every task and check no update is lost"""
+        if not self.session_id:
+            self.log("❌ No session ID available for test")
+            return False
+
+        success, session_data = self.run_test(
+            "Get Session for Parallel Toggles",
+            "GET",
+            f"api/sessions/{self.session_id}",
+            200
+        )
+        if not success or not session_data.get('tasks'):
+            self.log("❌ No tasks available to toggle")
+            return False
+
+        task_ids = [t['task_id'] for t in session_data['tasks']]
+        url = f"{self.base_url}/api/sessions/{self.session_id}/tasks"
+
+        def toggle(task_id, completed):
+            return requests.put(f"{url}/{task_id}", json={"completed": completed}, timeout=30).status_code
+
+        self.tests_run += 1
+        self.log("Testing Parallel Task Toggles...")
+        for completed in (True, False, True):
+            with ThreadPoolExecutor(max_workers=len(task_ids) * repeats) as pool:
+                codes = list(pool.map(lambda tid: toggle(tid, completed), task_ids * repeats))
+            if any(code != 200 for code in codes):
+                self.log(f"❌ FAILED - Parallel Task Toggles - non-200 responses: {set(codes)}")
+                return False
+
+            state = requests.get(f"{self.base_url}/api/sessions/{self.session_id}", timeout=30).json()
+            actual = sum(1 for t in state['tasks'] if t['completed'])
+            expected = len(task_ids) if completed else 0
+            if actual != expected or state['completed_tasks'] != expected:
+                self.log(f"❌ FAILED - Parallel Task Toggles - expected {expected}, "
+                         f"tasks say {actual}, counter says {state['completed_tasks']}")
+                return False
+
+        if state['status'] != "completed":
+            self.log(f"❌ FAILED - Parallel Task Toggles - status is {state['status']}")
+            return False
+
+        self.tests_passed += 1
+        self.log(f"✅ PASSED - Parallel Task Toggles - {len(task_ids)} tasks x {repeats} concurrent taps")
+        return True
+
+    def test_conditional_get(self):
+        """Check ETag/If-None-Match and that a delta toggle moves the revision"""
+        if not self.session_id:
+            self.log("❌ No session ID available for test")
+            return False
+
+        url = f"{self.base_url}/api/sessions/{self.session_id}"
+        self.tests_run += 1
+        self.log("Testing Conditional Session GET...")
+        first = requests.get(url, timeout=30)
+        etag = first.headers.get('ETag')
+        if not etag:
+            self.log("❌ FAILED - Conditional Session GET - no ETag header")
+            return False
+        again = requests.get(url, headers={'If-None-Match': etag}, timeout=30)
+        if again.status_code != 304:
+            self.log(f"❌ FAILED - Conditional Session GET - expected 304, got {again.status_code}")
+            return False
+
+        task_id = first.json()['tasks'][0]['task_id']
+        delta = requests.put(f"{url}/tasks/{task_id}?delta=true", json={"completed": False}, timeout=30).json()
+        if 'tasks' in delta or delta.get('revision', 0) <= first.json()['revision']:
+            self.log(f"❌ FAILED - Conditional Session GET - unexpected delta {delta}")
+            return False
+        after = requests.get(url, headers={'If-None-Match': etag}, timeout=30)
+        if after.status_code != 200:
+            self.log(f"❌ FAILED - Conditional Session GET - stale ETag got {after.status_code}")
+            return False
+
+        self.tests_passed += 1
+        self.log("✅ PASSED - Conditional Session GET - 304 on match, 200 after a change")
+        return True
+
     def test_identify_items(self):
         """Test item identification with AI"""
         if not self.session_id:
@@ -189,6 +296,24 @@ class NudgeAPITester:
             return True
         return False
     
+    def test_identify_items_by_ref(self):
+        """Identify items on the photo stored by analyze, without re-uploading it"""
+        if not self.session_id or not self.image_ref:
+            self.log("❌ No session ID or image ref available for test")
+            return False
+
+        success, response = self.run_test(
+            "Identify Items by Ref",
+            "POST",
+            "api/identify-items",
+            200,
+            data={
+                "session_id": self.session_id,
+                "image_ref": self.image_ref
+            }
+        )
+        return success and bool(response.get('items')) and response.get('image_ref') == self.image_ref
+
     def test_sort_item(self):
         """Test sorting an item"""
         if not self.session_id:
@@ -216,6 +341,64 @@ class NudgeAPITester:
             data={"decision": "keep"}
         )[0]
 
+    def test_idempotent_generate(self):
+        """Retrying generate-tasks with the same Idempotency-Key replays the first result"""
+        if not self.session_id:
+            self.log("❌ No session ID available for test")
+            return False
+
+        url = f"{self.base_url}/api/generate-tasks"
+        headers = {'Idempotency-Key': f"test-{self.session_id}"}
+        self.tests_run += 1
+        self.log("Testing Idempotent Generate Tasks...")
+        first = requests.post(url, json={"session_id": self.session_id}, headers=headers, timeout=60)
+        retry = requests.post(url, json={"session_id": self.session_id}, headers=headers, timeout=60)
+        if first.status_code != 200 or retry.status_code != 200:
+            self.log(f"❌ FAILED - Idempotent Generate Tasks - got {first.status_code}/{retry.status_code}")
+            return False
+        if first.json()['revision'] != retry.json()['revision'] or first.json()['tasks'] != retry.json()['tasks']:
+            self.log("❌ FAILED - Idempotent Generate Tasks - the retry generated a new plan")
+            return False
+
+        self.tests_passed += 1
+        self.log("✅ PASSED - Idempotent Generate Tasks - retry replayed the first plan")
+        return True
+
+    def test_live_updates(self):
+        """A change made by another client reaches an open event stream as a delta"""
+        if not self.session_id:
+            self.log("❌ No session ID available for test")
+            return False
+
+        url = f"{self.base_url}/api/sessions/{self.session_id}/events"
+        self.tests_run += 1
+        self.log("Testing Live Session Updates...")
+        with requests.get(url, stream=True, timeout=30) as stream:
+            # Skip blank separators and ": keepalive" comments
+            lines = (line.decode() for line in stream.iter_lines() if line and not line.startswith(b":"))
+            if next(lines) != "event: snapshot":
+                self.log("❌ FAILED - Live Session Updates - stream did not start with a snapshot")
+                return False
+            snapshot = json.loads(next(lines)[len("data: "):])
+            if not snapshot.get('items'):
+                self.log("❌ No items available to sort")
+                return False
+            item_id = snapshot['items'][0]['item_id']
+            requests.put(f"{self.base_url}/api/sessions/{self.session_id}/items/{item_id}",
+                         json={"decision": "donate"}, timeout=30)
+            event = next(lines)
+            update = json.loads(next(lines)[len("data: "):])
+        if event != "event: update" or update.get('revision', 0) <= snapshot['revision']:
+            self.log(f"❌ FAILED - Live Session Updates - got {event} {update}")
+            return False
+        if {"item_id": item_id, "decision": "donate"} not in update.get('changed_items', []):
+            self.log(f"❌ FAILED - Live Session Updates - update lacks the sorted item: {update}")
+            return False
+
+        self.tests_passed += 1
+        self.log("✅ PASSED - Live Session Updates - sort pushed as a changed_items delta")
+        return True
+
 def main():
     """Run all tests"""
     tester = NudgeAPITester()
@@ -234,10 +417,16 @@ def main():
     
     # AI-powered tests (these might take longer)
     test_results['analyze_space'] = tester.test_analyze_space()
+    test_results['analyze_multi'] = tester.test_analyze_multi()
     test_results['generate_tasks'] = tester.test_generate_tasks()
     test_results['complete_task'] = tester.test_complete_task()
+    test_results['parallel_toggles'] = tester.test_parallel_task_toggles()
+    test_results['conditional_get'] = tester.test_conditional_get()
     test_results['identify_items'] = tester.test_identify_items()
+    test_results['identify_items_by_ref'] = tester.test_identify_items_by_ref()
     test_results['sort_item'] = tester.test_sort_item()
+    test_results['idempotent_generate'] = tester.test_idempotent_generate()
+    test_results['live_updates'] = tester.test_live_updates()
     
     # Results summary
     print("\n" + "=" * 60)